@@ -0,0 +1,128 @@
+#
+# State shared by the stand-ins for lcg_util, gfal and the BDII used by
+# bench/srmbench.py: call latencies and failures, the fake SE and the log
+# of the calls made.
+#
+# The behaviour of the calls is read from $BENCH_FAKES, JSON of the form
+#
+#   {"default": {"latency": 0.05, "fail": 0.01},
+#    "lcg_cp3": {"latency": 0.5, "tail": 0.05, "tailFactor": 10},
+#    "gfal_ls": {"hang": 0.001}}
+#
+# where, per call name or for all of them ("default"):
+#
+#   latency     median duration of a call, in seconds
+#   sigma       spread of the log-normal distribution of the durations
+#   tail        probability of a call from the slow tail ...
+#   tailFactor  ... taking this many times longer
+#   hang        probability of a call hanging ...
+#   hangTime    ... for this many seconds
+#   fail        probability of a call failing
+#
+# Files put on the fake SE are kept in $BENCH_SE, one per SURL. Every call
+# is appended to $BENCH_CALLLOG, one line each.
+#
+
+import os
+import time
+import errno
+import random
+import hashlib
+import zlib
+import simplejson
+
+defaults = {'latency'    : 0.05,
+            'sigma'      : 0.3,
+            'tail'       : 0.0,
+            'tailFactor' : 20,
+            'hang'       : 0.0,
+            'hangTime'   : 3600,
+            'fail'       : 0.0}
+
+_config = None
+_random = None
+_randomPid = None
+
+
+def config(name):
+    "Behaviour of the call name."
+    global _config
+    if _config is None:
+        _config = simplejson.loads(os.environ.get('BENCH_FAKES') or '{}')
+    cfg = dict(defaults)
+    cfg.update(_config.get('default', {}))
+    cfg.update(_config.get(name, {}))
+    return cfg
+
+
+def rand():
+    "Random generator of this process; the call workers are forked."
+    global _random, _randomPid
+    if _randomPid != os.getpid():
+        seed = os.environ.get('BENCH_SEED')
+        if seed is not None:
+            seed = '%s-%i' % (seed, os.getpid())
+        _random = random.Random(seed)
+        _randomPid = os.getpid()
+    return _random
+
+
+def log(name):
+    path = os.environ.get('BENCH_CALLLOG')
+    if not path:
+        return
+    fd = os.open(path, os.O_WRONLY|os.O_APPEND|os.O_CREAT, 0644)
+    try:
+        os.write(fd, name+'\n')
+    finally:
+        os.close(fd)
+
+
+def call(name):
+    """Take the time of one call of name; returns the error message of the
+    call if it is to fail, else None."""
+    log(name)
+    cfg = config(name)
+    r = rand()
+    if r.random() < cfg['hang']:
+        time.sleep(cfg['hangTime'])
+    delay = cfg['latency'] * r.lognormvariate(0, cfg['sigma'])
+    if r.random() < cfg['tail']:
+        delay *= cfg['tailFactor']
+    time.sleep(delay)
+    if r.random() < cfg['fail']:
+        return '[SE][%s][EIO] injected failure' % name
+    return None
+
+
+def se_path(surl):
+    "Local file holding the SURL on the fake SE."
+    directory = os.environ.get('BENCH_SE') or '/tmp/bench-se-%i' % os.getuid()
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+    return os.path.join(directory, hashlib.md5(surl).hexdigest())
+
+
+def is_file(surl):
+    "Test files have an extension, the endpoint directories not."
+    return '.' in surl.rstrip('/').split('/')[-1]
+
+
+def local_path(url):
+    if url.startswith('file://'):
+        return url[7:]
+    if url.startswith('file:'):
+        return url[5:]
+    return url
+
+
+def adler32(path):
+    fp = open(path, 'rb')
+    try:
+        return '%08x' % (zlib.adler32(fp.read()) & 0xffffffffL)
+    finally:
+        fp.close()
@@ -0,0 +1,63 @@
+#
+# Stand-in for the gfal Python bindings, for bench/srmbench.py: the calls
+# take the time and fail as configured in $BENCH_FAKES and answer from the
+# fake SE, see benchfakes.
+#
+
+import os
+import stat
+import errno
+
+import benchfakes
+
+
+def gfal_init(req):
+    return (0, {'req' : req, 'results' : []}, '')
+
+
+def gfal_ls(gfalobj):
+    error = benchfakes.call('gfal_ls')
+    if error:
+        return (-1, gfalobj, error)
+    results = []
+    for surl in gfalobj['req']['surls']:
+        path = benchfakes.se_path(surl)
+        if not benchfakes.is_file(surl):
+            results.append({'surl' : surl, 'status' : 0, 'explanation' : '',
+                            'stat' : (stat.S_IFDIR|0755, 0, 0, 1, 0, 0, 512,
+                                      0, 0, 0)})
+        elif os.path.exists(path):
+            st = os.stat(path)
+            results.append({'surl' : surl, 'status' : 0, 'explanation' : '',
+                            'stat' : tuple(st),
+                            'checksumtype' : 'ADLER32',
+                            'checksum' : benchfakes.adler32(path)})
+        else:
+            results.append({'surl' : surl, 'status' : errno.ENOENT,
+                            'explanation' : 'No such file or directory'})
+    gfalobj['results'] = results
+    return (0, gfalobj, '')
+
+
+def gfal_deletesurls(gfalobj):
+    error = benchfakes.call('gfal_deletesurls')
+    if error:
+        return (-1, gfalobj, error)
+    results = []
+    for surl in gfalobj['req']['surls']:
+        try:
+            os.remove(benchfakes.se_path(surl))
+            results.append({'surl' : surl, 'status' : 0, 'explanation' : ''})
+        except OSError:
+            results.append({'surl' : surl, 'status' : errno.ENOENT,
+                            'explanation' : 'No such file or directory'})
+    gfalobj['results'] = results
+    return (0, gfalobj, '')
+
+
+def gfal_get_results(gfalobj):
+    return (0, gfalobj, gfalobj['results'])
+
+
+def gfal_internal_free(gfalobj):
+    pass
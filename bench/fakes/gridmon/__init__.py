@@ -0,0 +1,5 @@
+#
+# Stand-in for the gridmon package, for bench/srmbench.py: the parts of
+# gridmon.probe, gridmon.utils and gridmon.gridutils srmvometrics.py uses,
+# so that the benchmark runs where gridmon is not installed.
+#
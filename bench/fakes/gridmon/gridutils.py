@@ -0,0 +1,29 @@
+#
+# Stand-in for gridmon.gridutils, see __init__.py: the BDII publishes the
+# SRM service of the fake SE with $BENCH_ENDPOINTS storage paths.
+#
+
+import os
+
+import benchfakes
+
+
+def query_bdii(ldap_filter, ldap_attrlist, ldap_url='', ldap_timelimit=None):
+    "The SRM service, storage paths and access protocols of the fake SE."
+    host = os.environ.get('BENCH_HOST', 'srm.bench.example.org')
+    endpoints = int(os.environ.get('BENCH_ENDPOINTS', '1'))
+    error = benchfakes.call('query_bdii')
+    if error:
+        return 0, (1, 'BDII query failed', error)
+    if 'GlueSEAccessProtocolType' in ldap_attrlist:
+        return 1, [('GlueSEAccessProtocolLocalID=%s,GlueSEUniqueID=%s,o=grid' %
+                    (proto, host), {'GlueSEAccessProtocolType' : [proto]})
+                   for proto in ('gsiftp', 'dcap')]
+    return 1, [('GlueServiceUniqueID=httpg://%s,o=grid' % host,
+                {'GlueServiceEndpoint' : ['httpg://%s:8443/srm/managerv2' % host],
+                 'GlueVOInfoPath'      : ['/bench/ep%03i' % i
+                                          for i in range(endpoints)]})]
+
+
+def get_lcg_util_gfal_ver():
+    return 'lcg_util-bench gfal-bench'
@@ -0,0 +1,137 @@
+#
+# Stand-in for gridmon.probe, see __init__.py: a MetricGatherer taking its
+# options from the metric descriptions, and a Runner running one metric
+# (or sequence) given with -m and exiting with its Nagios code. The
+# metrics work in $BENCH_WORKDIR.
+#
+
+import os
+import sys
+import time
+import getopt
+import tempfile
+
+import utils
+
+
+class ErrorsMatching:
+    "The error DB of the bench is empty: no message matches."
+
+    def __init__(self, errdb, topics):
+        self.errdb = errdb
+        self.topics = topics
+
+    def match(self, errmsg):
+        return []
+
+
+class MetricGatherer(object):
+
+    ns = 'org.sam'
+
+    def __init__(self, tuples, serviceType):
+        self.serviceType = serviceType
+        self.hostName = tuples.get('serviceURI', '')
+        self.voName = tuples.get('voName', 'ops')
+        self.verbosity = int(tuples.get('verbosity', 0))
+        self.errorDBFile = ''
+        self.errorTopics = []
+        self.workdir_metric = None
+
+    def set_metrics(self, metrics):
+        self._metrics = metrics
+
+    def parse_cmd_args(self, tuples, cmdopts=None, func=None):
+        "getopt the metric options in tuples['args'], then func(opts)."
+        longopts = list(cmdopts or [])
+        for desc in self._metrics.values():
+            for opt in desc.get('cmdLineOptions', []):
+                if opt not in longopts:
+                    longopts.append(opt)
+        opts = getopt.getopt(tuples.get('args', []), '', longopts)[0]
+        (func or self.parse_args)(opts)
+
+    def parse_args(self, opts):
+        pass
+
+    def make_workdir(self):
+        self.workdir_metric = os.environ.get('BENCH_WORKDIR') or \
+                              tempfile.mkdtemp(prefix='bench-')
+        if not os.path.isdir(self.workdir_metric):
+            os.makedirs(self.workdir_metric)
+
+    def printd(self, msg, v=1, cr=True):
+        if v <= self.verbosity:
+            sys.stdout.write(str(msg) + (cr and '\n' or ''))
+
+    def print_time(self):
+        self.printd(time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+    def metricAll(self, name='All'):
+        """Run the metrics of sequence name; returns the worst result, each
+        one is written as it comes."""
+        worst = ('OK', 'All metrics passed.')
+        for metric in self._metrics[name]['metricsOrder']:
+            result = getattr(self, 'metric' + metric)()
+            sys.stdout.write('%s.%s-%s %s' % (self.ns, self.serviceType, metric,
+                                              ProbeFormatRenderer().render(result)))
+            if utils.to_retcode(result[0]) > utils.to_retcode(worst[0]):
+                worst = (result[0], '%s: %s' % (metric, result[1]))
+        return worst
+
+
+class ProbeFormatRenderer:
+
+    def render(self, result):
+        "STATUS: summary, one line."
+        if not isinstance(result, tuple) or len(result) < 2:
+            return 'UNKNOWN: no result\n'
+        return '%s: %s\n' % (result[0], result[1])
+
+
+class Runner:
+    """Run the metric given with -m on the host given with -H (or -u); the
+    other arguments are the metric options."""
+
+    def __init__(self, gatherer, renderer):
+        self.gatherer = gatherer
+        self.renderer = renderer
+
+    def run(self, argv):
+        tuples = {}
+        metric = None
+        args = []
+        argv = list(argv[1:])
+        while argv:
+            arg = argv.pop(0)
+            if arg in ('-H', '--hostname', '-u', '--uri', '-m', '--metric',
+                       '-v', '--verbosity', '--vo') and not argv:
+                return self.fail('%s requires an argument' % arg)
+            if arg in ('-H', '--hostname', '-u', '--uri'):
+                tuples['serviceURI'] = utils.parse_uri(argv.pop(0))[0]
+            elif arg in ('-m', '--metric'):
+                metric = argv.pop(0).split('-', 1)[-1]
+            elif arg in ('-v', '--verbosity'):
+                tuples['verbosity'] = argv.pop(0)
+            elif arg == '--vo':
+                tuples['voName'] = argv.pop(0)
+            else:
+                args.append(arg)
+        if not metric or not tuples.has_key('serviceURI'):
+            return self.fail('-m <metric> and -H <host> are required')
+        tuples['args'] = args
+        try:
+            gatherer = self.gatherer(tuples)
+        except getopt.GetoptError, e:
+            return self.fail(str(e))
+        if not hasattr(gatherer, 'metric' + metric):
+            return self.fail('unknown metric %s' % metric)
+        result = getattr(gatherer, 'metric' + metric)()
+        sys.stdout.write(self.renderer.render(result))
+        if not isinstance(result, tuple) or not result:
+            return 3
+        return utils.to_retcode(result[0])
+
+    def fail(self, msg):
+        sys.stdout.write('UNKNOWN: %s\n' % msg)
+        return 3
@@ -0,0 +1,28 @@
+#
+# Stand-in for gridmon.utils, see __init__.py.
+#
+
+import uuid
+
+retcodes = {'OK'       : 0,
+            'WARNING'  : 1,
+            'CRITICAL' : 2,
+            'UNKNOWN'  : 3}
+
+
+def uuidstr():
+    return str(uuid.uuid4())
+
+
+def to_retcode(status):
+    "Nagios exit code of status."
+    return retcodes.get(status, 3)
+
+
+def parse_uri(uri):
+    "[host, port] of [scheme://]host[:port[/]]; port is '' if not given."
+    hostport = uri.split('://')[-1].split('/')[0]
+    if ':' in hostport:
+        host, port = hostport.split(':', 1)
+        return [host, port]
+    return [hostport, '']
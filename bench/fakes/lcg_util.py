@@ -0,0 +1,60 @@
+#
+# Stand-in for the lcg_util Python bindings, for bench/srmbench.py: the
+# calls take the time and fail as configured in $BENCH_FAKES and keep the
+# files on a fake SE, see benchfakes.
+#
+
+import os
+import shutil
+
+import benchfakes
+
+_noFile = '[SE][%s][SRM_INVALID_PATH] No such file or directory'
+
+
+def lcg_cp3(src_file, dest_file, *args):
+    error = benchfakes.call('lcg_cp3')
+    if error:
+        return (-1, error)
+    if src_file.startswith('srm:'):
+        src = benchfakes.se_path(src_file)
+        if not os.path.exists(src):
+            return (-1, _noFile % 'Get')
+    else:
+        src = benchfakes.local_path(src_file)
+    if dest_file.startswith('srm:'):
+        dest = benchfakes.se_path(dest_file)
+    else:
+        dest = benchfakes.local_path(dest_file)
+    shutil.copyfile(src, dest)
+    return (0, '')
+
+
+def lcg_del4(src_file, *args):
+    error = benchfakes.call('lcg_del4')
+    if error:
+        return (-1, error)
+    try:
+        os.remove(benchfakes.se_path(src_file))
+    except OSError:
+        return (-1, _noFile % 'Del')
+    return (0, '')
+
+
+def lcg_gt3(src_file, defaulttype, setype, nobdii, protocols, *args):
+    error = benchfakes.call('lcg_gt3')
+    if error:
+        return (-1, '', 0, 0, '', error)
+    if not os.path.exists(benchfakes.se_path(src_file)):
+        return (-1, '', 0, 0, '', _noFile % 'PrepareToGet')
+    hostport, sfn = src_file.split('://', 1)[-1].split('?SFN=', 1)
+    turl = '%s://%s%s' % ((protocols or ['gsiftp'])[0],
+                          hostport.split('/')[0], sfn)
+    return (0, turl, 1, 1, 'bench-token', '')
+
+
+def lcg_sd3(src_file, *args):
+    error = benchfakes.call('lcg_sd3')
+    if error:
+        return (-1, error)
+    return (0, '')
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+#
+# Run a probe with the stand-ins of bench/srmbench.py: lcg_util, gfal and
+# gridmon from this directory, and the PhEDEx DataService answered
+# locally. No grid proxy, network nor gridmon installation is needed.
+#
+# usage: runprobe.py <probe path> <probe arguments>
+#
+# Environment (set by srmbench.py):
+#
+#   BENCH_WORKDIR    working directory of the metrics
+#   BENCH_HOST       the SE host tested
+#   BENCH_ENDPOINTS  number of storage paths the BDII publishes for it
+#   BENCH_FAKES ...  see benchfakes
+#
+
+import os
+import sys
+import imp
+import StringIO
+import urllib2
+import simplejson
+
+import benchfakes
+
+host = os.environ.get('BENCH_HOST', 'srm.bench.example.org')
+
+
+def endpoint(i):
+    "The SURL of storage path i of the fake SE."
+    return 'srm://%s:8443/srm/managerv2?SFN=/bench/ep%03i' % (host, i)
+
+
+def urlopen(url, *args):
+    "The SE list and the lfn2pfn mapping of the PhEDEx DataService."
+    error = benchfakes.call('urlopen')
+    if error:
+        raise urllib2.URLError(error)
+    if 'lfn2pfn' in url:
+        return StringIO.StringIO(simplejson.dumps(
+            {'phedex' : {'mapping' : [{'pfn'         : endpoint(0),
+                                       'space_token' : 'BENCH000'}]}}))
+    return StringIO.StringIO('%s T2_XX_Bench\n' % host)
+
+
+def main(argv):
+    path = os.path.abspath(argv[1])
+    sys.path.insert(1, os.path.dirname(path))
+
+    urllib2.urlopen = urlopen
+
+    # the probe runs as __main__, as it would on its own: the call workers
+    # unpickle its classes from there
+    module = imp.new_module('__main__')
+    module.__file__ = path
+    module.__runprobe__ = sys.modules['__main__']
+    sys.modules['__main__'] = module
+    sys.argv = [path] + argv[2:]
+    execfile(path, module.__dict__)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+#
+# Wall time, SRM call rate and memory of the metric sequences of
+# srmvometrics.py against a fake SE, for comparing revisions. Runs
+# without grid proxy, SE, network nor gridmon: lcg_util, gfal, gridmon,
+# the BDII and the PhEDEx DataService are stand-ins (bench/fakes), whose
+# latencies and failures are configurable.
+#
+# usage: srmbench.py [-s <sequences>] [-e <endpoints>] [-n <runs>]
+#                    [-f <fakes>] [-r <git revision>] [-- <probe args>]
+#
+#   -s  comma separated metric sequences (default AllLHCb,All,AllCMS)
+#   -e  comma separated numbers of endpoints of the SE (default 1,10,100)
+#   -n  number of runs of each (default 3); the median and maximum wall
+#       time, the SRM calls per second of the median run and the maximum
+#       RSS over all runs are reported
+#   -f  JSON file with the behaviour of the stand-ins, see
+#       bench/fakes/benchfakes.py (default: every call takes ~50 ms and
+#       succeeds)
+#   -r  take the probe directory from this git revision instead of the
+#       working tree (exported with git archive into a temporary directory)
+#
+# The probe arguments are added to those running the sequence on the fake
+# SE (-H <host> -m org.lhcb.SRM-<sequence>).
+# Example, slow tail and hangs, before and after:
+#
+#   echo '{"lcg_cp3": {"tail": 0.05, "hang": 0.01, "hangTime": 600}}' > tail.json
+#   bench/srmbench.py -f tail.json -r HEAD~1 -- --endpoint-concurrency 10
+#   bench/srmbench.py -f tail.json -- --endpoint-concurrency 10
+#
+
+import os
+import sys
+import time
+import getopt
+import shutil
+import pickle
+import tempfile
+
+from startup import export, probedir, topdir
+
+fakesdir = os.path.join(topdir, 'bench', 'fakes')
+host = 'srm.bench.example.org'
+ns = 'org.lhcb'
+
+# sequences whose endpoints come from a ToA list, and from PhEDEx
+toaSequences = ('AllLHCb', 'AllATLAS')
+phedexSequences = ('AllCMS',)
+
+
+def endpoint(i):
+    "The SURL of storage path i of the fake SE, as in fakes/runprobe.py."
+    return 'srm://%s:8443/srm/managerv2?SFN=/bench/ep%03i' % (host, i)
+
+
+def prepare(tmp, sequence, endpoints):
+    """Lay out the working directory of a run in tmp; returns the probe
+    arguments it needs."""
+    workdir = os.path.join(tmp, 'work')
+    os.makedirs(workdir)
+    if sequence in toaSequences:
+        toa = os.path.join(tmp, 'ToA_srm2_list')
+        fp = open(toa, 'w')
+        try:
+            for i in range(endpoints):
+                fp.write('%s BENCH%03i\n' % (endpoint(i), i))
+        finally:
+            fp.close()
+        return ['--file', toa]
+    if sequence in phedexSequences:
+        # PhEDEx maps to a single endpoint; the others are known from
+        # earlier runs, as the VO info dictionary of older versions
+        info = {}
+        for i in range(endpoints):
+            info[endpoint(i)] = {'fn'          : 'testfile-put-BENCH%03i-%i-%s.txt' %
+                                                 (i, int(time.time()), 'bench'),
+                                 'space_token' : 'BENCH%03i' % i,
+                                 'criticality' : i % 2}
+        fp = open(os.path.join(workdir, 'VOInfoDictionary'), 'w')
+        try:
+            pickle.dump(info, fp)
+        finally:
+            fp.close()
+    return []
+
+
+def run(path, sequence, endpoints, fakes, args):
+    """Run the sequence once; returns (wall seconds, SRM calls, max RSS in kB
+    of the probe and its call workers, exit code)."""
+    tmp = tempfile.mkdtemp(prefix='srmbench-')
+    try:
+        argv = [sys.executable, os.path.join(fakesdir, 'runprobe.py'), path,
+                '-H', host, '-m', '%s.SRM-%s' % (ns, sequence)] + \
+               prepare(tmp, sequence, endpoints) + args
+        env = dict(os.environ)
+        env.update({'BENCH_WORKDIR'   : os.path.join(tmp, 'work'),
+                    'BENCH_SE'        : os.path.join(tmp, 'se'),
+                    'BENCH_CALLLOG'   : os.path.join(tmp, 'calls'),
+                    'BENCH_HOST'      : host,
+                    'BENCH_ENDPOINTS' : str(endpoints),
+                    'BENCH_FAKES'     : fakes,
+                    'SRM_SE_LIMIT_DIR': os.path.join(tmp, 'limits')})
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        start = time.time()
+        pid = os.fork()
+        if pid == 0:
+            os.dup2(devnull, 1)
+            os.dup2(devnull, 2)
+            try:
+                os.execve(sys.executable, argv, env)
+            finally:
+                os._exit(127)
+        os.close(devnull)
+        status, rusage = os.wait4(pid, 0)[1:]
+        wall = time.time() - start
+        calls = 0
+        if os.path.exists(env['BENCH_CALLLOG']):
+            fp = open(env['BENCH_CALLLOG'])
+            try:
+                calls = len(fp.readlines())
+            finally:
+                fp.close()
+        return wall, calls, rusage.ru_maxrss, os.WEXITSTATUS(status)
+    finally:
+        shutil.rmtree(tmp)
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv[1:], 's:e:n:f:r:')
+    except getopt.GetoptError, e:
+        sys.stderr.write('%s\n' % e)
+        return 2
+    sequences = ['AllLHCb', 'All', 'AllCMS']
+    counts = [1, 10, 100]
+    runs = 3
+    fakes = '{}'
+    rev = None
+    for o, v in opts:
+        if o in ('-s'):
+            sequences = v.split(',')
+        elif o in ('-e'):
+            counts = [int(x) for x in v.split(',')]
+        elif o in ('-n'):
+            runs = int(v)
+        elif o in ('-f'):
+            fp = open(v)
+            try:
+                fakes = fp.read()
+            finally:
+                fp.close()
+        elif o in ('-r'):
+            rev = v
+
+    tmp = None
+    if rev:
+        tmp = export(rev)
+        path = os.path.join(tmp, probedir, 'srmvometrics.py')
+    else:
+        path = os.path.join(topdir, probedir, 'srmvometrics.py')
+
+    print 'srmvometrics.py %s (%s), %i run(s) each' % \
+          (' '.join(args), rev or 'working tree', runs)
+    print '%-10s %9s %10s %10s %7s %8s %10s  %s' % \
+          ('sequence', 'endpoints', 'wall med', 'wall max', 'calls',
+           'calls/s', 'max RSS', 'exit codes')
+    try:
+        for sequence in sequences:
+            for endpoints in counts:
+                results = [run(path, sequence, endpoints, fakes, args)
+                           for i in range(runs)]
+                results.sort()
+                median = results[len(results)/2]
+                print '%-10s %9i %8.3f s %8.3f s %7i %8.1f %7i kB  %s' % \
+                      (sequence, endpoints, median[0], results[-1][0],
+                       median[1], median[1]/median[0],
+                       max([r[2] for r in results]),
+                       ','.join([str(c) for c in
+                                 sorted(set([r[3] for r in results]))]))
+                sys.stdout.flush()
+    finally:
+        if tmp:
+            shutil.rmtree(tmp)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
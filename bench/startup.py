@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+#
+# Start-up time and memory of a probe run, for comparing revisions.
+#
+# usage: startup.py [-n <runs>] [-r <git revision>] [-p <probe>]
+#                   [-e <name>=<value> ...] [-- <probe args>]
+#
+#   -n  number of runs (default 20); the median and maximum wall time and
+#       the maximum RSS over all runs are reported
+#   -r  take the probe directory from this git revision instead of the
+#       working tree (exported with git archive into a temporary directory)
+#   -p  probe, relative to the org.lhcb probes directory
+#       (default srmvometrics.py)
+#   -e  set this environment variable for the probe runs; may be repeated
+#
+# The probe arguments default to --help, which loads the probe and its
+# modules without contacting any service. Example, before and after:
+#
+#   bench/startup.py -r HEAD~1 -- GetLHCbInfo -H srm.example.org
+#   bench/startup.py -- GetLHCbInfo -H srm.example.org
+#
+# Cold start of the SRM-probe with and without the DIRAC configuration
+# snapshot (the first run with it writes the snapshot):
+#
+#   bench/startup.py -p SRM-probe
+#   bench/startup.py -p SRM-probe -e SRM_PROBE_CS_SNAPSHOT=/tmp/cs.cfg
+#
+
+import os
+import sys
+import time
+import getopt
+import shutil
+import tempfile
+import subprocess
+
+probedir = 'usr/libexec/grid-monitoring/probes/org.lhcb'
+topdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def export(rev):
+    "Export the probes directory of git revision rev; returns its path."
+    tmp = tempfile.mkdtemp(prefix='startup-')
+    git = subprocess.Popen(['git', 'archive', rev, probedir], cwd=topdir,
+                           stdout=subprocess.PIPE)
+    tar = subprocess.Popen(['tar', '-x', '-C', tmp], stdin=git.stdout)
+    git.stdout.close()
+    if tar.wait() or git.wait():
+        shutil.rmtree(tmp)
+        raise SystemExit('cannot export %s from %s' % (probedir, rev))
+    return tmp
+
+
+def run(path, args, env=None):
+    "Run the probe once; returns (wall seconds, max RSS in kB, exit code)."
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    start = time.time()
+    pid = os.fork()
+    if pid == 0:
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        try:
+            os.execve(sys.executable, [sys.executable, path] + args,
+                      env or os.environ)
+        finally:
+            os._exit(127)
+    os.close(devnull)
+    status, rusage = os.wait4(pid, 0)[1:]
+    return time.time() - start, rusage.ru_maxrss, os.WEXITSTATUS(status)
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv[1:], 'n:r:p:e:')
+    except getopt.GetoptError, e:
+        sys.stderr.write('%s\n' % e)
+        return 2
+    runs = 20
+    rev = None
+    name = 'srmvometrics.py'
+    env = dict(os.environ)
+    for o, v in opts:
+        if o in ('-n'):
+            runs = int(v)
+        elif o in ('-r'):
+            rev = v
+        elif o in ('-p'):
+            name = v
+        elif o in ('-e'):
+            k, v = v.split('=', 1)
+            env[k] = v
+    args = args or ['--help']
+
+    tmp = None
+    if rev:
+        tmp = export(rev)
+        path = os.path.join(tmp, probedir, name)
+    else:
+        path = os.path.join(topdir, probedir, name)
+    try:
+        results = [run(path, args, env) for i in range(runs)]
+    finally:
+        if tmp:
+            shutil.rmtree(tmp)
+
+    walls = sorted([r[0] for r in results])
+    print '%s %s (%s), %i runs, exit code(s) %s' % \
+          (name, ' '.join(args), rev or 'working tree', runs,
+           ','.join([str(c) for c in sorted(set([r[2] for r in results]))]))
+    print 'wall: median %.3f s, max %.3f s' % (walls[len(walls)/2], walls[-1])
+    print 'rss:  max %i kB' % max([r[1] for r in results])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
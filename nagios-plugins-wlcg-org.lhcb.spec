@@ -36,6 +36,12 @@ install --directory %{buildroot}%{dir2}
 %{__cp} -rpf .%dir/SRM-probe  %{buildroot}%{dir}
 %{__cp} -rpf .%dir/LFC-probe  %{buildroot}%{dir}
 %{__cp} -rpf .%dir/srmvometrics.py  %{buildroot}%{dir}
+%{__cp} -rpf .%dir/srmvometrics-client  %{buildroot}%{dir}
+%{__cp} -rpf .%dir/probeworker.py  %{buildroot}%{dir}
+%{__cp} -rpf .%dir/srmvoproviders  %{buildroot}%{dir}
+%{__cp} -rpf .%dir/srmratelimit.py  %{buildroot}%{dir}
+%{__cp} -rpf .%dir/cssnapshot.py  %{buildroot}%{dir}
+%{__cp} -rpf .%dir/endpointpool.py  %{buildroot}%{dir}
 %{__cp} -rpf .%dir2/lhcb_vofeed.py %{buildroot}%{dir2}
 %{__cp} -rpf .%dir2/lhcb_webdav.py %{buildroot}%{dir2}
 
@@ -50,6 +56,20 @@ install --directory %{buildroot}%{dir2}
 %{dir}/srmvometrics.py
 %{dir}/srmvometrics.pyc
 %{dir}/srmvometrics.pyo
+%{dir}/srmvometrics-client
+%{dir}/probeworker.py
+%{dir}/probeworker.pyc
+%{dir}/probeworker.pyo
+%{dir}/srmratelimit.py
+%{dir}/srmratelimit.pyc
+%{dir}/srmratelimit.pyo
+%{dir}/cssnapshot.py
+%{dir}/cssnapshot.pyc
+%{dir}/cssnapshot.pyo
+%{dir}/endpointpool.py
+%{dir}/endpointpool.pyc
+%{dir}/endpointpool.pyo
+%{dir}/srmvoproviders
 %{dir2}/lhcb_vofeed.py
 %{dir2}/lhcb_vofeed.pyc
 %{dir2}/lhcb_vofeed.pyo
@@ -0,0 +1,153 @@
+##############################################################################
+#
+# NAME:        cssnapshot.py
+#
+# FACILITY:    SAM (Service Availability Monitoring)
+#
+# COPYRIGHT:
+#         Copyright (c) 2009, Members of the EGEE Collaboration.
+#         http://www.eu-egee.org/partners/
+#         Licensed under the Apache License, Version 2.0.
+#         http://www.apache.org/licenses/LICENSE-2.0
+#         This software is provided "as is", without warranties
+#         or conditions of any kind, either express or implied.
+#
+# DESCRIPTION:
+#
+#         Local snapshot of the parts of the DIRAC configuration the
+#         SRM-probe needs, so that a run does not have to load the whole
+#         configuration from the Configuration Service first.
+#
+# NOTES:
+#
+#         Opt-in: the snapshot is used when $SRM_PROBE_CS_SNAPSHOT names
+#         its file. It holds the sections listed in 'sections' (the setup,
+#         and the storage elements StorageFactory.getStorages() resolves)
+#         and is taken as stale after $SRM_PROBE_CS_MAX_AGE seconds
+#         (default 6 hours).
+#
+#         A run finding the snapshot missing or stale initialises DIRAC
+#         from the Configuration Service as before, and rewrites the
+#         snapshot from it. It can also be refreshed from cron:
+#
+#             SRM_PROBE_CS_SNAPSHOT=<file> cssnapshot.py
+#
+##############################################################################
+
+"""
+Local snapshot of the DIRAC configuration sections used by the SRM-probe.
+
+    if not cssnapshot.load():
+        initialize(enableCommandLine=False)
+        cssnapshot.save()
+"""
+
+import os
+import sys
+import time
+
+# sections of the configuration kept in the snapshot
+sections = ['/DIRAC',
+            '/Resources/StorageElements',
+            '/Resources/StorageElementBases']
+
+maxAge = 6 * 3600
+
+
+def snapshot_path():
+    "File of the snapshot, None when the snapshot is not used."
+    return os.environ.get('SRM_PROBE_CS_SNAPSHOT') or None
+
+
+def snapshot_max_age():
+    try:
+        return int(os.environ.get('SRM_PROBE_CS_MAX_AGE', maxAge))
+    except ValueError:
+        return maxAge
+
+
+def _cfg():
+    try:
+        from diraccfg import CFG
+    except ImportError:
+        from DIRAC.Core.Utilities.CFG import CFG
+    return CFG()
+
+
+def load(path=None):
+    """Load the DIRAC configuration from the snapshot, and keep DIRAC from
+    contacting the Configuration Service for it. Returns False, having
+    loaded nothing, when the snapshot is not used, missing or stale."""
+    path = path or snapshot_path()
+    if not path:
+        return False
+    try:
+        if time.time() - os.stat(path).st_mtime > snapshot_max_age():
+            return False
+    except OSError:
+        return False
+    try:
+        from DIRAC.ConfigurationSystem.Client.ConfigurationData import gConfigurationData
+        from DIRAC.ConfigurationSystem.private.Refresher import gRefresher
+        cfg = _cfg()
+        cfg.loadFromFile(path)
+    except Exception:
+        return False
+    gConfigurationData.mergeWithLocal(cfg)
+    gRefresher.disable()
+    return True
+
+
+def save(path=None):
+    """Write the snapshot from the configuration DIRAC has loaded; returns
+    False when the snapshot is not used."""
+    path = path or snapshot_path()
+    if not path:
+        return False
+    from DIRAC.ConfigurationSystem.Client.ConfigurationData import gConfigurationData
+    merged = gConfigurationData.mergedCFG
+    cfg = _cfg()
+    for section in sections:
+        found = merged.getRecursive(section)
+        if not found:
+            continue
+        names = section.strip('/').split('/')
+        parent = cfg
+        for name in names[:-1]:
+            if not parent.isSection(name):
+                parent.createNewSection(name)
+            parent = parent[name]
+        parent.createNewSection(names[-1], contents=found['value'])
+
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    # written aside and renamed, the probes running meanwhile read either
+    # the old snapshot or the new one
+    tmp = '%s.%i' % (path, os.getpid())
+    try:
+        cfg.writeToFile(tmp)
+        os.rename(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return True
+
+
+def main(argv):
+    path = (argv[1:] or [snapshot_path()])[0]
+    if not path:
+        sys.stderr.write('usage: %s <snapshot file>\n' % argv[0])
+        return 2
+    from DIRAC.Core.Base.Script import initialize
+    initialize(enableCommandLine=False)
+    try:
+        save(path)
+    except (IOError, OSError), e:
+        sys.stderr.write('Cannot write %s: %s\n' % (path, str(e)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
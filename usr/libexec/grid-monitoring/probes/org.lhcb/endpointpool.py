@@ -0,0 +1,117 @@
+##############################################################################
+#
+# NAME:        endpointpool.py
+#
+# FACILITY:    SAM (Service Availability Monitoring)
+#
+# COPYRIGHT:
+#         Copyright (c) 2009, Members of the EGEE Collaboration.
+#         http://www.eu-egee.org/partners/
+#         Licensed under the Apache License, Version 2.0.
+#         http://www.apache.org/licenses/LICENSE-2.0
+#         This software is provided "as is", without warranties
+#         or conditions of any kind, either express or implied.
+#
+# DESCRIPTION:
+#
+#         Thread pool testing the endpoints (or space tokens) of a storage
+#         element concurrently, each within its own time limit. Used by
+#         srmvometrics.py and SRM-probe.
+#
+##############################################################################
+
+"""
+Bounded pool of worker threads for per-endpoint SRM operations.
+
+    pool = EndpointPool(10, 120)
+    pool.run(func, endpoints)
+    pool.results, pool.errors, pool.timedout
+"""
+
+import time
+import threading
+import Queue
+
+
+class EndpointPool:
+    """Bounded pool of worker threads for per-endpoint SRM operations.
+
+    Each task gets its own deadline, counted from the moment a worker
+    picks it up. The SRM calls run in the C bindings and cannot be
+    interrupted, so a task running past its deadline is abandoned and
+    recorded in 'timedout'; a new worker replaces the stuck one so the
+    remaining endpoints are still served.
+    """
+
+    def __init__(self, size, timeout):
+        self.size = max(1, int(size))
+        self.timeout = timeout
+
+    def run(self, func, keys):
+        """Call func(key) for every key with at most 'size' in flight.
+
+        Fills 'results' (key -> return value), 'errors' (key -> exception)
+        and 'timedout' (list of keys).
+        """
+        self.results = {}
+        self.errors = {}
+        self.timedout = []
+        self._tasks = Queue.Queue()
+        self._running = {}
+        self._cond = threading.Condition()
+        for key in keys:
+            self._tasks.put(key)
+
+        for i in range(min(self.size, len(keys))):
+            self._spawn(func)
+
+        self._cond.acquire()
+        try:
+            while len(self.results) + len(self.errors) + \
+                    len(self.timedout) < len(keys):
+                now = time.time()
+                wait = 1.0
+                for key, started in self._running.items():
+                    left = started + self.timeout - now
+                    if left <= 0:
+                        del self._running[key]
+                        self.timedout.append(key)
+                        self._spawn(func)
+                    elif left < wait:
+                        wait = left
+                self._cond.wait(wait)
+        finally:
+            self._cond.release()
+
+    def _spawn(self, func):
+        t = threading.Thread(target=self._worker, args=(func,))
+        t.setDaemon(True)
+        t.start()
+
+    def _worker(self, func):
+        while True:
+            try:
+                key = self._tasks.get_nowait()
+            except Queue.Empty:
+                return
+            self._cond.acquire()
+            self._running[key] = time.time()
+            self._cond.release()
+            res = err = None
+            try:
+                res = func(key)
+            except Exception, e:
+                err = e
+            self._cond.acquire()
+            try:
+                if not self._running.has_key(key):
+                    # abandoned after its deadline; a replacement took over
+                    return
+                del self._running[key]
+                if err is None:
+                    self.results[key] = res
+                else:
+                    self.errors[key] = err
+                self._cond.notify()
+            finally:
+                self._cond.release()
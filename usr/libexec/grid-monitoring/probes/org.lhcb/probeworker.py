@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+
+##############################################################################
+#
+# NAME:        probeworker.py
+#
+# FACILITY:    SAM (Service Availability Monitoring)
+#
+# COPYRIGHT:
+#         Copyright (c) 2009, Members of the EGEE Collaboration.
+#         http://www.eu-egee.org/partners/
+#         Licensed under the Apache License, Version 2.0.
+#         http://www.apache.org/licenses/LICENSE-2.0
+#         This software is provided "as is", without warranties
+#         or conditions of any kind, either express or implied.
+#
+# DESCRIPTION:
+#
+#         Resident worker for the org.lhcb SRM/LFC probes.
+#
+# NOTES:
+#
+#         probeworker.py --serve <probe> [--socket <path>] [--concurrency <n>]
+#                        [--timeout <sec>] [--max-rss <MB>] [--max-requests <n>]
+#
+#             Load the probe (srmvometrics, SRM-probe or LFC-probe) once and
+#             serve runs of it on a local UNIX socket. Every run is forked
+#             from the loaded worker, at most --concurrency at a time; the
+#             others wait in a queue. A run taking longer than --timeout is
+#             killed. Once its memory exceeds --max-rss, or after
+#             --max-requests runs, the worker stops accepting, finishes the
+#             runs queued and restarts itself. SIGHUP restarts it the same
+#             way, SIGTERM stops it after the queued runs.
+#
+#         probeworker.py <probe> <probe arguments>
+#
+#             Client: have the worker run the probe and print its output
+#             verbatim, with its exit code. Without a worker the probe is
+#             run directly. srmvometrics-client does this for srmvometrics.
+#
+#         The socket defaults to /tmp/probeworker-<probe>-<uid>.sock, or
+#         $PROBEWORKER_SOCKET.
+#
+##############################################################################
+
+"""
+Resident worker for the org.lhcb SRM/LFC probes.
+
+Saves the interpreter start-up, the imports of gridmon, lcg_util and gfal
+and the lcg_util/GFAL version lookup on every check.
+
+usage: probeworker.py --serve <probe> [--socket <path>] [--concurrency <n>]
+                      [--timeout <sec>] [--max-rss <MB>] [--max-requests <n>]
+       probeworker.py <probe> <probe arguments>
+"""
+
+import os
+import sys
+import socket
+import select
+import signal
+import errno
+import time
+import getopt
+import traceback
+import simplejson
+
+probes = {'srmvometrics' : 'srmvometrics.py',
+          'SRM-probe'    : 'SRM-probe',
+          'LFC-probe'    : 'LFC-probe'}
+
+probedir = os.path.dirname(os.path.abspath(__file__))
+
+
+def socket_path(name):
+    return os.environ.get('PROBEWORKER_SOCKET') or \
+        '/tmp/probeworker-%s-%i.sock' % (name, os.getuid())
+
+
+def client(name, argv, timeout=900):
+    """Run probe name with argv (argv[0] being the program name) in the
+    worker; run it directly if there is no worker. Returns the exit code."""
+    path = os.path.join(probedir, probes[name])
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path(name))
+    except socket.error:
+        sock.close()
+        os.execv(sys.executable, [sys.executable, path] + argv[1:])
+
+    request = simplejson.dumps({'argv' : argv[1:],
+                                'env'  : dict(os.environ),
+                                'cwd'  : os.getcwd()})
+    try:
+        sock.settimeout(timeout)
+        sock.sendall(request)
+        sock.shutdown(socket.SHUT_WR)
+        data = []
+        while True:
+            buf = sock.recv(65536)
+            if not buf:
+                break
+            data.append(buf)
+        sock.close()
+        response = simplejson.loads(''.join(data))
+    except (socket.error, ValueError), e:
+        sys.stdout.write('UNKNOWN: probe worker failed: %s\n' % str(e))
+        return 3
+    sys.stdout.write(response['stdout'].encode('utf-8'))
+    sys.stderr.write(response['stderr'].encode('utf-8'))
+    return response['status']
+
+
+def rss():
+    "Resident memory of this process in MB."
+    try:
+        fp = open('/proc/self/status', 'r')
+        try:
+            for line in fp:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+        finally:
+            fp.close()
+    except (IOError, ValueError):
+        pass
+    return 0
+
+
+class Run:
+    "A probe run forked by the worker for the request on conn."
+
+    def __init__(self, conn, pid, out, err):
+        self.conn = conn
+        self.pid = pid
+        self.started = time.time()
+        self.output = {out : [], err : []}
+        self.stdout = out
+        self.stderr = err
+        self.killed = False
+
+
+class Worker:
+    """Serves the runs of one probe on a UNIX socket, see the NOTES above."""
+
+    def __init__(self, name, path, concurrency=4, timeout=600, maxrss=0,
+                 maxrequests=0):
+        self.name = name
+        self.path = path
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.maxrss = maxrss
+        self.maxrequests = maxrequests
+        self.served = 0
+        self.listener = None
+        self.reading = {}   # socket -> data of requests being received
+        self.queue = []     # (socket, request)
+        self.runs = {}      # pipe fd -> Run
+        self.draining = False
+        self.restart = False
+
+    def load(self):
+        "Import the probe without running it and warm it up."
+        import imp
+        sys.argv = [self.path]
+        self.module = imp.load_source(self.name.replace('-', '_'), self.path)
+        if hasattr(self.module, 'get_lcg_util_gfal_ver'):
+            self.module.get_lcg_util_gfal_ver()
+        if hasattr(self.module, 'client_module'):
+            self.module.client_module('lcg_util')
+            self.module.client_module('gfal')
+
+    def listen(self):
+        path = socket_path(self.name)
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        os.chmod(path, 0600)
+        self.listener.listen(64)
+
+    def stop_listening(self):
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+            try:
+                os.unlink(socket_path(self.name))
+            except OSError:
+                pass
+
+    def drain(self, restart):
+        self.draining = True
+        self.restart = self.restart or restart
+        self.stop_listening()
+
+    def serve(self):
+        """Serve until drained; returns True if the worker should restart."""
+        signal.signal(signal.SIGHUP, lambda sig, stack: self.drain(True))
+        signal.signal(signal.SIGTERM, lambda sig, stack: self.drain(False))
+        self.listen()
+        while not self.draining or self.reading or self.queue or self.runs:
+            self.dispatch()
+            rlist = self.reading.keys() + self.runs.keys()
+            if self.listener is not None:
+                rlist.append(self.listener)
+            try:
+                ready = select.select(rlist, [], [], 1.0)[0]
+            except select.error, e:
+                if e[0] == errno.EINTR:
+                    continue
+                raise
+            for r in ready:
+                if r is self.listener:
+                    self.accept()
+                elif self.reading.has_key(r):
+                    self.receive(r)
+                else:
+                    self.collect(r)
+            self.expire()
+        self.stop_listening()
+        return self.restart
+
+    def accept(self):
+        try:
+            conn = self.listener.accept()[0]
+        except socket.error:
+            return
+        self.reading[conn] = []
+
+    def receive(self, conn):
+        try:
+            buf = conn.recv(65536)
+        except socket.error:
+            buf = None
+        if buf:
+            self.reading[conn].append(buf)
+            return
+        data = ''.join(self.reading.pop(conn))
+        try:
+            request = simplejson.loads(data)
+        except ValueError:
+            conn.close()
+            return
+        self.queue.append((conn, request))
+
+    def dispatch(self):
+        "Fork runs for queued requests while below the concurrency limit."
+        while self.queue and len(self.running()) < self.concurrency:
+            conn, request = self.queue.pop(0)
+            out_r, out_w = os.pipe()
+            err_r, err_w = os.pipe()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                os.close(out_r)
+                os.close(err_r)
+                self.child(conn, request, out_w, err_w)
+            os.close(out_w)
+            os.close(err_w)
+            run = Run(conn, pid, out_r, err_r)
+            self.runs[out_r] = run
+            self.runs[err_r] = run
+            self.served += 1
+
+    def running(self):
+        runs = []
+        for run in self.runs.values():
+            if run not in runs:
+                runs.append(run)
+        return runs
+
+    def child(self, conn, request, out_w, err_w):
+        "Run the probe for request in a forked child; never returns."
+        code = 3
+        try:
+            try:
+                signal.signal(signal.SIGHUP, signal.SIG_DFL)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                # clients only see the end of their response once no
+                # process holds their connection any more
+                if self.listener is not None:
+                    self.listener.close()
+                for sock in [conn] + self.reading.keys() + \
+                        [c for c, r in self.queue]:
+                    sock.close()
+                for fd in self.runs.keys():
+                    os.close(fd)
+                os.dup2(out_w, 1)
+                os.dup2(err_w, 2)
+                os.environ.clear()
+                for k, v in request['env'].items():
+                    os.environ[k.encode('utf-8')] = v.encode('utf-8')
+                os.chdir(request['cwd'])
+                argv = [self.path] + [a.encode('utf-8') for a in request['argv']]
+                sys.argv = argv
+                code = self.module.main(argv)
+            except SystemExit, e:
+                code = e.code
+                if code is not None and not isinstance(code, int):
+                    sys.stdout.write('%s\n' % code)
+                    code = 3
+            except:
+                traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code or 0)
+
+    def collect(self, fd):
+        run = self.runs[fd]
+        data = os.read(fd, 65536)
+        if data:
+            run.output[fd].append(data)
+            return
+        os.close(fd)
+        del self.runs[fd]
+        if self.runs.has_key(run.stdout) or self.runs.has_key(run.stderr):
+            return
+        status = os.waitpid(run.pid, 0)[1]
+        stdout = ''.join(run.output[run.stdout])
+        if run.killed:
+            code = 3
+            stdout += 'UNKNOWN: probe timed out after %i sec\n' % self.timeout
+        elif os.WIFEXITED(status):
+            code = os.WEXITSTATUS(status)
+        else:
+            code = 3
+            stdout += 'UNKNOWN: probe killed by signal %i\n' % \
+                                                        os.WTERMSIG(status)
+        self.respond(run.conn, {'status' : code,
+                                'stdout' : stdout.decode('utf-8', 'replace'),
+                                'stderr' : ''.join(run.output[run.stderr]).decode(
+                                                    'utf-8', 'replace')})
+        if self.maxrss and rss() > self.maxrss:
+            sys.stderr.write('%s worker: %i MB resident, restarting\n' %
+                             (self.name, rss()))
+            self.drain(True)
+        elif self.maxrequests and self.served >= self.maxrequests:
+            self.drain(True)
+
+    def respond(self, conn, response):
+        try:
+            conn.setblocking(1)
+            conn.sendall(simplejson.dumps(response))
+        except socket.error:
+            pass
+        conn.close()
+
+    def expire(self):
+        "Kill runs over the timeout."
+        now = time.time()
+        for run in self.running():
+            if not run.killed and now - run.started > self.timeout:
+                run.killed = True
+                try:
+                    os.kill(run.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+
+
+def serve(argv):
+    try:
+        opts, args = getopt.getopt(argv, '', ['serve=', 'socket=',
+                                              'concurrency=', 'timeout=',
+                                              'max-rss=', 'max-requests='])
+    except getopt.GetoptError, e:
+        sys.stderr.write('%s\n%s' % (str(e), __doc__))
+        return 2
+    name = None
+    kwargs = {}
+    for o, v in opts:
+        if o in ('--serve'):
+            name = v
+        elif o in ('--socket'):
+            os.environ['PROBEWORKER_SOCKET'] = v
+        elif o in ('--concurrency'):
+            kwargs['concurrency'] = int(v)
+        elif o in ('--timeout'):
+            kwargs['timeout'] = int(v)
+        elif o in ('--max-rss'):
+            kwargs['maxrss'] = int(v)
+        elif o in ('--max-requests'):
+            kwargs['maxrequests'] = int(v)
+    if not probes.has_key(name):
+        sys.stderr.write('--serve must be one of %s\n' % ', '.join(probes.keys()))
+        return 2
+
+    worker = Worker(name, os.path.join(probedir, probes[name]), **kwargs)
+    worker.load()
+    if worker.serve():
+        # fresh interpreter, same arguments
+        os.execv(sys.executable, [sys.executable, os.path.abspath(__file__)] + argv)
+    return 0
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1].startswith('--'):
+        sys.exit(serve(sys.argv[1:]))
+    if len(sys.argv) < 2 or not probes.has_key(sys.argv[1]):
+        sys.stderr.write(__doc__)
+        sys.exit(3)
+    sys.exit(client(sys.argv[1], sys.argv[1:]))
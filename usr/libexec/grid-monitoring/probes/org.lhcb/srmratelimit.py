@@ -0,0 +1,176 @@
+##############################################################################
+#
+# NAME:        srmratelimit.py
+#
+# FACILITY:    SAM (Service Availability Monitoring)
+#
+# COPYRIGHT:
+#         Copyright (c) 2009, Members of the EGEE Collaboration.
+#         http://www.eu-egee.org/partners/
+#         Licensed under the Apache License, Version 2.0.
+#         http://www.apache.org/licenses/LICENSE-2.0
+#         This software is provided "as is", without warranties
+#         or conditions of any kind, either express or implied.
+#
+# DESCRIPTION:
+#
+#         Limit of the SRM requests to a storage element, shared by all the
+#         probes running on this machine.
+#
+# NOTES:
+#
+#         A host has a number of request slots, files <host>.<n>.slot in the
+#         limit directory. A request holds an flock() on one of them while
+#         it runs, so at most that many requests from srmvometrics.py and
+#         SRM-probe are in flight to the host at a time, whatever process
+#         or thread sends them. The kernel drops the lock of a killed probe.
+#
+#         Optionally the starts of the requests to a host are also spaced by
+#         an interval: <host>.next holds the earliest time the next request
+#         may start, and every request reserves its start time in it.
+#
+#         A process forked while holding slots must call forget_slots(),
+#         or they stay locked until it exits.
+#
+#         The directory defaults to /tmp/srm-se-limits-<uid>, or
+#         $SRM_SE_LIMIT_DIR.
+#
+##############################################################################
+
+"""
+Limit of the SRM requests to a storage element, shared by all the probes
+running on this machine.
+
+    limiter = SELimiter(limit_dir(), 'srm.example.org', 2, 0.5)
+    slot, waited = limiter.acquire(time.time() + 60)
+    try:
+        ... SRM request ...
+    finally:
+        limiter.release(slot)
+"""
+
+import os
+import time
+import fcntl
+import errno
+
+
+class LimitTimeout(Exception):
+    "No request slot became free before the deadline."
+
+# fd -> path of the slots (and the start time file) locked by this process
+_held = {}
+
+
+def forget_slots():
+    """Close the slots inherited from the parent process, without freeing
+    them for the parent; to be called first thing in a forked child."""
+    for slot in _held.keys():
+        del _held[slot]
+        try:
+            os.close(slot)
+        except OSError:
+            pass
+
+
+def limit_dir():
+    return os.environ.get('SRM_SE_LIMIT_DIR') or \
+        '/tmp/srm-se-limits-%i' % os.getuid()
+
+
+class SELimiter:
+    """At most 'slots' SRM requests in flight to a host, started at least
+    'interval' seconds apart, across all processes using 'directory'; the
+    host is 'host' unless acquire() is given another one."""
+
+    # how often a waiting request looks for a free slot
+    _poll = 0.05
+
+    def __init__(self, directory, host, slots, interval=0.0):
+        self.directory = directory
+        self.host = host
+        self.slots = slots
+        self.interval = interval
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory, 0700)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def _path(self, host, suffix):
+        return os.path.join(self.directory, '%s.%s' % (host, suffix))
+
+    def _tryLock(self, path):
+        "The fd of path locked exclusively, or None if it is locked already."
+        fd = os.open(path, os.O_RDWR|os.O_CREAT, 0600)
+        _held[fd] = path
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX|fcntl.LOCK_NB)
+            return fd
+        except IOError, e:
+            self.release(fd)
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return None
+            raise
+
+    def acquire(self, deadline=None, host=None):
+        """Wait for a free request slot of the host, and for the start time
+        of the request if an interval is set; returns (slot, seconds waited).
+
+        Raises LimitTimeout if that would take past deadline."""
+        host = host or self.host
+        start = time.time()
+        slot = None
+        while 1:
+            for n in range(self.slots):
+                slot = self._tryLock(self._path(host, '%i.slot' % n))
+                if slot is not None:
+                    break
+            if slot is not None or not self.slots:
+                break
+            if deadline is not None and time.time() + self._poll > deadline:
+                raise LimitTimeout('no free request slot on %s after %.1f sec '
+                                   '(%i in flight)' % (host,
+                                   time.time() - start, self.slots))
+            time.sleep(self._poll)
+        if self.interval > 0:
+            try:
+                at = self._reserve(host)
+                if deadline is not None and at > deadline:
+                    raise LimitTimeout('next request slot on %s in %.1f sec' %
+                                       (host, at - time.time()))
+                while 1:
+                    left = at - time.time()
+                    if left <= 0:
+                        break
+                    time.sleep(left)
+            except:
+                self.release(slot)
+                raise
+        return (slot, time.time() - start)
+
+    def _reserve(self, host):
+        "Reserve the next start time of a request to host; returns it."
+        path = self._path(host, 'next')
+        fd = os.open(path, os.O_RDWR|os.O_CREAT, 0600)
+        _held[fd] = path
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                at = float(os.read(fd, 64) or 0)
+            except ValueError:
+                at = 0.0
+            at = max(at, time.time())
+            os.lseek(fd, 0, 0)
+            os.ftruncate(fd, 0)
+            os.write(fd, '%.3f' % (at + self.interval))
+            return at
+        finally:
+            self.release(fd)
+
+    def release(self, slot):
+        "Free the slot returned by acquire()."
+        if slot is not None:
+            _held.pop(slot, None)
+            os.close(slot)
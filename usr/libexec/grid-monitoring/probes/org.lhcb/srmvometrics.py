@@ -27,6 +27,12 @@
 #
 # NOTES:
 #
+#         Batch mode: with --batch-hosts <host,...|@file> the given metric
+#         is run for every host in a child forked from one warm process,
+#         --batch-concurrency <n> (default 10) at a time. Each child gets
+#         the other arguments plus -H <host>; the output of every child is
+#         written in one piece, in the format of a single run.
+#
 ##############################################################################
 
 """
@@ -46,26 +52,890 @@ import sys
 import getopt
 import time #@UnresolvedImport
 import signal
-import commands
 import errno
 import re
-import urllib2
-import simplejson
 import pickle
 import datetime
+import threading
+import fcntl
+import sqlite3
+import math
+# the modules only some metrics need are imported where they are used
 
 try:
     from gridmon import probe
     from gridmon import utils as samutils
     from gridmon import gridutils
-    import lcg_util
-    import gfal
+    from srmratelimit import SELimiter, LimitTimeout, limit_dir, forget_slots
+    from endpointpool import EndpointPool
 except ImportError,e:
     summary = "UNKNOWN: Error loading modules : %s" % (e)
     sys.stdout.write(summary+'\n')
     sys.stdout.write(summary+'\nsys.path: %s\n'% str(sys.path))
     sys.exit(3)
 
+_clientModules = {}
+
+def client_module(name):
+    """The SRM client library name (lcg_util or gfal), imported on first
+    use: the discovery metrics do not need them."""
+    if not _clientModules.has_key(name):
+        _clientModules[name] = __import__(name)
+    return _clientModules[name]
+
+
+class BDIICache:
+    """On-disk cache of BDII query results.
+
+    Entries are keyed by (ldap_url, filter, attrlist) and pickled one file
+    per key together with the time they were fetched. Refreshing an entry
+    is done under a per-key lock, so probes running at the same time query
+    the BDII only once and then share the result.
+    """
+
+    def __init__(self, directory, ttl, maxstale):
+        self.directory = directory
+        self.ttl = ttl
+        self.maxstale = maxstale
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        import hashlib
+        return os.path.join(self.directory,
+                            hashlib.md5(repr(key)).hexdigest())
+
+    def read(self, key):
+        "Return (age, value) of the cached entry, or None."
+        try:
+            fp = open(self._path(key), 'rb')
+            try:
+                stamp, value = pickle.load(fp)
+            finally:
+                fp.close()
+        except (IOError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+        return (time.time() - stamp, value)
+
+    def write(self, key, value):
+        path = self._path(key)
+        tmp = '%s.%i' % (path, os.getpid())
+        fp = open(tmp, 'wb')
+        try:
+            pickle.dump((time.time(), value), fp, 2)
+        finally:
+            fp.close()
+        os.rename(tmp, path)
+
+    def lock(self, key):
+        fd = os.open(self._path(key)+'.lock', os.O_WRONLY | os.O_CREAT, 0644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+
+    def unlock(self, fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+class VOInfoStore:
+    """SQLite store of the VO info dictionary and of the VO test results.
+
+    'endpoints' holds the current VO info dictionary with one row per SRM
+    endpoint, so a probe reads or updates a single endpoint in its own
+    transaction. 'results' keeps every test result together with the hour
+    it was taken, which replaces the VOInfoDictionary_<hour> snapshots.
+    'latencies' keeps the duration of the successful SRM calls per host,
+    space token and operation, for --adaptive-timeouts. 'breakers' holds
+    the circuit breaker of every endpoint, for --circuit-breaker.
+    """
+
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS endpoints (
+                               endpoint TEXT PRIMARY KEY,
+                               info     BLOB NOT NULL,
+                               updated  REAL NOT NULL)""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS results (
+                               endpoint TEXT NOT NULL,
+                               test     TEXT NOT NULL,
+                               status   TEXT NOT NULL,
+                               summary  TEXT,
+                               hour     INTEGER NOT NULL,
+                               recorded REAL NOT NULL)""")
+        self.db.execute("""CREATE INDEX IF NOT EXISTS results_endpoint_test
+                               ON results (endpoint, test, recorded)""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS latencies (
+                               host     TEXT NOT NULL,
+                               token    TEXT NOT NULL,
+                               op       TEXT NOT NULL,
+                               seconds  REAL NOT NULL,
+                               recorded REAL NOT NULL)""")
+        self.db.execute("""CREATE INDEX IF NOT EXISTS latencies_host
+                               ON latencies (host, recorded)""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS breakers (
+                               endpoint TEXT PRIMARY KEY,
+                               state    TEXT NOT NULL,
+                               failures INTEGER NOT NULL,
+                               status   TEXT NOT NULL,
+                               error    TEXT,
+                               summary  TEXT,
+                               opened   REAL NOT NULL,
+                               retry    REAL NOT NULL)""")
+
+    def close(self):
+        self.db.close()
+
+    def load(self):
+        "Return the whole VO info dictionary."
+        voInfoDict = {}
+        for srmendpt, info in self.db.execute(
+                'SELECT endpoint, info FROM endpoints'):
+            # TEXT comes back as unicode, the SRM clients want plain str
+            voInfoDict[str(srmendpt)] = pickle.loads(str(info))
+        return voInfoDict
+
+    def endpoint(self, srmendpt):
+        "Return the VO info of one endpoint, or None."
+        row = self.db.execute('SELECT info FROM endpoints WHERE endpoint = ?',
+                              (srmendpt,)).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(str(row[0]))
+
+    def save(self, srmendpt, info):
+        "Store the VO info of a (re)discovered endpoint."
+        self.db.execute('INSERT OR REPLACE INTO endpoints VALUES (?, ?, ?)',
+                        (srmendpt, sqlite3.Binary(pickle.dumps(info, 2)),
+                         time.time()))
+
+    def update(self, srmendpt, info, test, extra=()):
+        """Store info[test] of one endpoint and add it to the history.
+
+        The keys in extra are stored along with it, or removed if they are
+        not in info. The current entry is only updated if it still describes
+        the same test file, i.e. it was not rediscovered in the meantime.
+        """
+        now = time.time()
+        status, summary = info[test][0], info[test][1]
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            current = self.endpoint(srmendpt)
+            if current is not None and current.get('fn') == info.get('fn'):
+                current[test] = info[test]
+                for key in extra:
+                    if info.has_key(key):
+                        current[key] = info[key]
+                    elif current.has_key(key):
+                        del current[key]
+                self.db.execute('UPDATE endpoints SET info = ? WHERE endpoint = ?',
+                                (sqlite3.Binary(pickle.dumps(current, 2)),
+                                 srmendpt))
+            self.db.execute('INSERT INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                            (srmendpt, test, status, summary,
+                             time.localtime(now)[3], now))
+        except:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+
+    def history(self, srmendpt, test, limit=24):
+        "Return the last (status, summary, recorded) results, newest first."
+        return self.db.execute("""SELECT status, summary, recorded FROM results
+                                   WHERE endpoint = ? AND test = ?
+                                   ORDER BY recorded DESC LIMIT ?""",
+                               (srmendpt, test, limit)).fetchall()
+
+    def addLatencies(self, host, latencies):
+        "Add the (token, op, seconds) latencies of calls to host."
+        now = time.time()
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            self.db.executemany('INSERT INTO latencies VALUES (?, ?, ?, ?, ?)',
+                                [(host, token, op, seconds, now) for
+                                 token, op, seconds in latencies])
+        except:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+
+    def latencies(self, host, window=100):
+        "Return (token, op) -> [seconds] of the last window calls of each."
+        latencies = {}
+        for token, op, seconds in self.db.execute(
+                """SELECT token, op, seconds FROM latencies WHERE host = ?
+                    ORDER BY recorded DESC""", (host,)):
+            samples = latencies.setdefault((str(token), str(op)), [])
+            if len(samples) < window:
+                samples.append(seconds)
+        return latencies
+
+    def breakers(self):
+        "Return srmendpt -> circuit breaker (a dictionary of its columns)."
+        breakers = {}
+        cursor = self.db.execute('SELECT * FROM breakers')
+        names = [d[0] for d in cursor.description]
+        for row in cursor:
+            breaker = dict(zip(names[1:], row[1:]))
+            for key in ('state', 'status', 'error', 'summary'):
+                breaker[key] = str(breaker[key] or '')
+            breakers[str(row[0])] = breaker
+        return breakers
+
+    def saveBreaker(self, srmendpt, breaker):
+        self.db.execute('INSERT OR REPLACE INTO breakers VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (srmendpt, breaker['state'], breaker['failures'],
+                         breaker['status'], breaker['error'], breaker['summary'],
+                         breaker['opened'], breaker['retry']))
+
+    def expire(self, maxage, historyage):
+        """Drop endpoints not rediscovered within maxage seconds, and results
+        and latencies older than historyage seconds, and the breakers of the
+        endpoints dropped. Returns the number of endpoints dropped.
+        """
+        now = time.time()
+        n = self.db.execute('DELETE FROM endpoints WHERE updated < ?',
+                            (now - maxage,)).rowcount
+        self.db.execute('DELETE FROM results WHERE recorded < ?',
+                        (now - historyage,))
+        self.db.execute('DELETE FROM latencies WHERE recorded < ?',
+                        (now - historyage,))
+        self.db.execute("""DELETE FROM breakers WHERE endpoint NOT IN
+                               (SELECT endpoint FROM endpoints)""")
+        return n
+
+
+class ErrorMatcher:
+    """Shared, memoising front end to probe.ErrorsMatching.
+
+    The error DB is parsed once per process (see get_error_matcher()) and
+    the parsed matcher is pickled to disk, to be reused by later runs for
+    as long as the DB file keeps its mtime and size. Match results are
+    memoised per message: when an SE is down all its endpoints fail with
+    the same few messages, and each of them is matched only once.
+    """
+
+    def __init__(self, errdb, topics, stamp, cachefile=None):
+        self.stamp = stamp
+        self._lock = threading.Lock()
+        self._matches = {}
+        self._em = None
+        key = (errdb, topics, stamp)
+        if cachefile and stamp:
+            try:
+                fp = open(cachefile, 'rb')
+                try:
+                    ckey, em = pickle.load(fp)
+                finally:
+                    fp.close()
+                if ckey == key:
+                    self._em = em
+            except Exception:
+                pass
+        if self._em is None:
+            self._em = probe.ErrorsMatching(errdb, list(topics))
+            if cachefile and stamp:
+                try:
+                    tmp = '%s.%i' % (cachefile, os.getpid())
+                    fp = open(tmp, 'wb')
+                    try:
+                        pickle.dump((key, self._em), fp, 2)
+                    finally:
+                        fp.close()
+                    os.rename(tmp, cachefile)
+                except Exception:
+                    # not picklable or not writable, keep it in memory only
+                    try: os.unlink(tmp)
+                    except OSError: pass
+
+    def match(self, errmsg):
+        "Same as probe.ErrorsMatching.match()."
+        self._lock.acquire()
+        try:
+            if not self._matches.has_key(errmsg):
+                self._matches[errmsg] = self._em.match(errmsg)
+            return self._matches[errmsg]
+        finally:
+            self._lock.release()
+
+    def match_many(self, errmsgs):
+        "Match a list of messages, returns the list of results."
+        return [self.match(m) for m in errmsgs]
+
+
+_errorMatchers = {}
+_errorMatchersLock = threading.Lock()
+
+def get_error_matcher(errdb, topics, cachefile=None):
+    """Return the process-wide ErrorMatcher for the error DB and topics.
+
+    The matcher is rebuilt when the DB file changes.
+    """
+    topics = tuple(topics or [])
+    try:
+        st = os.stat(errdb)
+        stamp = (st.st_mtime, st.st_size)
+    except OSError:
+        stamp = None
+    _errorMatchersLock.acquire()
+    try:
+        em = _errorMatchers.get((errdb, topics))
+        if em is None or em.stamp != stamp:
+            em = ErrorMatcher(errdb, topics, stamp, cachefile)
+            _errorMatchers[(errdb, topics)] = em
+        return em
+    finally:
+        _errorMatchersLock.release()
+
+
+class CallError(Exception):
+    "An SRM call that did not complete in its worker process."
+
+
+class RemoteObject:
+    """Stand-in for an object that cannot leave the worker process which
+    created it (a gfal context); calls passing it are run by that worker."""
+
+    def __init__(self, pid, handle):
+        self.pid = pid
+        self.handle = handle
+
+
+def send_message(fd, obj):
+    import struct
+    data = pickle.dumps(obj, 2)
+    data = struct.pack('!I', len(data)) + data
+    while data:
+        data = data[os.write(fd, data):]
+
+def receive_message(fd, deadline=None):
+    """Read a message written by send_message(); raises CallError on EOF,
+    or if deadline (a time.time()) passes first."""
+    import select
+    import struct
+    data = ''
+    need = 4
+    length = None
+    while len(data) < need:
+        if deadline is not None:
+            left = deadline - time.time()
+            if left <= 0:
+                raise CallError('timed out')
+            try:
+                if not select.select([fd], [], [], left)[0]:
+                    continue
+            except select.error, e:
+                if e[0] == errno.EINTR:
+                    continue
+                raise
+        try:
+            buf = os.read(fd, need - len(data))
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        if not buf:
+            raise CallError('worker process died')
+        data += buf
+        if length is None and len(data) == 4:
+            length = struct.unpack('!I', data)[0]
+            data = ''
+            need = length
+    return pickle.loads(data)
+
+def serve_calls(rfd, wfd):
+    "Main loop of a CallPool worker process: run the calls it is sent."
+    objects = {}
+    while True:
+        try:
+            module, name, args = receive_message(rfd)
+        except CallError:
+            return
+        args = list(args)
+        for i, a in enumerate(args):
+            if isinstance(a, RemoteObject) and objects.has_key(a.handle):
+                args[i] = objects[a.handle]
+        try:
+            result = getattr(client_module(module), name)(*args)
+            if name == 'gfal_internal_free':
+                for handle, obj in objects.items():
+                    if obj is args[0]:
+                        del objects[handle]
+            if isinstance(result, tuple):
+                items = []
+                for item in result:
+                    try:
+                        pickle.dumps(item, 2)
+                    except Exception:
+                        objects[id(item)] = item
+                        item = RemoteObject(os.getpid(), id(item))
+                    items.append(item)
+                result = tuple(items)
+            reply = ('result', result)
+        except Exception, e:
+            reply = ('error', CallError('%s: %s' % (name, str(e))))
+        try:
+            pickle.dumps(reply, 2)
+        except Exception, e:
+            reply = ('error', CallError('%s: cannot return the result: %s' % 
+                                        (name, str(e))))
+        send_message(wfd, reply)
+
+
+class CallPool:
+    """Pre-forked worker processes running the blocking gfal/lcg_util calls.
+
+    The C bindings cannot be interrupted, so every call is sent to an idle
+    worker process and waited for until its deadline. A worker running past
+    it is killed and replaced, and the call raises CallError; calls that
+    finished keep their results. Objects that cannot be pickled (gfal
+    contexts) stay in the worker that created them, see RemoteObject.
+    """
+
+    def __init__(self, size):
+        self.size = max(1, int(size))
+        self._cond = threading.Condition()
+        self._workers = {}      # pid -> [request fd, result fd, busy]
+        for module in ('lcg_util', 'gfal'):
+            client_module(module)
+        for i in range(self.size):
+            self._spawn()
+
+    def _spawn(self):
+        req_r, req_w = os.pipe()
+        res_r, res_w = os.pipe()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                for sig in (signal.SIGALRM, signal.SIGTERM, signal.SIGHUP):
+                    signal.signal(sig, signal.SIG_DFL)
+                # a hung worker must not hold the probe's output open
+                devnull = os.open(os.devnull, os.O_RDWR)
+                os.dup2(devnull, 1)
+                os.dup2(devnull, 2)
+                os.close(req_w)
+                os.close(res_r)
+                for wfd, rfd, busy in self._workers.values():
+                    os.close(wfd)
+                    os.close(rfd)
+                forget_slots()
+                serve_calls(req_r, res_w)
+            finally:
+                os._exit(0)
+        os.close(req_r)
+        os.close(res_w)
+        self._workers[pid] = [req_w, res_r, False]
+
+    def _reap(self, pid):
+        "Kill worker pid and start a new one; called with _cond held."
+        wfd, rfd, busy = self._workers.pop(pid)
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+        os.waitpid(pid, 0)
+        os.close(wfd)
+        os.close(rfd)
+        self._spawn()
+
+    def _acquire(self, pid, deadline):
+        """An idle worker: pid if given; waits for it until deadline."""
+        self._cond.acquire()
+        try:
+            while True:
+                if pid is not None:
+                    if not self._workers.has_key(pid):
+                        raise CallError('worker process %i is gone' % pid)
+                    candidates = [pid]
+                else:
+                    candidates = self._workers.keys()
+                for p in candidates:
+                    if not self._workers[p][2]:
+                        self._workers[p][2] = True
+                        return p
+                left = deadline - time.time()
+                if left <= 0:
+                    raise CallError('no worker process free in time')
+                self._cond.wait(min(left, 1.0))
+        finally:
+            self._cond.release()
+
+    def call(self, module, name, args, deadline):
+        """module.name(*args) in a worker, given until deadline (a time.time())."""
+        if deadline <= time.time():
+            raise CallError('%s not started, no time left' % name)
+        pid = None
+        for a in args:
+            if isinstance(a, RemoteObject):
+                pid = a.pid
+        pid = self._acquire(pid, deadline)
+        wfd, rfd, busy = self._workers[pid]
+        try:
+            try:
+                send_message(wfd, (module, name, args))
+                kind, value = receive_message(rfd, deadline)
+            except (CallError, OSError), e:
+                self._cond.acquire()
+                try:
+                    if self._workers.has_key(pid):
+                        self._reap(pid)
+                finally:
+                    self._cond.release()
+                raise CallError('%s did not complete, worker killed: %s' % 
+                                (name, str(e)))
+        finally:
+            self._cond.acquire()
+            if self._workers.has_key(pid):
+                self._workers[pid][2] = False
+            self._cond.notifyAll()
+            self._cond.release()
+        if kind == 'error':
+            raise value
+        return value
+
+    def kill(self):
+        "Kill the workers busy with a call; the calls raise CallError."
+        self._cond.acquire()
+        try:
+            for pid, (wfd, rfd, busy) in self._workers.items():
+                if busy:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+        finally:
+            self._cond.release()
+
+    def close(self):
+        self._cond.acquire()
+        try:
+            for pid, (wfd, rfd, busy) in self._workers.items():
+                os.close(wfd)
+                os.close(rfd)
+                if busy:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+                os.waitpid(pid, 0)
+            self._workers = {}
+        finally:
+            self._cond.release()
+
+
+class SRMSession:
+    """SRM client context shared by the metrics of a probe run.
+
+    All gfal and lcg_util calls of the metrics go through call(), which
+    counts and times the SRM handshakes (every request sent to the SE sets
+    up its own GSI session in these client libraries). gfal contexts are
+    released once, by close(). gfal_ls() results are kept per SURL until
+    the SURL is written or deleted, so a later metric of the same run
+    needing the same listing gets it without another SRM request.
+
+    Every call is also recorded as a timing of its phase (put, get, ls,
+    ...) for the metric and endpoint set in 'context' by the calling
+    thread, see takeTimings().
+
+    With workers, the calls run in a CallPool of that many processes,
+    started on the first call. Each call is given until the deadline set
+    in 'context', and at most callLimit seconds.
+
+    With a limiter (an srmratelimit.SELimiter), the calls contacting the
+    SE first wait for a request slot of the host of the endpoint in
+    'context' (or the limiter's host), until the same deadline; the wait
+    is recorded as a timing of its own, phase 'wait'.
+    """
+
+    # calls that contact the SE
+    _handshakeCalls = ('gfal_ls', 'gfal_deletesurls',
+                       'lcg_cp3', 'lcg_del4', 'lcg_gt3', 'lcg_sd3')
+    # calls modifying a SURL: position of the SURL in the arguments
+    _surlWrites = {'lcg_cp3'  : 1,
+                   'lcg_del4' : 0}
+    # timing phases of the calls; lcg_cp3 is 'put' or 'get'
+    _phases = {'gfal_ls'          : 'ls',
+               'gfal_get_results' : 'ls_results',
+               'gfal_deletesurls' : 'del',
+               'lcg_del4'         : 'del',
+               'lcg_gt3'          : 'getturl',
+               'lcg_sd3'          : 'setdone'}
+
+    def __init__(self, context=None, workers=0, callLimit=0, limiter=None):
+        self.workers = workers
+        self.callLimit = callLimit
+        self.limiter = limiter
+        self.pool = None
+        self.handshakes = 0
+        self.handshakeTime = 0.0
+        self.reused = 0
+        self.calls = {}
+        self.timings = []
+        self.context = context or threading.local()
+        self._gfalobjs = []
+        self._ls = {}
+        self._lock = threading.Lock()
+
+    def call(self, name, *args):
+        "Call gfal.<name>/lcg_util.<name>(*args), which are named gfal_*/lcg_*."
+        if self._surlWrites.has_key(name):
+            self.forget(args[self._surlWrites[name]])
+        start = time.time()
+        slot = None
+        if self.limiter is not None and name in self._handshakeCalls:
+            try:
+                slot, waited = self.limiter.acquire(self.deadline(),
+                                                    self.endpointHost())
+            except LimitTimeout, e:
+                self.record('wait', time.time() - start, False)
+                raise CallError('%s not started: %s' % (name, str(e)))
+            self.record('wait', waited)
+            start = time.time()
+        ok = False
+        try:
+            result = self._invoke(name, args)
+            # all of them return the status code first, 0 on success
+            ok = isinstance(result, tuple) and result[:1] == (0,)
+            return result
+        finally:
+            if slot is not None:
+                self.limiter.release(slot)
+            elapsed = time.time() - start
+            self._account(name, elapsed)
+            if name == 'lcg_cp3':
+                self.record(str(args[1]).startswith('file:') and 'get' or 'put',
+                            elapsed, ok)
+            else:
+                self.record(self._phases.get(name, name), elapsed, ok)
+
+    def _invoke(self, name, args):
+        module = name.startswith('gfal_') and 'gfal' or 'lcg_util'
+        if not self.workers:
+            return getattr(client_module(module), name)(*args)
+        self._lock.acquire()
+        try:
+            if self.pool is None:
+                self.pool = CallPool(self.workers)
+        finally:
+            self._lock.release()
+        return self.pool.call(module, name, args, self.deadline())
+
+    def endpointHost(self):
+        "Host of the endpoint of the calling thread, None if it has none."
+        m = re.match(r'\w+://([^:/]+)', getattr(self.context, 'endpoint', None) or '')
+        return m and m.group(1) or None
+
+    def deadline(self):
+        "When a call of the calling thread has to be done by."
+        deadline = time.time() + (self.callLimit or 86400)
+        return min(deadline, getattr(self.context, 'deadline', None) or deadline)
+
+    def abort(self):
+        "Make the calls in flight fail now, if they run in worker processes."
+        if self.pool is not None:
+            self.pool.kill()
+            return True
+        return False
+
+    def record(self, phase, elapsed, ok=True):
+        """Record a timing for the metric and endpoint of the calling thread;
+        ok tells whether the call succeeded."""
+        self._lock.acquire()
+        try:
+            self.timings.append([getattr(self.context, 'metric', None),
+                                 getattr(self.context, 'endpoint', None),
+                                 phase, elapsed, ok, False])
+        finally:
+            self._lock.release()
+
+    def takeTimings(self, metric):
+        """Return the (endpoint, phase, seconds, ok) timings of metric not
+        taken yet; timings recorded outside any metric go to the first taker."""
+        self._lock.acquire()
+        try:
+            taken = []
+            for timing in self.timings:
+                if not timing[5] and timing[0] in (metric, None):
+                    timing[5] = True
+                    taken.append(tuple(timing[1:5]))
+            return taken
+        finally:
+            self._lock.release()
+
+    def _account(self, name, elapsed):
+        self._lock.acquire()
+        try:
+            count, total = self.calls.get(name, (0, 0.0))
+            self.calls[name] = (count + 1, total + elapsed)
+            if name in self._handshakeCalls:
+                self.handshakes += 1
+                self.handshakeTime += elapsed
+        finally:
+            self._lock.release()
+
+    def free(self, gfalobj):
+        "Release the gfal context when the session is closed."
+        self._lock.acquire()
+        self._gfalobjs.append(gfalobj)
+        self._lock.release()
+
+    def cachedLs(self, surls):
+        "gfal_ls() statuses of all surls from this session, or None."
+        self._lock.acquire()
+        try:
+            for surl in surls:
+                if not self._ls.has_key(surl):
+                    return None
+            self.reused += 1
+            return [self._ls[surl] for surl in surls]
+        finally:
+            self._lock.release()
+
+    def storeLs(self, statuses):
+        self._lock.acquire()
+        try:
+            for st in statuses:
+                if st['status'] == 0:
+                    self._ls[st['surl']] = st
+        finally:
+            self._lock.release()
+
+    def forget(self, surl):
+        self._lock.acquire()
+        try:
+            if self._ls.has_key(surl):
+                del self._ls[surl]
+        finally:
+            self._lock.release()
+
+    def close(self):
+        for gfalobj in self._gfalobjs:
+            try: self._invoke('gfal_internal_free', (gfalobj,))
+            except: pass
+        self._gfalobjs = []
+        self._ls = {}
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def report(self):
+        "One line summary of the SRM traffic, for the debug output."
+        saved = 0.0
+        if self.handshakes:
+            saved = self.reused * self.handshakeTime / self.handshakes
+        return 'SRM session: %i handshake(s) in %.2f sec, %i listing(s) ' \
+               'reused (~%.2f sec saved); %s' % \
+               (self.handshakes, self.handshakeTime, self.reused, saved,
+                ', '.join(['%s: %i' % (k, v[0]) for k, v in 
+                           sorted(self.calls.items())]) or 'no calls')
+
+
+def file_checksums(path, bufsize=65536):
+    "adler32 and md5 of a local file, as lowercase hex like SRM reports them."
+    import hashlib
+    import zlib
+    adler = 1
+    md5 = hashlib.md5()
+    fp = open(path, 'rb')
+    try:
+        while 1:
+            buf = fp.read(bufsize)
+            if not buf:
+                break
+            adler = zlib.adler32(buf, adler)
+            md5.update(buf)
+    finally:
+        fp.close()
+    return {'adler32' : '%08x' % (adler & 0xffffffffL),
+            'md5'     : md5.hexdigest()}
+
+def same_checksum(ctype, value, checksums):
+    """Compare a checksum reported by the SE with file_checksums().
+
+    Returns True or False, or None if the SE reported no checksum or one
+    of a type not in checksums.
+    """
+    ctype = (ctype or '').lower().replace('-', '')
+    value = (value or '').lower()
+    if value.startswith('0x'):
+        value = value[2:]
+    if not value or not checksums.has_key(ctype):
+        return None
+    if ctype == 'adler32':
+        value = value.zfill(8)
+    return value == checksums[ctype]
+
+def same_content(path1, path2, bufsize=65536):
+    "Compare two local files block by block."
+    fp1 = open(path1, 'rb')
+    try:
+        fp2 = open(path2, 'rb')
+        try:
+            if os.fstat(fp1.fileno()).st_size != \
+                    os.fstat(fp2.fileno()).st_size:
+                return False
+            while 1:
+                buf1 = fp1.read(bufsize)
+                if buf1 != fp2.read(bufsize):
+                    return False
+                if not buf1:
+                    return True
+        finally:
+            fp2.close()
+    finally:
+        fp1.close()
+
+_lcgUtilGfalVer = None
+
+def get_lcg_util_gfal_ver():
+    "gridutils.get_lcg_util_gfal_ver(), which forks, once per process."
+    global _lcgUtilGfalVer
+    if _lcgUtilGfalVer is None:
+        _lcgUtilGfalVer = gridutils.get_lcg_util_gfal_ver()
+    return _lcgUtilGfalVer
+
+def write_test_file(path, size, blocksize=1048576):
+    """Write size bytes of random data to path one block at a time; an
+    existing file of that size is kept."""
+    try:
+        if os.path.getsize(path) == size:
+            return
+    except OSError:
+        pass
+    block = os.urandom(min(size, blocksize))
+    # written aside and renamed, a probe copying the file meanwhile reads
+    # either the old file or the whole new one
+    tmp = '%s.%i' % (path, os.getpid())
+    try:
+        fp = open(tmp, 'wb')
+        try:
+            left = size
+            while left > 0:
+                fp.write(block[:left])
+                left -= len(block)
+        finally:
+            fp.close()
+        os.rename(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def perfdata(label, value, uom=''):
+    "One item of Nagios performance data."
+    return "'%s'=%.3f%s;;;" % (label.replace("'", '"'), value, uom)
+
+def stamp(t):
+    "Local time t for the output."
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(t))
+
+def percentile(values, p):
+    "The p-th percentile of values, nearest rank."
+    values = sorted(values)
+    k = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[max(0, min(k, len(values) - 1))]
+
 
 class SRMVOMetrics(probe.MetricGatherer) :
     """A Metric Gatherer specific for SRM."""
@@ -84,6 +954,114 @@ class SRMVOMetrics(probe.MetricGatherer) :
                  'srm_operation'  : 0}
     
     _ldap_url  = "ldap://sam-bdii.cern.ch:2170"
+
+    # BDII results are reused for _bdiiCacheTTL seconds (0 disables the
+    # cache); if the BDII fails, results up to _bdiiCacheMaxStale old are
+    # served instead
+    _bdiiCacheTTL      = 6*3600
+    _bdiiCacheMaxStale = 7*86400
+
+    # endpoints not rediscovered for _voInfoMaxAge seconds are dropped from
+    # the VO info store, test results are kept for _voHistoryMaxAge seconds
+    _voInfoMaxAge    = 3*86400
+    _voHistoryMaxAge = 7*86400
+
+    # number of endpoints tested in parallel by the VO metrics, and the
+    # time allowed on top of srm_connect before an endpoint is given up
+    _endpointConcurrency = 1
+    _endpointGrace       = 10
+
+    # time a metric may take per endpoint (0: --se-timeout plus
+    # _endpointGrace); with --adaptive-timeouts every SRM call gets the
+    # _timeoutPercentile percentile plus _timeoutMargin sec of the
+    # durations of its last _latencyWindow successful calls to the host,
+    # space token and operation, within what is left of that time, once
+    # there are _latencyMinSamples of them; --se-timeout until then
+    _metricTimeout      = 0
+    _adaptiveTimeouts   = False
+    _timeoutPercentile  = 95
+    _timeoutMargin      = 10
+    _latencyWindow      = 100
+    _latencyMinSamples  = 10
+    # their calls scale with the test file size, not counted
+    _latencyExcluded    = ('VOPutThroughput', 'VOGetThroughput')
+    _timeoutOptions     = ['call-workers=',
+                           'metric-timeout=',
+                           'adaptive-timeouts',
+                           'timeout-percentile=',
+                           'timeout-margin=']
+
+    # --circuit-breaker: an endpoint failing in _breakerFailures runs in a
+    # row with the same error is open, its VO metrics are skipped; every
+    # _breakerCooldown seconds a single ls of its directory probes it. If
+    # that works it is half-open for the run, and closed again if it
+    # passes all its metrics
+    _circuitBreaker  = False
+    _breakerFailures = 3
+    _breakerCooldown = 3600
+    _breakerOptions  = ['circuit-breaker',
+                        'breaker-failures=',
+                        'breaker-cooldown=']
+
+    # at most _seMaxRequests SRM requests to the host in flight at a time,
+    # started at least _seRequestInterval sec apart, counting those of all
+    # the SRM probes sharing _seLimitDir (0: no limit)
+    _seMaxRequests     = 0
+    _seRequestInterval = 0.0
+    _seLimitDir        = None
+    _limitOptions      = ['se-max-requests=',
+                          'se-request-interval=',
+                          'se-limit-dir=']
+
+    # how Get/VOGet verify the test file: 'download' compares a downloaded
+    # copy, 'checksum' compares the checksum reported by the SE with the
+    # one taken at Put time and downloads only if the SE reports none
+    _getVerifyModes = ('download', 'checksum')
+    _getVerify      = 'download'
+
+    # ToA lists of the VO metrics (--file overrides), indexed locally by
+    # hostname; the list is checked for changes at most every
+    # _toaCheckInterval seconds, see srmvoproviders.toa
+    _toaFiles = {'ATLAS' : '/afs/cern.ch/user/d/digirola/public/nagios_atlas/project/src/SRM/org.atlas/src/ToA_srm2_list',
+                 'LHCb'  : '/afs/cern.ch/user/r/roiser/public/inproduction/ToA_srm2_list'}
+                 #'LHCb' : '/afs/cern.ch/user/s/santinel/public/www/ATP/ToA_srm2_list'
+    _toaFile = ''
+    _toaCheckInterval = 600
+
+    # VOPutThroughput/VOGetThroughput: size of the test file (MB), number
+    # of parallel streams and the rate (MB/s) below which they warn
+    _throughputSize    = 50
+    _throughputStreams = 1
+    _throughputMin     = 0
+
+    # VOCleanup: test files (_fileSRMPattern) older than _cleanupAge sec
+    # are deleted from the endpoint directories, _cleanupBatch SURLs per
+    # SRM request; directories are listed _cleanupListCount entries at a
+    # time
+    _cleanupAge       = 172800
+    _cleanupBatch     = 100
+    _cleanupListCount = 1000
+
+    # processes running the gfal/lcg_util calls, so that a call running
+    # past its deadline can be killed (None: one per endpoint tested in
+    # parallel, 0: run them in the probe process)
+    _callWorkers = None
+
+    # per-endpoint part of the VO metrics: metric -> method(srmendpt). With
+    # --pipeline consecutive ones of a sequence run as one chain per endpoint
+    _endpointStages = {'VOPut'           : '_voPutEndpoint',
+                       'VOLs'            : '_voLsEndpoint',
+                       'VOGetTURLs'      : '_voGetTURLsEndpoint',
+                       'VOGet'           : '_voGetEndpoint',
+                       'VODel'           : '_voDelEndpoint',
+                       'VOPutThroughput' : '_voPutThroughputEndpoint',
+                       'VOGetThroughput' : '_voGetThroughputEndpoint',
+                       'VOCleanup'       : '_voCleanupEndpoint'}
+    _pipeline = False
+
+    # metrics getting the endpoints, which run without lcg_util and gfal
+    _discoveryMetrics = ('GetSURLs', 'GetPFNFromTFC', 'RefreshToA',
+                         'GetATLASInfo', 'GetLHCbInfo')
     
     probeinfo = { 'probeName'      : ns+'.SRM-Probe',
                   'probeVersion'   : '1.0',
@@ -92,7 +1070,8 @@ class SRMVOMetrics(probe.MetricGatherer) :
     _metrics = { 
                'GetSURLs' : {'metricDescription': "Get full SRM endpoints and storage areas from BDII.",
                              'cmdLineOptions'   : ['ldap-uri=',
-                                                   'ldap-timeout='],
+                                                   'ldap-timeout=',
+                                                   'ldap-cache-ttl='],
                              'cmdLineOptionsReq' : [],
                              'metricChildren'   : ['LsDir','Put','Ls','GetTURLs','Get','Del']                            
                              },
@@ -110,6 +1089,13 @@ class SRMVOMetrics(probe.MetricGatherer) :
                                  'critical'         : 'N'
                              },
 
+               'RefreshToA' : {'metricDescription': "Re-read the ATLAS and LHCb ToA lists into the local index.",
+                                 'cmdLineOptions'   : [],
+                                 'cmdLineOptionsReq' : [],
+                                 'metricChildren'   : [],
+                                 'critical'         : 'N'
+                             },
+
                'GetPFNFromTFC' : {'metricDescription': "Get full SRM endpoints and space tokens from PhEDEx DataService TFC module.",
                              'cmdLineOptions'   : ['lfn='],
                              'cmdLineOptionsReq' : [],
@@ -117,7 +1103,7 @@ class SRMVOMetrics(probe.MetricGatherer) :
                              'critical'         :'N'
                              },
                'LsDir'    : {'metricDescription': "List content of VO's top level space area(s) in SRM.",
-                             'cmdLineOptions'   : ['se-timeout='],
+                             'cmdLineOptions'   : ['se-timeout='] + _timeoutOptions + _limitOptions,
                              'cmdLineOptionsReq' : [],                             
                              'metricChildren'   : [],
                              'critical'         : 'Y',
@@ -127,7 +1113,7 @@ class SRMVOMetrics(probe.MetricGatherer) :
                                                    'UNKNOWN' :'UNKNOWN: Problems listing Storage Path directory.'}
                              },
                'VOLsDir'    : {'metricDescription': "List content of VO's top level space area(s) in SRM.",
-                             'cmdLineOptions'   : ['se-timeout='],
+                             'cmdLineOptions'   : ['se-timeout='] + _timeoutOptions + _limitOptions,
                              'cmdLineOptionsReq' : [],                             
                              'metricChildren'   : [],
                              'critical'         : 'N',
@@ -137,18 +1123,19 @@ class SRMVOMetrics(probe.MetricGatherer) :
                                                    'UNKNOWN' :'UNKNOWN: Problems listing Storage Path directory.'}
                              },
                'Put'      : {'metricDescription': "Copy a local file to the SRM into default space area(s).",
-                             'cmdLineOptions'   : ['se-timeout='],
+                             'cmdLineOptions'   : ['se-timeout='] + _timeoutOptions + _limitOptions,
                              'cmdLineOptionsReq' : [],                             
                              'metricChildren'   : ['Ls','GetTURLs','Get','Del']
                              },
                'VOPut'      : {'metricDescription': "Copy a local file to the SRM into default space area(s).",
-                             'cmdLineOptions'   : ['se-timeout='],
+                             'cmdLineOptions'   : _timeoutOptions + _limitOptions + _breakerOptions + ['se-timeout=',
+                                                   'endpoint-concurrency='],
                              'cmdLineOptionsReq' : [],                             
                              'metricChildren'   : ['VOLs','VOGetTURLs','VOGet','VODel'],
                              'critical'         :'N'
                              },
                'Ls'       : {'metricDescription': "List (previously copied) file(s) on the SRM.",
-                             'cmdLineOptions'   : ['se-timeout='],
+                             'cmdLineOptions'   : ['se-timeout='] + _timeoutOptions + _limitOptions,
                              'cmdLineOptionsReq' : [],                             
                              'metricChildren'   : [],
                              'critical'         : 'Y',
@@ -158,7 +1145,7 @@ class SRMVOMetrics(probe.MetricGatherer) :
                                                    'UNKNOWN' :'UNKNOWN: Problems listing file(s).'}                                 
                              },
                'VOLs'       : {'metricDescription': "List (previously copied) file(s) on the SRM.",
-                             'cmdLineOptions'   : ['se-timeout='],
+                             'cmdLineOptions'   : ['se-timeout='] + _timeoutOptions + _limitOptions + _breakerOptions,
                              'cmdLineOptionsReq' : [],                             
                              'metricChildren'   : [],
                              'critical'         : 'N',
@@ -168,62 +1155,99 @@ class SRMVOMetrics(probe.MetricGatherer) :
                                                    'UNKNOWN' :'UNKNOWN: Problems listing file(s).'}                                 
                              },
                'GetTURLs' : {'metricDescription': "Get Transport URLs for the file copied to storage.",
-                             'cmdLineOptions'   : ['se-timeout=',
+                             'cmdLineOptions'   : _timeoutOptions + _limitOptions + ['se-timeout=',
                                                    'ldap-uri=',
-                                                   'ldap-timeout='],
+                                                   'ldap-timeout=',
+                                                   'ldap-cache-ttl='],
                              'cmdLineOptionsReq' : [],                             
                              'metricChildren'   : [],
                              'critical'         : 'Y'
                              },
                'VOGetTURLs' : {'metricDescription': "Get Transport URLs for the file copied to storage.",
-                             'cmdLineOptions'   : ['se-timeout=',
+                             'cmdLineOptions'   : _timeoutOptions + _limitOptions + _breakerOptions + ['se-timeout=',
                                                    'ldap-uri=',
-                                                   'ldap-timeout='],
+                                                   'ldap-timeout=',
+                                                   'ldap-cache-ttl='],
                              'cmdLineOptionsReq' : [],                             
                              'metricChildren'   : [],
                              'critical'         : 'N'
                              },
                'Get'      : {'metricDescription': "Copy given remote file(s) from SRM to a local file.",
-                             'cmdLineOptions'   : ['se-timeout='],
+                             'cmdLineOptions'   : _timeoutOptions + _limitOptions + ['se-timeout=',
+                                                   'get-verify='],
                              'cmdLineOptionsReq' : [],                             
                              'metricChildren'   : [],
                              'critical'         : 'Y'
                              },
                'VOGet'      : {'metricDescription': "Copy given remote file(s) from SRM to a local file.",
-                             'cmdLineOptions'   : ['se-timeout='],
+                             'cmdLineOptions'   : _timeoutOptions + _limitOptions + _breakerOptions + ['se-timeout=',
+                                                   'endpoint-concurrency=',
+                                                   'get-verify='],
                              'cmdLineOptionsReq' : [],                             
                              'metricChildren'   : [],
                              'critical'         : 'N'
                              },
                'Del'      : {'metricDescription': "Delete given file(s) from SRM.",
-                             'cmdLineOptions'   : ['se-timeout='],
+                             'cmdLineOptions'   : ['se-timeout='] + _timeoutOptions + _limitOptions,
                              'cmdLineOptionsReq' : [],                             
                              'metricChildren'   : [],
                              'critical'         : 'Y'
                              },
                'VODel'      : {'metricDescription': "Delete given file(s) from SRM.",
-                             'cmdLineOptions'   : ['se-timeout='],
+                             'cmdLineOptions'   : _timeoutOptions + _limitOptions + _breakerOptions + ['se-timeout=',
+                                                   'endpoint-concurrency='],
+                             'cmdLineOptionsReq' : [],                             
+                             'metricChildren'   : [],
+                             'critical'         : 'N'
+                             },
+               'VOPutThroughput' : {'metricDescription': "Measure the upload rate to the SRM space area(s) defined by VO.",
+                             'cmdLineOptions'   : _timeoutOptions + _limitOptions + _breakerOptions + ['se-timeout=',
+                                                   'endpoint-concurrency=',
+                                                   'throughput-size=',
+                                                   'nbstreams=',
+                                                   'min-throughput='],
+                             'cmdLineOptionsReq' : [],                             
+                             'metricChildren'   : ['VOGetThroughput'],
+                             'critical'         : 'N'
+                             },
+               'VOGetThroughput' : {'metricDescription': "Measure the download rate from the SRM space area(s) defined by VO.",
+                             'cmdLineOptions'   : _timeoutOptions + _limitOptions + _breakerOptions + ['se-timeout=',
+                                                   'endpoint-concurrency=',
+                                                   'nbstreams=',
+                                                   'min-throughput='],
                              'cmdLineOptionsReq' : [],                             
                              'metricChildren'   : [],
                              'critical'         : 'N'
                              },
+               'VOCleanup' : {'metricDescription': "Delete the test files left in the SRM space area(s) defined by VO.",
+                             'cmdLineOptions'   : _timeoutOptions + _limitOptions + _breakerOptions + ['se-timeout=',
+                                                   'endpoint-concurrency=',
+                                                   'cleanup-age=',
+                                                   'cleanup-batch='],
+                             'cmdLineOptionsReq' : [],
+                             'metricChildren'   : [],
+                             'critical'         : 'N'
+                             },
                'All'      : {'metricDescription': "Run all metrics.",
                              'cmdLineOptions'   : ['srmv='],
                              'cmdLineOptionsReq' : [],
                              'metricsOrder'     : ['GetSURLs','LsDir','Put','Ls','GetTURLs','Get','Del']
                              },
                'AllCMS'      : {'metricDescription': "Run all CMS metrics.",
-                             'cmdLineOptions'   : [],
+                             'cmdLineOptions'   : _breakerOptions + _limitOptions + ['pipeline',
+                                                   'endpoint-concurrency='],
                              'cmdLineOptionsReq' : [],
                              'metricsOrder'     : ['GetPFNFromTFC','VOLsDir','VOPut','VOLs','VOGetTURLs','VOGet','VODel']
                              },
                'AllATLAS'      : {'metricDescription': "Run all ATLAS metrics.",
-                             'cmdLineOptions'   : [],
+                             'cmdLineOptions'   : _breakerOptions + _limitOptions + ['pipeline',
+                                                   'endpoint-concurrency='],
                              'cmdLineOptionsReq' : [],
                              'metricsOrder'     : ['GetATLASInfo','VOLsDir','VOPut','VOLs','VOGet','VODel']
                              },
                'AllLHCb'      : {'metricDescription': "Run all LHCb non DIRAC specific  metrics.",
-                             'cmdLineOptions'   : [],
+                             'cmdLineOptions'   : _breakerOptions + _limitOptions + ['pipeline',
+                                                   'endpoint-concurrency='],
                              'cmdLineOptionsReq' : [],
                              'metricsOrder'     : ['GetLHCbInfo','VOLsDir','VOPut','VOLs','VOGet','VODel']
                              },
@@ -243,9 +1267,68 @@ class SRMVOMetrics(probe.MetricGatherer) :
 --ldap-uri <URI>       Format [ldap://]hostname[:port[/]] 
                        (Default: %s)
 --ldap-timeout <sec>   (Default: %i)   
+--ldap-cache-ttl <sec> Reuse BDII results for this long; 0 disables the 
+                       cache. Older results are used if the BDII fails. 
+                       (Default: %i)
     
 %s
 --se-timeout <sec>     (Default: %i)
+--metric-timeout <sec> Time a metric may take, per endpoint for the VO
+                       metrics. (Default: --se-timeout plus %i sec)
+--call-workers <n>     Run the SRM calls in n worker processes, killed when
+                       a call overruns its metric's time; the results of the
+                       other calls are still reported. 0 runs them in the
+                       probe itself. (Default: --endpoint-concurrency)
+--adaptive-timeouts    Time out every SRM call after the
+                       --timeout-percentile percentile plus --timeout-margin
+                       sec of the durations of the last %i successful calls
+                       of the same operation to the same host and space
+                       token, within what is left of --metric-timeout. Until
+                       %i such calls were seen, --se-timeout applies.
+--timeout-percentile <p>  (Default: %i)
+--timeout-margin <sec> (Default: %i)
+--se-max-requests <n>  SRM requests in flight to the host at a time, counting
+                       those of all the SRM probes on this machine; 0 for no
+                       limit. Time spent waiting for a slot is reported as
+                       wait_seconds. (Default: %i)
+--se-request-interval <sec>  Least time between the starts of two SRM
+                       requests to the host. (Default: %s)
+--se-limit-dir <dir>   Directory the probes share the limits in.
+                       (Default: %s)
+
+%s
+--circuit-breaker      Skip the endpoints that failed in --breaker-failures
+                       runs in a row with the same error. Every
+                       --breaker-cooldown sec they are probed with a single
+                       ls, and tested again once that works.
+--breaker-failures <n> (Default: %i)
+--breaker-cooldown <sec>  (Default: %i)
+
+%s
+--endpoint-concurrency <n>  Number of SRM endpoints (space tokens) tested
+                       in parallel. Each endpoint gets its own deadline
+                       of --se-timeout plus %i sec. (Default: %i)
+
+%s
+--throughput-size <MB> Size of the test file. (Default: %i)
+--nbstreams <n>        Parallel streams per transfer. (Default: %i)
+--min-throughput <MB/s>  Warn below this rate; 0 disables. (Default: %s)
+
+%s
+--cleanup-age <sec>    Delete the test files older than this left behind by
+                       failed or skipped Del metrics. (Default: %i)
+--cleanup-batch <n>    Files deleted per SRM request. (Default: %i)
+
+%s
+--pipeline             Run Put, Ls, GetTURLs, Get and Del of each endpoint
+                       as one chain, endpoints advancing independently
+                       (at most --endpoint-concurrency at a time) instead
+                       of each metric waiting for the slowest endpoint.
+
+%s
+--get-verify <%s>  'download': copy the file back and compare
+                       it. 'checksum': compare the checksum reported by the
+                       SE, download only if it reports none. (Default: %s)
 
 !!! NOT IMPLEMENTED YET !!!
 --sapath <SAPath,...>  Storage Area Path to be tested on SRM. Comma separated 
@@ -255,11 +1338,37 @@ class SRMVOMetrics(probe.MetricGatherer) :
      self.ns+'.SRM-{GetSURLs,GetTURLs}',
      self._ldap_url,
      self._timeouts['ldap_timelimit'],
+     self._bdiiCacheTTL,
      self.ns+'.SRM-{LsDir,Put,Ls,GetTURLs,Get,Del}',
-     self._timeouts['srm_connect'])
+     self._timeouts['srm_connect'],
+     self._endpointGrace,
+     self._latencyWindow,
+     self._latencyMinSamples,
+     self._timeoutPercentile,
+     self._timeoutMargin,
+     self._seMaxRequests,
+     self._seRequestInterval,
+     limit_dir(),
+     self.ns+'.SRM-{VOPut,VOLs,VOGetTURLs,VOGet,VODel,AllCMS,AllATLAS,AllLHCb}',
+     self._breakerFailures,
+     self._breakerCooldown,
+     self.ns+'.SRM-{VOPut,VOGet,VODel}',
+     self._endpointGrace,
+     self._endpointConcurrency,
+     self.ns+'.SRM-{VOPutThroughput,VOGetThroughput}',
+     self._throughputSize,
+     self._throughputStreams,
+     self._throughputMin,
+     self.ns+'.SRM-VOCleanup',
+     self._cleanupAge,
+     self._cleanupBatch,
+     self.ns+'.SRM-{AllCMS,AllATLAS,AllLHCb}',
+     self.ns+'.SRM-{Get,VOGet}',
+     '|'.join(self._getVerifyModes),
+     self._getVerify)
      
         # TODO: move to super class
-        # Need to be parametrized from CLI at runtime
+        # set by --metric-timeout
         self.childTimeout = 120 # timeout
 
         # initiate metrics description
@@ -271,42 +1380,83 @@ class SRMVOMetrics(probe.MetricGatherer) :
         # working directory for metrics
         self.make_workdir()
 
+        # debug output of endpoints tested in worker threads
+        self._endpointLog = threading.local()
+
+        # metric and endpoint of the SRM calls of the current thread, for
+        # their timings; every metric reports its timings as perfdata
+        self._timingContext = threading.local()
+        for metric, desc in self._metrics.items():
+            if not desc.has_key('metricsOrder'):
+                setattr(self, 'metric'+metric,
+                        self.timedMetric(metric, getattr(self, 'metric'+metric)))
+
+        # SRM session shared by the metrics of a metricAll() sequence
+        self._session = None
+
+        # metrics of the running sequence, and results of its VO metrics
+        # already run by the endpoint pipeline
+        self._sequence = []
+        self._pipelined = {}
+
+        # srmendpt -> VO metrics that failed for it in this run; their
+        # metricChildren are skipped for that endpoint
+        self._endpointFailures = {}
+
         # LDAP
         self._ldap_base = "o=grid"
         self._ldap_fileEndptSAPath = self.workdir_metric+"/EndpointAndPath"
+        self._ldap_cacheDir = self.workdir_metric+"/BDIICache"
+        self._bdiiCacheMarker = ''
         
         # files and patterns
         self._fileTest       = self.workdir_metric+'/testFile.txt'
         self._fileTestIn     = self.workdir_metric+'/testFileIn.txt'
         self._fileFilesOnSRM = self.workdir_metric+'/FilesOnSRM.txt'
         self._fileSRMPattern = 'testfile-put-%s-%s-%s.txt' # spacetoken, time, uuid
+        self._fileThroughput = self.workdir_metric+'/testFileThroughput.dat'
 
-        # Dictionary of extra SRM info for VOs, and file to save current version and history of dictionary
-        curhour=datetime.datetime.now().hour
-        self._fileHistoryVoInfoDictionary = self.workdir_metric+"/VOInfoDictionary_%s"%curhour
+        # Dictionary of extra SRM info for VOs, stored together with the
+        # history of test results in an SQLite database
+        self._fileVoInfoStore = self.workdir_metric+"/VOInfo.sqlite"
         self._fileVoInfoDictionary = self.workdir_metric+"/VOInfoDictionary"
-        #Read dictionary from current cache
+        self._voInfoStore = None
+        self._voInfoDictionary = {}
         try:
-            #Clean up stale current cache entries (older than 3 days) 
+            self._voInfoStore = self.openVoInfoStore()
+            #Clean up stale endpoints and old results
+            n = self._voInfoStore.expire(self._voInfoMaxAge, self._voHistoryMaxAge)
+            if n:
+                self.printd('Dropped %i stale endpoint(s) from VO Info store' % n)
+            self._voInfoDictionary = self._voInfoStore.load()
+            self.printd('Loading VO Info dictionary from %s' % self._fileVoInfoStore)
+        except sqlite3.Error, e:
+            self.printd('Cannot use VO Info store %s: %s; creating empty dictionary' % 
+                                (self._fileVoInfoStore, str(e)))
+        if self._voInfoStore and not self._voInfoDictionary:
+            self.importVoInfoDictionary()
+
+        # (space token, operation) -> durations of past SRM calls to the host
+        self._latencies = {}
+        if self._adaptiveTimeouts and self._voInfoStore:
             try:
-                modtime=os.path.getmtime(self._fileVoInfoDictionary)
-                if (time.time()-modtime>3*86400):
-                    self.printd('Stale VO Info cache file, deleting')
-                    os.remove(self._fileVoInfoDictionary)
-            except OSError:
-                self.printd('VO Info cache file not found')
-            self._voInfoDictionary = self.readVoInfoDictionary(self._fileVoInfoDictionary)
-            self.printd('Loading VO Info dictionary from cache')
-        except IOError:
-            self._voInfoDictionary = {}
-            self.printd('No cached VO Info dictionary; creating empty dictionary')
-        except KeyError:
-            self._voInfoDictionary = {}
-            os.remove(self._fileVoInfoDictionary)
-            self.printd('Cannot read cached VO Info dictionary; cleaning cache file and creating empty dictionary')
-            
+                self._latencies = self._voInfoStore.latencies(self.hostName,
+                                                              self._latencyWindow)
+            except sqlite3.Error, e:
+                self.printd('Cannot read SRM call latencies: %s' % str(e))
+
+        # circuit breakers of the endpoints as of the start of the run, and
+        # srmendpt -> what happened to the endpoint in this run
+        self._breakers = {}
+        self._breakerRun = {}
+        if self._circuitBreaker and self._voInfoStore:
+            try:
+                self._breakers = self._voInfoStore.breakers()
+            except sqlite3.Error, e:
+                self.printd('Cannot read circuit breakers: %s' % str(e))
+
         # lcg_util and GFAL versions
-        self.lcg_util_gfal_ver = gridutils.get_lcg_util_gfal_ver()
+        self.lcg_util_gfal_ver = get_lcg_util_gfal_ver()
 
 
     def parse_args(self, opts):
@@ -327,8 +1477,55 @@ class SRMVOMetrics(probe.MetricGatherer) :
                 os.environ['LCG_GFAL_INFOSYS'] = host+':'+port
             elif o in ('--ldap-timeout'):
                 self._timeouts['ldap_timelimit'] = int(v)
+            elif o in ('--ldap-cache-ttl'):
+                self._bdiiCacheTTL = int(v)
             elif o in ('--se-timeout'):
                 self._timeouts['srm_connect'] = int(v)
+            elif o in ('--call-workers'):
+                self._callWorkers = int(v)
+            elif o in ('--metric-timeout'):
+                self._metricTimeout = self.childTimeout = int(v)
+            elif o in ('--adaptive-timeouts'):
+                self._adaptiveTimeouts = True
+            elif o in ('--timeout-percentile'):
+                self._timeoutPercentile = float(v)
+            elif o in ('--timeout-margin'):
+                self._timeoutMargin = float(v)
+            elif o in ('--se-max-requests'):
+                self._seMaxRequests = int(v)
+            elif o in ('--se-request-interval'):
+                self._seRequestInterval = float(v)
+            elif o in ('--se-limit-dir'):
+                self._seLimitDir = v
+            elif o in ('--circuit-breaker'):
+                self._circuitBreaker = True
+            elif o in ('--breaker-failures'):
+                self._breakerFailures = int(v)
+            elif o in ('--breaker-cooldown'):
+                self._breakerCooldown = int(v)
+            elif o in ('--endpoint-concurrency'):
+                self._endpointConcurrency = int(v)
+            elif o in ('--throughput-size'):
+                self._throughputSize = int(v)
+            elif o in ('--nbstreams'):
+                self._throughputStreams = int(v)
+            elif o in ('--min-throughput'):
+                self._throughputMin = float(v)
+            elif o in ('--cleanup-age'):
+                self._cleanupAge = int(v)
+            elif o in ('--cleanup-batch'):
+                self._cleanupBatch = int(v)
+            elif o in ('--file'):
+                self._toaFile = v
+            elif o in ('--pipeline'):
+                self._pipeline = True
+            elif o in ('--get-verify'):
+                if v in self._getVerifyModes:
+                    self._getVerify = v
+                else:
+                    errstr = '--get-verify must be one of '+\
+                        ', '.join(self._getVerifyModes)+'. '+v+' given.'
+                    raise getopt.GetoptError(errstr)
     
     def __query_bdii(self, ldap_filter, ldap_attrlist, ldap_url=''):
         'Local wrapper for gridutils.query_bdii()'
@@ -344,27 +1541,144 @@ class SRMVOMetrics(probe.MetricGatherer) :
  ldap_timelimit: %i
  ldap_filter: %s
  ldap_attrlist: %s'''% (ldap_url, tl, ldap_filter, ldap_attrlist))
+        self._bdiiCacheMarker = ''
+        if self._bdiiCacheTTL <= 0:
+            return self.__query_bdii_live(ldap_filter, ldap_attrlist,
+                                          ldap_url, tl)
+
+        key = (ldap_url, ldap_filter, tuple(ldap_attrlist))
+        try:
+            cache = BDIICache(self._ldap_cacheDir, self._bdiiCacheTTL,
+                              self._bdiiCacheMaxStale)
+            lock = cache.lock(key)
+        except (IOError, OSError), e:
+            self.printd('WARNING: BDII cache unusable: %s' % str(e))
+            return self.__query_bdii_live(ldap_filter, ldap_attrlist,
+                                          ldap_url, tl)
+        try:
+            entry = cache.read(key)
+            if entry and entry[0] < cache.ttl:
+                self.printd('Using BDII result cached %i sec ago.' % entry[0])
+                return 1, entry[1]
+
+            rc, qres = self.__query_bdii_live(ldap_filter, ldap_attrlist,
+                                              ldap_url, tl)
+            if rc:
+                try:
+                    cache.write(key, qres)
+                except (IOError, OSError), e:
+                    self.printd('WARNING: cannot cache BDII result: %s' % str(e))
+            elif qres[0] != 0 and entry and entry[0] < cache.maxstale:
+                # only for a failed query: an empty set is the answer
+                self.printd('BDII query failed: %s' % qres[1])
+                self.printd('Using stale BDII result cached %i sec ago.' % entry[0])
+                self._bdiiCacheMarker = ' [stale BDII cache, %s old]' % \
+                                    str(datetime.timedelta(seconds=int(entry[0])))
+                return 1, entry[1]
+            return rc, qres
+        finally:
+            cache.unlock(lock)
+
+    def __query_bdii_live(self, ldap_filter, ldap_attrlist, ldap_url, tl):
         self.print_time()
         self.printd('Querying BDII %s' % ldap_url)
+        start = time.time()
         rc, qres = gridutils.query_bdii(ldap_filter, ldap_attrlist, 
                                     ldap_url=ldap_url, 
                                     ldap_timelimit=tl)
+        self.session().record('bdii', time.time() - start)
         self.print_time()
         return rc, qres
 
+    def printd(self, msg, v=1, cr=True):
+        "Buffer debug output of endpoint workers, see runEndpoints()."
+        lines = getattr(self._endpointLog, 'lines', None)
+        if lines is None:
+            probe.MetricGatherer.printd(self, msg, v=v, cr=cr)
+        else:
+            lines.append((msg, v, cr))
+
+    def print_time(self):
+        if getattr(self._endpointLog, 'lines', None) is None:
+            probe.MetricGatherer.print_time(self)
+        else:
+            self.printd(time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+    def errorMatcher(self):
+        "The shared matcher for self.errorDBFile, see get_error_matcher()."
+        return get_error_matcher(self.errorDBFile, self.errorTopics,
+                                 self.workdir_metric+'/ErrorsMatching.cache')
+
     def sig_term(self, sig, stack):
-        self.chldproc.kill(signal.SIGKILL)
+        """SIGALRM of a metric out of time: the SRM calls in flight are
+        killed and fail, so that the metric reports what it got so far."""
+        if self._session is None or not self._session.abort():
+            raise CallError('timed out after %i sec' % self.childTimeout)
+
+    def openVoInfoStore(self):
+        """Open the VO info store; an unreadable database is moved aside
+        and replaced by an empty one."""
+        try:
+            return VOInfoStore(self._fileVoInfoStore)
+        except sqlite3.DatabaseError, e:
+            corrupt = '%s.corrupt.%i' % (self._fileVoInfoStore, time.time())
+            self.printd('Cannot read VO Info store (%s); moving it to %s' % 
+                                (str(e), corrupt))
+            os.rename(self._fileVoInfoStore, corrupt)
+            return VOInfoStore(self._fileVoInfoStore)
+
+    def importVoInfoDictionary(self):
+        "Import the VO info dictionary pickled by earlier versions."
+        try:
+            if time.time()-os.path.getmtime(self._fileVoInfoDictionary) < \
+                    self._voInfoMaxAge:
+                fp = open(self._fileVoInfoDictionary, "r")
+                try:
+                    self._voInfoDictionary = pickle.load(fp)
+                finally:
+                    fp.close()
+                self.saveVoInfoDictionary()
+                self.printd('Imported VO Info dictionary from %s' % 
+                                    self._fileVoInfoDictionary)
+            os.remove(self._fileVoInfoDictionary)
+        except (OSError, IOError):
+            pass
+        except Exception, e:
+            self._voInfoDictionary = {}
+            self.printd('Cannot import VO Info dictionary: %s' % str(e))
 
-    def saveVoInfoDictionary(self,filename):
-        fp = open(filename, "w")
-        pickle.dump(self._voInfoDictionary,fp)
-        fp.close()
-                
-    def readVoInfoDictionary(self,filename):
-        fp = open(filename, "r")
-        voInfoDict=pickle.load(fp)
-        fp.close()
-        return voInfoDict
+    def saveVoInfoDictionary(self, endpoints=None):
+        """Store the given (default: all) endpoints of the VO info dictionary.
+
+        Only endpoints just (re)discovered should be passed, storing an
+        endpoint marks it as current for the retention policy.
+        """
+        if self._voInfoStore is None:
+            return
+        if endpoints is None:
+            endpoints = self._voInfoDictionary.keys()
+        try:
+            for srmendpt in endpoints:
+                self._voInfoStore.save(srmendpt, self._voInfoDictionary[srmendpt])
+        except sqlite3.Error, e:
+            self.printd('Error saving VO Info Dictionary to %s: %s' % 
+                                (self._fileVoInfoStore, str(e)))
+
+    def saveVoResults(self, VOtest, extra=()):
+        """Store the VOtest result of every endpoint and add it to the history.
+
+        The keys in extra are stored along with the result.
+        """
+        if self._voInfoStore is None:
+            return
+        for srmendpt, info in self._voInfoDictionary.items():
+            if not info.has_key(VOtest):
+                continue
+            try:
+                self._voInfoStore.update(srmendpt, info, VOtest, extra)
+            except sqlite3.Error, e:
+                self.printd('Error saving %s of %s to %s: %s' % 
+                                    (VOtest, srmendpt, self._fileVoInfoStore, str(e)))
 
     def weightEndpointCriticality(self,VOtest):
         DetailedMsg=''
@@ -398,6 +1712,430 @@ class SRMVOMetrics(probe.MetricGatherer) :
           return ('UNKNOWN' ,str(DetailedMsg))
         return ('OK' ,str(DetailedMsg)) # all OK
 
+    def runEndpoints(self, func, timeout=None):
+        """Run func(srmendpt) for all endpoints in the VO info dictionary.
+
+        Up to --endpoint-concurrency endpoints are tested at a time, each
+        given timeout seconds (default: metricBudget()).
+        Returns a dictionary srmendpt -> (status, summary). Debug output of
+        every endpoint is printed in one block once all of them are done.
+        """
+        endpoints = self._voInfoDictionary.keys()
+        if timeout is None:
+            timeout = self.metricBudget()
+        if self.session().workers:
+            # the calls of a stage are killed at its deadline, so that it
+            # reports what it got; this one is only the backstop
+            timeout += self._endpointGrace
+        logs = {}
+
+        def call(srmendpt):
+            self._endpointLog.lines = logs[srmendpt] = []
+            try:
+                return func(srmendpt)
+            finally:
+                self._endpointLog.lines = None
+
+        pool = EndpointPool(self._endpointConcurrency, timeout)
+        self.printd('Testing %i endpoint(s), %i at a time.' % 
+                            (len(endpoints), pool.size))
+        pool.run(call, endpoints)
+
+        results = {}
+        for srmendpt in endpoints:
+            self.printd('===== %s' % srmendpt)
+            for msg, v, cr in logs.get(srmendpt, []):
+                self.printd(msg, v=v, cr=cr)
+            if pool.results.has_key(srmendpt):
+                results[srmendpt] = pool.results[srmendpt]
+            elif pool.errors.has_key(srmendpt):
+                e = pool.errors[srmendpt]
+                self.printd('ERROR: %s' % str(e))
+                results[srmendpt] = ('UNKNOWN', 'Exception: %s' % str(e))
+            else:
+                self.printd('ERROR: no result after %i sec' % timeout)
+                results[srmendpt] = ('UNKNOWN',
+                                     'Timed out after %i sec.' % timeout)
+        return results
+
+    def endpointResults(self, metric):
+        """Results of the per-endpoint stage of a VO metric.
+
+        Returns srmendpt -> (status, summary). With --pipeline the first VO
+        metric of a sequence runs the stages of the VO metrics following it
+        as well, see runPipeline(); those then just pick up their results.
+        """
+        if self._pipelined.has_key(metric):
+            return self._pipelined.pop(metric)
+        results = self._endpointResults(metric)
+        for srmendpt, result in results.items():
+            # failed by timeout or exception outside of runStage()
+            if result[0] in ('CRITICAL', 'UNKNOWN') and \
+                    metric not in self._endpointFailures.get(srmendpt, []):
+                self._endpointFailures.setdefault(srmendpt, []).append(metric)
+        return results
+
+    def _endpointResults(self, metric):
+        stages = [metric]
+        if self._pipeline and metric in self._sequence:
+            for m in self._sequence[self._sequence.index(metric)+1:]:
+                if not self._endpointStages.has_key(m):
+                    break
+                stages.append(m)
+        if len(stages) == 1:
+            return self.runEndpoints(lambda srmendpt:
+                                            self.runStage(metric, srmendpt))
+        results = self.runPipeline(stages)
+        for m in stages[1:]:
+            self._pipelined[m] = results[m]
+        return results[metric]
+
+    def runPipeline(self, stages):
+        """Run the stages (VO metric names) as one chain per endpoint.
+
+        An endpoint moves on to its next stage as soon as its previous one
+        is done, independently of the others. The chain gets the budget
+        of all its stages; stages it did not reach in time are reported as
+        timed out. Returns metric -> {srmendpt: (status, summary)}.
+        """
+        self.printd('Pipelining %s per endpoint.' % ', '.join(stages))
+        done = dict([(m, {}) for m in stages])
+
+        def chain(srmendpt):
+            for m in stages:
+                try:
+                    done[m][srmendpt] = self.runStage(m, srmendpt)
+                except Exception, e:
+                    self.printd('ERROR in %s: %s' % (m, str(e)))
+                    done[m][srmendpt] = ('UNKNOWN', 'Exception: %s' % str(e))
+            return ('OK', '')
+
+        timeout = len(stages)*self.metricBudget()
+        chains = self.runEndpoints(chain, timeout)
+
+        # copy: the chain of an endpoint given up may still be running
+        results = {}
+        for m in stages:
+            results[m] = {}
+            for srmendpt, result in chains.items():
+                results[m][srmendpt] = done[m].get(srmendpt, result)
+        return results
+
+    def failedParent(self, metric, srmendpt):
+        "The metric having metric as child that failed for srmendpt, or None."
+        for parent in self._endpointFailures.get(srmendpt, []):
+            if metric in self._metrics[parent].get('metricChildren', []):
+                return parent
+        return None
+
+    def runStage(self, metric, srmendpt):
+        """Run the per-endpoint stage of a VO metric for srmendpt.
+
+        If the circuit of the endpoint is open (see breakerGate()), or a
+        parent metric failed for it in this run, no SRM request is made and
+        the stage is reported as skipped.
+        """
+        self._timingContext.metric = metric
+        self._timingContext.endpoint = srmendpt
+        self._timingContext.deadline = time.time() + self.metricBudget()
+        try:
+            gate = self.breakerGate(srmendpt)
+            if gate:
+                self.printd('%s %s' % (metric, gate[1]))
+                return gate
+            parent = self.failedParent(metric, srmendpt)
+            if parent:
+                self.printd('%s skipped: parent %s failed.' % (metric, parent))
+                return ('UNKNOWN', 'skipped: parent %s failed' % parent)
+            try:
+                result = getattr(self, self._endpointStages[metric])(srmendpt)
+            except Exception, e:
+                # counted as a failure below: children are skipped, and the
+                # breaker of the endpoint sees it
+                self.printd('%s failed: %s %s' % (metric, str(e),
+                                                  sys.exc_info()[0]))
+                result = ('UNKNOWN', 'error running the test: %s' % str(e))
+        finally:
+            self._timingContext.metric = self._timingContext.endpoint = None
+            self._timingContext.deadline = None
+        result = self.breakerOutcome(srmendpt, result)
+        if result[0] in ('CRITICAL', 'UNKNOWN'):
+            self._endpointFailures.setdefault(srmendpt, []).append(metric)
+        return result
+
+    def breakerGate(self, srmendpt):
+        """With --circuit-breaker: None if srmendpt is to be tested in this
+        run, else the (status, summary) to report instead for its metrics.
+
+        Decided on the first call of the run for the endpoint: an open
+        endpoint due for a probe is listed here with a single ls, and is
+        tested if that works (half-open).
+        """
+        if not self._circuitBreaker:
+            return None
+        # every endpoint is tested by one thread at a time
+        run = self._breakerRun.get(srmendpt)
+        if run is None:
+            run = self._breakerRun[srmendpt] = self.breakerDecide(srmendpt)
+        return run['gate']
+
+    def breakerDecide(self, srmendpt):
+        now = time.time()
+        run = {'time'     : now,
+               'gate'     : None,
+               'probed'   : False,
+               'halfOpen' : False,
+               'ran'      : False,
+               'failed'   : None}
+        breaker = self._breakers.get(srmendpt)
+        if breaker is None or breaker['state'] == 'closed':
+            return run
+        if now < breaker['retry']:
+            run['gate'] = (breaker['status'], 
+                           'skipped: circuit open after %i failure(s) since %s '
+                           '(%s), next probe at %s' % 
+                           (breaker['failures'], stamp(breaker['opened']),
+                            breaker['summary'], stamp(breaker['retry'])))
+            return run
+        self.printd('Circuit of %s open since %s, probing it.' % 
+                            (srmendpt, stamp(breaker['opened'])))
+        run['probed'] = True
+        status, summary, gfalstatuses = self.lsSURLs([srmendpt],
+                                    'storage url', 'Storage Path', 'Storage Path[%s]')
+        if status in ('CRITICAL', 'UNKNOWN'):
+            run['failed'] = (status, summary)
+            run['gate'] = (breaker['status'],
+                           'skipped: circuit open since %s, probe failed (%s), '
+                           'next probe at %s' % 
+                           (stamp(breaker['opened']), summary.strip(),
+                            stamp(now + self._breakerCooldown)))
+        else:
+            run['halfOpen'] = True
+        return run
+
+    def breakerOutcome(self, srmendpt, result):
+        "Note the result of a metric for srmendpt; returns it for reporting."
+        run = self._breakerRun.get(srmendpt)
+        if run is None:
+            return result
+        run['ran'] = True
+        if result[0] in ('CRITICAL', 'UNKNOWN') and not run['failed']:
+            run['failed'] = result[:2]
+        if run['halfOpen']:
+            result = (result[0], 'circuit half-open: ' + result[1]) + \
+                     tuple(result[2:])
+        return result
+
+    def breakerNext(self, breaker, run):
+        "The circuit breaker of an endpoint after the run."
+        now = run['time']
+        closed = {'state'    : 'closed',
+                  'failures' : 0,
+                  'status'   : 'OK',
+                  'error'    : '',
+                  'summary'  : '',
+                  'opened'   : 0,
+                  'retry'    : 0}
+        breaker = dict(breaker or closed)
+        if run['failed'] is None:
+            if run['ran']:
+                return closed
+            return breaker
+        status, summary = run['failed']
+        if run['probed'] and not run['halfOpen']:
+            breaker['failures'] += 1
+            breaker['retry'] = now + self._breakerCooldown
+            return breaker
+        # the same error, whatever the numbers in its message
+        error = re.sub(r'\d+', '#', summary.strip())
+        if breaker['state'] == 'closed' and error != breaker['error']:
+            breaker['failures'] = 0
+        breaker['failures'] += 1
+        breaker['status'] = status
+        breaker['error'] = error
+        breaker['summary'] = summary.strip()[:200]
+        if breaker['state'] != 'closed' or \
+                breaker['failures'] >= self._breakerFailures:
+            if breaker['state'] == 'closed':
+                breaker['opened'] = now
+            breaker['state'] = 'open'
+            breaker['retry'] = now + self._breakerCooldown
+        return breaker
+
+    def saveBreakers(self):
+        "Store the circuit breakers of the endpoints tested in this run."
+        if not self._breakerRun or self._voInfoStore is None:
+            return
+        try:
+            for srmendpt, run in self._breakerRun.items():
+                self._voInfoStore.saveBreaker(srmendpt, 
+                        self.breakerNext(self._breakers.get(srmendpt), run))
+        except sqlite3.Error, e:
+            self.printd('Cannot store circuit breakers: %s' % str(e))
+
+    def timedMetric(self, metric, func):
+        "Wrap metric function func to report the timings of its SRM calls."
+        def timed(*args, **kwargs):
+            if metric not in self._discoveryMetrics:
+                # imported here rather than by the calls, whose errors the
+                # metrics report as failed SRM operations
+                try:
+                    client_module('lcg_util')
+                    client_module('gfal')
+                except ImportError, e:
+                    self.printd('ERROR: %s' % str(e))
+                    return ('UNKNOWN', 'Error loading modules : %s' % e)
+            self._timingContext.metric = metric
+            self._timingContext.endpoint = None
+            self._timingContext.deadline = time.time() + self.childTimeout
+            try:
+                try:
+                    result = func(*args, **kwargs)
+                finally:
+                    # the watchdog of the ls metrics (see sig_term()) must
+                    # not abort the calls of the metrics after them
+                    signal.alarm(0)
+                    self._timingContext.metric = None
+                    self._timingContext.deadline = None
+                    self.saveBreakers()
+                return self.addTimings(metric, result)
+            finally:
+                # a standalone metric closes the session session() made for it
+                if not self._sequence and self._session is not None:
+                    self._session.close()
+                    self._session = None
+        timed.__doc__ = func.__doc__
+        return timed
+
+    def metricBudget(self):
+        "Seconds a VO metric may take per endpoint."
+        return self._metricTimeout or \
+               self._timeouts['srm_connect'] + self._endpointGrace
+
+    def spaceToken(self, srmendpt):
+        "Space token of srmendpt, '' for None (the non-VO metrics)."
+        if not srmendpt:
+            return ''
+        return str(self._voInfoDictionary.get(srmendpt, {}).get(
+                                        'space_token') or srmendpt)
+
+    def callTimeout(self, op):
+        """Timeout (sec) of an SRM call of operation op (put, get, ls, del,
+        getturl, setdone) by the calling thread, see --adaptive-timeouts."""
+        timeout = self._timeouts['srm_connect']
+        if not self._adaptiveTimeouts:
+            return timeout
+        samples = self._latencies.get(
+            (self.spaceToken(getattr(self._timingContext, 'endpoint', None)), op), [])
+        if len(samples) >= self._latencyMinSamples:
+            timeout = percentile(samples, self._timeoutPercentile) + \
+                      self._timeoutMargin
+        deadline = getattr(self._timingContext, 'deadline', None)
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.time())
+        return max(1, int(math.ceil(timeout)))
+
+    def recordLatencies(self, metric, timings):
+        "Add the durations of the successful SRM calls of metric to the store."
+        if self._voInfoStore is None or metric in self._latencyExcluded:
+            return
+        latencies = [(self.spaceToken(srmendpt), phase, elapsed) for
+                     srmendpt, phase, elapsed, ok in timings if ok and
+                     phase in ('put', 'get', 'ls', 'del', 'getturl', 'setdone')]
+        if not latencies:
+            return
+        try:
+            self._voInfoStore.addLatencies(self.hostName, latencies)
+        except sqlite3.Error, e:
+            self.printd('Cannot store SRM call latencies: %s' % str(e))
+
+    def addTimings(self, metric, result):
+        """Append the timings of the SRM calls of metric to its result as
+        Nagios perfdata, per endpoint, and write them to the JSON file
+        Timings.<metric>.json in the metric's working directory."""
+        timings = self.session().takeTimings(metric)
+        self.recordLatencies(metric, timings)
+        if not timings or not isinstance(result, tuple) or len(result) < 2:
+            return result
+
+        # seconds per phase and endpoint ('' for the metric as a whole)
+        phases = {}
+        for srmendpt, phase, elapsed, ok in timings:
+            d = phases.setdefault(srmendpt or '', {})
+            d[phase] = d.get(phase, 0.0) + elapsed
+        perf = []
+        for srmendpt in sorted(phases.keys()):
+            prefix = ''
+            if srmendpt:
+                prefix = self.spaceToken(srmendpt) + '_'
+            for phase in sorted(phases[srmendpt].keys()):
+                perf.append(perfdata('%s%s_seconds' % (prefix, phase),
+                                     phases[srmendpt][phase], 's'))
+
+        sidecar = '%s/Timings.%s.json' % (self.workdir_metric, metric)
+        try:
+            import simplejson
+            fp = open(sidecar+'.tmp', 'w')
+            try:
+                simplejson.dump({'metric'    : metric,
+                                 'hostName'  : self.hostName,
+                                 'time'      : int(time.time()),
+                                 'status'    : result[0],
+                                 'endpoints' : phases}, fp)
+            finally:
+                fp.close()
+            os.rename(sidecar+'.tmp', sidecar)
+        except (ImportError, IOError, OSError), e:
+            self.printd('Cannot write %s: %s' % (sidecar, str(e)))
+
+        summary = result[1].rstrip('\n')
+        if '|' in summary:
+            summary += ' ' + ' '.join(perf)
+        else:
+            summary += ' | ' + ' '.join(perf)
+        return (result[0], summary) + tuple(result[2:])
+
+    def session(self):
+        "The current SRMSession; a new one if no sequence is running."
+        if self._session is None:
+            self._session = self.newSession()
+        return self._session
+
+    def newSession(self):
+        workers = self._callWorkers
+        if workers is None:
+            workers = max(1, self._endpointConcurrency)
+        limiter = None
+        if self._seMaxRequests or self._seRequestInterval:
+            try:
+                limiter = SELimiter(self._seLimitDir or limit_dir(),
+                                    self.hostName, self._seMaxRequests,
+                                    self._seRequestInterval)
+            except OSError, e:
+                self.printd('Cannot limit the SRM requests to %s: %s' %
+                                    (self.hostName, str(e)))
+        return SRMSession(self._timingContext, workers, self.metricBudget(),
+                          limiter)
+
+    def metricAll(self, *args, **kwargs):
+        "Run the metrics of the sequence in one SRM session."
+        if self._session is not None:
+            self._session.close()
+        self._session = self.newSession()
+        self._sequence = self._metrics[(args + ('All',))[0]]['metricsOrder']
+        self._pipelined = {}
+        self._endpointFailures = {}
+        self._breakerRun = {}
+        try:
+            return probe.MetricGatherer.metricAll(self, *args, **kwargs)
+        finally:
+            self._session.close()
+            self.printd(self._session.report())
+            self._session = None
+            self._sequence = []
+            self._pipelined = {}
+            self._endpointFailures = {}
+
     def metricAllCMS(self):
         return self.metricAll('AllCMS')
 
@@ -442,11 +2180,12 @@ class SRMVOMetrics(probe.MetricGatherer) :
         if not res[k]:
             return ('CRITICAL',
                     "%s is not published for %s in %s" % \
-                    (k, self.hostName, self._ldap_url))
+                    (k, self.hostName, self._ldap_url) + self._bdiiCacheMarker)
         elif len(res[k]) > 1:
             return ('CRITICAL',
                     "More than one SRMv"+self.svcVer+" "+\
-                    k+" is published for "+self.hostName+": "+', '.join(res[k]))
+                    k+" is published for "+self.hostName+": "+', '.join(res[k]) +\
+                    self._bdiiCacheMarker)
         else:
             endpoint = res[k][0]
 
@@ -465,7 +2204,8 @@ class SRMVOMetrics(probe.MetricGatherer) :
             # GlueSAPath or GlueVOInfoPath is not published
             return ('CRITICAL', 
                     "GlueVOInfoPath or GlueSAPath not published for %s in %s" % \
-                    (res['GlueServiceEndpoint'][0], self._ldap_url))
+                    (res['GlueServiceEndpoint'][0], self._ldap_url) +\
+                    self._bdiiCacheMarker)
         
         eps = [ endpoint.replace('httpg','srm',1)+'?SFN='+sp+"\n" for sp in storpaths]
         self.printd('SRM endpoint(s) to test:')
@@ -483,224 +2223,118 @@ class SRMVOMetrics(probe.MetricGatherer) :
             except: pass
             return ('UNKNOWN', 'IOError: %s' % str(e))
 
-        return ('OK', "Got SRM endpoint(s) and Storage Path(s) from BDII")
+        return ('OK', "Got SRM endpoint(s) and Storage Path(s) from BDII" +\
+                    self._bdiiCacheMarker)
+
+    def provider(self, name):
+        "VO provider module srmvoproviders.<name>, imported on first use."
+        return __import__('srmvoproviders.' + name, globals(), locals(), [name])
 
     def metricGetPFNFromTFC(self,testLFN="/store/unmerged/SAM/testSRM"):
         """Get full SRM endpoint(s) and storage areas from PhEDEx DataService.
         """
+        return self.provider('cms').get_info(self, testLFN)
 
-        #URLs for PhEDEx DataService for lfn2pfn
-
-        tfcURL="http://cmsweb.cern.ch/phedex/datasvc/json/prod/lfn2pfn?node="
-        pfnMatchURL="&lfn="
-        pfnProtocolOption = "&protocol=srmv2"
-        destinationOption = "&destination="
-        custodialOption = "&custodial="
-
-        #Path of text file with list of SRM endpoints
-        seMapFileURL="http://cern.ch/magini/phedex-v2-endpoints.txt"
-        nodeName = self.hostName
-
-        # LFN path for file to test transfers
-        self.printd('The LFN used for testing will be in: '+testLFN)
-        
-        try:
-            self.printd('Retrieving list of endpoints to test at: %s' % seMapFileURL)
-            siteNameFile=urllib2.urlopen(seMapFileURL)
-        except urllib2.URLError:
-            self.printd("WARNING: unable to open URL with SRM list")
-            return('UNKNOWN',"Unable to open URL with SRM list")
-
-        outputList={}
-        for siteLine in siteNameFile.readlines():
-            endpointName=siteLine.split()[0]
-            siteName=siteLine.split()[1]
-        
-            if endpointName == nodeName:
-                
-                self.printd(nodeName+" is listed as SRM for Site "+siteName)
-                
-                # Contact web service to get PFN and spacetoken for non-custodial transfers
-                endpointLFN = "/SAM-%s" % endpointName
-
-                # Testing only non-custodial area - don't want to clutter custodial area with small files at T1s
-                custodiality = "n"
-                    
-                pfnUrl = tfcURL+siteName+pfnMatchURL+testLFN+endpointLFN+pfnProtocolOption+destinationOption+siteName+custodialOption+custodiality
-                self.printd("Setting custodiality flag="+custodiality)
-                self.printd("Contacting webservice to perform LFN-to-PFN matching at URL:")
-                self.printd(pfnUrl)
-
-                try:
-                    pfnFile=urllib2.urlopen(pfnUrl)
-                except urllib2.URLError:
-                    self.printd('WARNING: Unable to open PhEDEx DataService lfn2pfn URL to perform LFN-to-PFN matching for Site %s' % siteName)
-                    continue
-
-                pfnJSON = simplejson.load(pfnFile)
-                
-                try:
-                    pfn = (((pfnJSON[u'phedex'])[u'mapping'])[0])[u'pfn']
-                    spacetoken = (((pfnJSON[u'phedex'])[u'mapping'])[0])[u'space_token']
-                except KeyError:
-                    try:
-                        errormsg = pfnJSON[u'error']
-                    except KeyError:
-                        self.printd('WARNING: Unknown error from PhEDEx DataService')
-                        continue
-                    self.printd("Error from PhEDEx DataService: ")
-                    self.printd(errormsg)
-                    self.printd("Possibly the site is not running a FileExport agent for the Prod instance of PhEDEx")
-                    continue
-                
-                if pfn == None:
-                    self.printd("ERROR: LFN did not match to any PFN - probably the TFC does not contain any rule for the srmv2 protocol.")
-                    continue
-                
-                self.printd("LFN was matched to PFN "+pfn)
-                if spacetoken:
-                    spacetokendesc=spacetoken
-                    self.printd("In space token "+spacetoken+" for custodiality="+custodiality)
-                else:
-                    spacetokendesc="nospacetoken"
-                    self.printd("No space token defined for custodiality="+custodiality)
-
-                if re.compile("^srm://.+srm/managerv2\?SFN=.+$").match(pfn) or re.compile("^srm://.+srm/v2/server\?SFN=.+$").match(pfn):
-                    pfntonode=re.sub(":.+$","",re.sub("^srm://","",pfn))
-                    if pfntonode!=nodeName :
-                        self.printd("WARNING: the resulting PFN matches to SRM "+pfntonode+" instead of SRM "+nodeName)
-                        continue
-                    else:
-                        fn = self._fileSRMPattern % (spacetokendesc,str(int(time.time())), 
-                                                     samutils.uuidstr())
-                        outputList[pfn]={'fn': fn, 'space_token': spacetoken, 'userspace' : testLFN}
-                else:
-                    self.printd("WARNING: Invalid matching to srmv2 protocol")
-                    self.printd("Note: this test currently supports only PFNs in the known srmv2 full endpoint formats:")
-                    self.printd("srm://hostname:port/srm/managerv2?SFN=sitefilename")
-                    self.printd("or")
-                    self.printd("srm://hostname:port/srm/v2/server?SFN=sitefilename")
-
-        # Extract a random PFN from the dictionary of PFN matches. It will be used for testing, other PFN matches will be ignored
-        # Print warning if not all PFN matches are the same.
-        try:
-            outputPfn=outputList.popitem()
-        except KeyError:
-            self.printd("WARNING: "+nodeName+" not found in SRM list")
-            return('UNKNOWN',"WARNING: "+nodeName+" not found in SRM list")
-
-        for otherOutputPfns in outputList:
-            if otherOutputPfns != outputPfn:
-                self.printd("WARNING: PFN matching was not the same on all PhEDEx nodes associated to SRM "+nodeName)
-
-        self.printd("The PFN path used for testing will be:")
-        self.printd(str(outputPfn))
-        
-        self._voInfoDictionary[outputPfn[0]]=outputPfn[1]
-
-        self.printd('Saving endpoints to %s' % self._fileVoInfoDictionary, v=2)
-        self.printd('Test results will be saved to %s' % self._fileHistoryVoInfoDictionary, v=2)
-
-        try:
-            self.saveVoInfoDictionary(self._fileVoInfoDictionary)
-        except IOError:
-            self.printd('Error saving VO Info Dictionary to file %s' % self._fileVoInfoDictionary)
-        try:
-            self.saveVoInfoDictionary(self._fileHistoryVoInfoDictionary)
-        except IOError:
-            self.printd('Error saving VO Info Dictionary history to file %s' % self._fileHistoryVoInfoDictionary)
-
-        return ('OK', "Got PFN and Space Token from PhEDEx DataService")
+    def metricRefreshToA(self):
+        "Re-read the ToA lists into the local index."
+        return self.provider('toa').refresh(self)
 
     def metricGetATLASInfo(self):
         """Get full SRM endpoint(s) and storage areas from ToACache.
         """
-        agis_file="/afs/cern.ch/user/d/digirola/public/nagios_atlas/project/src/SRM/org.atlas/src/ToA_srm2_list"         
-        agis=open(agis_file, 'r')
-        agis_endpoint_info=[]
-        for entry in agis:
-          if entry.find(self.hostName) != -1:
-            #print entry
-            agis_endpoint_info.append(entry[:-1])
-            spacetokendesc=entry.split()[1]
-            fn = self._fileSRMPattern % (spacetokendesc,str(int(time.time())),
-                                                     samutils.uuidstr())
-            if spacetokendesc in ('ATLASDATADISK','ATLASMCDISK','ATLASGROUPDISK'):
-              criticality=1
-            else: 
-              criticality=0
-            #endpoint (spacetoken) criticality
-            agis_endpoint_details = {
-              'fn': fn, 
-              'space_token': spacetokendesc,
-              'criticality': criticality,
-            }
-            self._voInfoDictionary[entry.split()[0]+'SAM']=agis_endpoint_details
-
-        #print agis_endpoint_info
-        self.printd(str(agis_endpoint_info))
-        self.printd(str(self._voInfoDictionary))
-        try:
-          fp = open(self._ldap_fileEndptSAPath, "w")
-          for info in agis_endpoint_info:
-            ep=info.split()[0]+'\n'   
-            fp.write(ep)
-          fp.close()
-        except IOError, e:
-          try:
-            os.unlink(self._ldap_fileEndptSAPath)
-          except: pass
-          return ('UNKNOWN', 'IOError: %s' % str(e))
-
- 
-        #print self._ldap_fileEndptSAPath
-        return ('OK',"Endpoint informations found in ToA cached file ")
-
+        return self.provider('atlas').get_info(self)
 
     def metricGetLHCbInfo(self):
         """Get full SRM endpoint(s) and storage areas from ToACache.
         """
-        dirac_file="/afs/cern.ch/user/r/roiser/public/inproduction/ToA_srm2_list"
-        #dirac_file="/afs/cern.ch/user/s/santinel/public/www/ATP/ToA_srm2_list"
-        dirac=open(dirac_file, 'r')
-        dirac_endpoint_info=[]
-        for entry in dirac:
-          if entry.find(self.hostName) != -1:
-            #print entry
-            dirac_endpoint_info.append(entry[:-1])
-            spacetokendesc=entry.split()[1]
-            fn = self._fileSRMPattern % (spacetokendesc,str(int(time.time())),
-                                                     samutils.uuidstr())
-            if spacetokendesc in ('LHCb_USER','LHCb_M-DST','LHCb_RAW'):
-              criticality=1
+        return self.provider('lhcb').get_info(self)
+
+    def lsSURLs(self, srms, listing, problem, label):
+        """List SURLs with gfal_ls() in the current SRM session.
+
+        Returns (status, summary, gfalstatuses); gfalstatuses is None if the
+        SURLs could not be listed at all.
+        """
+
+        status = 'OK'
+        summary = ''
+        session = self.session()
+
+        req = {'surls'          : srms,
+               'defaultsetype'  : 'srmv'+self.svcVer,
+               'setype'         : 'srmv'+self.svcVer,
+               'no_bdii_check'  : 1,
+               'timeout'        : self.callTimeout('ls'),
+               'srmv2_lslevels' : 0               
+               }
+        gfalstatuses = session.cachedLs(srms)
+        if gfalstatuses is not None:
+            self.printd('Reusing gfal_ls() results of this SRM session.')
+        else:
+            self.printd('Using gfal_ls().') 
+            self.printd('Parameters:\n%s' % '\n'.join(
+                            ['  %s: %s' % (x,str(y)) for x,y in req.items()]))
+            errmsg = ''
+            try:
+                (rc, gfalobj, errmsg) = session.call('gfal_init', req)
+            except (MemoryError, CallError), e:
+                summary = 'error initialising GFAL: %s' % str(e)
+                self.printd('ERROR: %s' % summary)
+                return ('UNKNOWN', summary, None)
             else:
-              criticality=0
-            #endpoint (spacetoken) criticality
-            dirac_endpoint_details = {
-              'fn': fn, 
-              'space_token': spacetokendesc,
-              'criticality': criticality,
-            }
-            self._voInfoDictionary[entry.split()[0]+'/SAM']=dirac_endpoint_details
-
-        #print dirac_endpoint_info
-        self.printd(str(dirac_endpoint_info))
-        self.printd(str(self._voInfoDictionary))
-        try:
-          fp = open(self._ldap_fileEndptSAPath, "w")
-          for info in dirac_endpoint_info:
-            ep=info.split()[0]+'\n'
-            fp.write(ep)
-          fp.close()
-        except IOError, e:
-          try:
-            os.unlink(self._ldap_fileEndptSAPath)
-          except: pass
-          return ('UNKNOWN', 'IOError: %s' % str(e))
+                if rc != 0:
+                    summary = 'problem initialising GFAL: %s' % errmsg
+                    self.printd('ERROR: %s' % summary)
+                    return ('UNKNOWN', summary, None)
+            session.free(gfalobj)
+
+            self.print_time()
+            self.printd('Listing %s.' % listing)
+            try:
+                (rc, gfalobj, errmsg) = session.call('gfal_ls', gfalobj)
+            except Exception, e:
+                return ('UNKNOWN', 'problem invoking gfal_ls(): %s' % str(e), None)
+            else:
+                self.print_time()
+                if rc != 0:
+                    er = self.errorMatcher().match(errmsg)
+                    summary = 'problem listing %s.' % problem
+                    if er:
+                        if status != 'CRITICAL':
+                            status = er[0][2]
+                        summary += ' [ErrDB:%s]' % str(er)
+                    else:
+                        status = 'CRITICAL'
+                    self.printd('ERROR: %s' % errmsg)
+                    return (status, summary, None)
+
+            try:
+                (rc, gfalobj, gfalstatuses) = session.call('gfal_get_results', gfalobj)
+            except CallError, e:
+                return ('UNKNOWN', 'problem getting the gfal_ls() results: %s' % str(e), None)
+            session.storeLs(gfalstatuses)
 
-        #print self._ldap_fileEndptSAPath
-        return ('OK',"Endpoint informations found in ToA cached file ")
+        summary = ''
+        failed = [st['explanation'] for st in gfalstatuses if st['status'] != 0]
+        errs = dict(zip(failed, self.errorMatcher().match_many(failed)))
+        for st in gfalstatuses:
+            summary += label % st['surl']
+            self.printd(label % st['surl'], cr=False)
+            if st['status'] != 0:
+                er = errs[st['explanation']]
+                if er:
+                    if status != 'CRITICAL':
+                        status = er[0][2]
+                    summary += '-%s [ErrDB:%s];' % (status.lower(), str(er))
+                else:
+                    status = 'CRITICAL'
+                    summary += '-%s;' % status.lower()
+                self.printd('-%s;\nERROR: %s\n' % (status.lower(), st['explanation']))
+            else:
+                summary += '-ok;'
+                self.printd('-ok;')
 
+        return (status, summary, gfalstatuses)
 
     def metricLsDir(self):
         "List content of VO's top level space area(s) in SRM using gfal_ls()."
@@ -723,85 +2357,7 @@ class SRMVOMetrics(probe.MetricGatherer) :
         signal.signal(signal.SIGALRM, self.sig_term)
         signal.alarm(self.childTimeout)
         
-        req = {'surls'          : srms,
-               'defaultsetype'  : 'srmv'+self.svcVer,
-               'setype'         : 'srmv'+self.svcVer,
-               'timeout'        : self._timeouts['srm_connect'],
-               'srmv2_lslevels' : 0,
-               'no_bdii_check'  : 1
-               }
-        self.printd('Using gfal_ls().') 
-        self.printd('Parameters:\n%s' % '\n'.join(
-                        ['  %s: %s' % (x,str(y)) for x,y in req.items()]))
-        errmsg = ''
-        try:
-            (rc, gfalobj, errmsg) = gfal.gfal_init(req)
-        except MemoryError, e:
-            try: gfal.gfal_internal_free(gfalobj)
-            except: pass
-            summary = 'error initialising GFAL: %s' % str(e)
-            self.printd('ERROR: %s' % summary)
-            return ('UNKNOWN', summary)
-        else:
-            if rc != 0:
-                summary = 'problem initialising GFAL: %s' % errmsg
-                self.printd('ERROR: %s' % summary)
-                return ('UNKNOWN', summary)
-
-        self.print_time()
-        self.printd('Listing storage url(s).')
-        try:
-            (rc, gfalobj, errmsg) = gfal.gfal_ls(gfalobj)
-        except:
-            try: gfal.gfal_internal_free(gfalobj)
-            except: pass
-            return ('UNKNOWN', 'problem invoking gfal_ls(): %s' % errmsg)
-        else:
-            self.print_time()
-            if rc != 0:
-                try: gfal.gfal_internal_free(gfalobj)
-                except: pass
-                em = probe.ErrorsMatching(self.errorDBFile, self.errorTopics)
-                er = em.match(errmsg)
-                summary = 'problem listing Storage Path(s).'
-                if er:
-                    if status != 'CRITICAL':
-                        status = er[0][2]
-                    summary += ' [ErrDB:%s]' % str(er)
-                else:
-                    status = 'CRITICAL'
-                self.printd('ERROR: %s' % errmsg)
-                return (status, summary)
-
-        try:
-            (rc, gfalobj, gfalstatuses) = gfal.gfal_get_results(gfalobj)
-        except:
-            try: gfal.gfal_internal_free(gfalobj)
-            except: pass            
-            raise
-        else:
-            summary = ''
-            for st in gfalstatuses:
-                summary += 'Storage Path[%s]' % st['surl']
-                self.printd('Storage Path[%s]' % st['surl'], cr=False)
-                if st['status'] != 0:
-                    em = probe.ErrorsMatching(self.errorDBFile, self.errorTopics)
-                    er = em.match(st['explanation'])
-                    if er:
-                        if status != 'CRITICAL':
-                            status = er[0][2]
-                        summary += '-%s [ErrDB:%s];' % (status.lower(), str(er))
-                    else:
-                        status = 'CRITICAL'
-                        summary += '-%s;' % status.lower()
-                    self.printd('-%s;\nERROR: %s\n' % (status.lower(), st['explanation']))
-                else:
-                    summary += '-ok;'
-                    self.printd('-ok;')
-
-        try: gfal.gfal_internal_free(gfalobj)
-        except: pass
-
+        status, summary, gfalstatuses = self.lsSURLs(srms, 'storage url(s)', 'Storage Path(s)', 'Storage Path[%s]')
         return (status, summary)
 
     def metricVOLsDir(self):
@@ -816,87 +2372,9 @@ class SRMVOMetrics(probe.MetricGatherer) :
         signal.signal(signal.SIGALRM, self.sig_term)
         signal.alarm(self.childTimeout)
         
-        req = {'surls'          : srms,
-               'defaultsetype'  : 'srmv'+self.svcVer,
-               'setype'         : 'srmv'+self.svcVer,
-               'timeout'        : self._timeouts['srm_connect'],
-               'srmv2_lslevels' : 0,
-               'no_bdii_check'  : 1
-               }
-        self.printd('Using gfal_ls().') 
-        self.printd('Parameters:\n%s' % '\n'.join(
-                        ['  %s: %s' % (x,str(y)) for x,y in req.items()]))
-        errmsg = ''
-        try:
-            (rc, gfalobj, errmsg) = gfal.gfal_init(req)
-        except MemoryError, e:
-            try: gfal.gfal_internal_free(gfalobj)
-            except: pass
-            summary = 'error initialising GFAL: %s' % str(e)
-            self.printd('ERROR: %s' % summary)
-            return ('UNKNOWN', summary)
-        else:
-            if rc != 0:
-                summary = 'problem initialising GFAL: %s' % errmsg
-                self.printd('ERROR: %s' % summary)
-                return ('UNKNOWN', summary)
-
-        self.print_time()
-        self.printd('Listing storage url(s).')
-        try:
-            (rc, gfalobj, errmsg) = gfal.gfal_ls(gfalobj)
-        except:
-            try: gfal.gfal_internal_free(gfalobj)
-            except: pass
-            return ('UNKNOWN', 'problem invoking gfal_ls(): %s' % errmsg)
-        else:
-            self.print_time()
-            if rc != 0:
-                try: gfal.gfal_internal_free(gfalobj)
-                except: pass
-                em = probe.ErrorsMatching(self.errorDBFile, self.errorTopics)
-                er = em.match(errmsg)
-                summary = 'problem listing Storage Path(s).'
-                if er:
-                    if status != 'CRITICAL':
-                        status = er[0][2]
-                    summary += ' [ErrDB:%s]' % str(er)
-                else:
-                    status = 'CRITICAL'
-                self.printd('ERROR: %s' % errmsg)
-                return (status, summary)
-
-        try:
-            (rc, gfalobj, gfalstatuses) = gfal.gfal_get_results(gfalobj)
-        except:
-            try: gfal.gfal_internal_free(gfalobj)
-            except: pass            
-            raise
-        else:
-            summary = ''
-            for st in gfalstatuses:
-                summary += 'Storage Path[%s]' % st['surl']
-                self.printd('Storage Path[%s]' % st['surl'], cr=False)
-                if st['status'] != 0:
-                    em = probe.ErrorsMatching(self.errorDBFile, self.errorTopics)
-                    er = em.match(st['explanation'])
-                    if er:
-                        if status != 'CRITICAL':
-                            status = er[0][2]
-                        summary += '-%s [ErrDB:%s];' % (status.lower(), str(er))
-                    else:
-                        status = 'CRITICAL'
-                        summary += '-%s;' % status.lower()
-                    self.printd('-%s;\nERROR: %s\n' % (status.lower(), st['explanation']))
-                else:
-                    summary += '-ok;'
-                    self.printd('-ok;')
-
-        try: gfal.gfal_internal_free(gfalobj)
-        except: pass
-
+        status, summary, gfalstatuses = self.lsSURLs(srms, 'storage url(s)', 'Storage Path(s)', 'Storage Path[%s]')
         return (status, summary)
-    
+
     def metricLsDir2(self):
         "List content of VO's top level space area(s) in SRM using lcg-ls."
 
@@ -934,36 +2412,53 @@ class SRMVOMetrics(probe.MetricGatherer) :
             fp = open(src_file, "w")
             for s in "1234567890": fp.write(s+'\n')
             fp.close()
+            self._fileTestChecksums = file_checksums(src_file)
         except IOError, e:
             self.printd('ERROR: %s' % str(e))
             return ('UNKNOWN', 'Error opening local file.')
 
-        for srmendpt in self._voInfoDictionary.keys():
-                        
-            self.printd('VOPut: Copy file using lcg_cp3().')
-            # bug in lcg_util: https://gus.fzk.de/ws/ticket_info.php?ticket=39926
-            # SRM types: string to integer mapping
-            # TYPE_NONE  -> 0
-            # TYPE_SRM   -> 1
-            # TYPE_SRMv2 -> 2
-            # TYPE_SE    -> 3
-            defaulttype = int(self.svcVer)
-            srctype     = 0
-            dsttype     = defaulttype
-            nobdii      = 1
-            vo          = self.voName
-            nbstreams   = 1
-            conf_file   = ''
-            insecure    = 0
-            verbose     = 0 # if self.verbosity > 0: verbose = 1 # when API is fixed
-            timeout     = self._timeouts['srm_connect']
-            src_spacetokendesc  = ''
-            try:
-                dest_spacetokendesc = (self._voInfoDictionary[srmendpt])['space_token']
-            except KeyError:
-                dest_spacetokendesc = ''
-                
-            self.printd('''Parameters:
+        results = self.endpointResults('VOPut')
+        for srmendpt, result in results.items():
+            (self._voInfoDictionary[srmendpt])['putResult']=result
+
+        self.saveVoResults('putResult', ('checksums',))
+
+        #EXTRACT ARIBITRARY ITEM FROM THE DICTIONARY TO RETURN RESULTS
+        #REPLACE WITH WEIGHTED CALCULATION BASED ON CRITICALITY OF PATHS/ENDPOINTS!!!
+        # weightedResult will return a tuple with nagiosexitcode and detailed output
+        weightedResult=self.weightEndpointCriticality('putResult')
+        return weightedResult
+         ## what if no srmendpt?
+
+    def _voPutEndpoint(self, srmendpt):
+        "VOPut for a single SRM endpoint; returns (status, summary)."
+
+        src_file = self._fileTest
+
+        self.printd('VOPut: Copy file using lcg_cp3().')
+        # bug in lcg_util: https://gus.fzk.de/ws/ticket_info.php?ticket=39926
+        # SRM types: string to integer mapping
+        # TYPE_NONE  -> 0
+        # TYPE_SRM   -> 1
+        # TYPE_SRMv2 -> 2
+        # TYPE_SE    -> 3
+        defaulttype = int(self.svcVer)
+        srctype     = 0
+        dsttype     = defaulttype
+        nobdii      = 1
+        vo          = self.voName
+        nbstreams   = 1
+        conf_file   = ''
+        insecure    = 0
+        verbose     = 0 # if self.verbosity > 0: verbose = 1 # when API is fixed
+        timeout     = self.callTimeout('put')
+        src_spacetokendesc  = ''
+        try:
+            dest_spacetokendesc = (self._voInfoDictionary[srmendpt])['space_token']
+        except KeyError:
+            dest_spacetokendesc = ''
+            
+        self.printd('''Parameters:
  defaulttype: %i
  srctype: %i
  dsttype: %i
@@ -976,60 +2471,52 @@ class SRMVOMetrics(probe.MetricGatherer) :
  timeout: %i
  src_spacetokendesc: %s
  dest_spacetokendesc: %s''' % (defaulttype, srctype,
-                               dsttype, nobdii, vo, nbstreams, conf_file or '-',
-                               insecure, verbose, timeout, 
-                               src_spacetokendesc or '-', dest_spacetokendesc or '-'))
-            
-            errmsg = ''
-            stMsg = 'File was%s copied to SRM.' 
-            start_transfer = datetime.datetime.now()
-            #self.print_time()
-            self.printd('StartTime of the transfer: %s' % str(start_transfer)) 
-            dest_filename=(self._voInfoDictionary[srmendpt])['fn']
-            dest_file=srmendpt+'/'+dest_filename
-            
-            self.printd('Destination: %s' % dest_file)
-            try:
-                rc, errmsg = \
-                    lcg_util.lcg_cp3(src_file, dest_file, defaulttype, srctype,
-                                     dsttype, nobdii, vo, nbstreams, conf_file,
-                                     insecure, verbose, timeout, 
-                                     src_spacetokendesc, dest_spacetokendesc)
-            except AttributeError, e:
-                status = 'UNKNOWN'
-                summary = stMsg % ' NOT'
-                self.printd('ERROR: %s %s' % (str(e), sys.exc_info()[0]))
-            else:
-                if rc != 0:
-                    em = probe.ErrorsMatching(self.errorDBFile, self.errorTopics)
-                    er = em.match(errmsg)
-                    if er:
-                        status = er[0][2]
-                        summary = stMsg % (' NOT')+' [ErrDB:%s]' % str(er)
-                    else:
-                        status = 'CRITICAL'
-                        summary = stMsg % ' NOT'   #ADD HERE the full error msg errmsg
-                    self.printd('ERROR: %s' % errmsg)
-                else:
-                    status = 'OK'
-                    total_transfer = datetime.datetime.now()-start_transfer
-                    self.printd('Transfer Duration: %s' % str(total_transfer))
-                    summary = stMsg % ''+ " Transfer time: "+str(total_transfer)
-            #self.print_time()
-            (self._voInfoDictionary[srmendpt])['putResult']=(status,summary)
-
+                           dsttype, nobdii, vo, nbstreams, conf_file or '-',
+                           insecure, verbose, timeout, 
+                           src_spacetokendesc or '-', dest_spacetokendesc or '-'))
+        
+        errmsg = ''
+        stMsg = 'File was%s copied to SRM.' 
+        start_transfer = datetime.datetime.now()
+        #self.print_time()
+        self.printd('StartTime of the transfer: %s' % str(start_transfer)) 
+        dest_filename=(self._voInfoDictionary[srmendpt])['fn']
+        dest_file=srmendpt+'/'+dest_filename
+        
+        self.printd('Destination: %s' % dest_file)
         try:
-            self.saveVoInfoDictionary(self._fileHistoryVoInfoDictionary)
-        except IOError:
-            self.printd('Error saving VO Info Dictionary to file %s' % self._fileHistoryVoInfoDictionary)
+            rc, errmsg = \
+                self.session().call('lcg_cp3', src_file, dest_file, defaulttype, srctype,
+                                    dsttype, nobdii, vo, nbstreams, conf_file,
+                                    insecure, verbose, timeout,
+                                    src_spacetokendesc, dest_spacetokendesc)
+        except (AttributeError, CallError), e:
+            status = 'UNKNOWN'
+            summary = stMsg % ' NOT'
+            self.printd('ERROR: %s %s' % (str(e), sys.exc_info()[0]))
+        else:
+            if rc != 0:
+                er = self.errorMatcher().match(errmsg)
+                if er:
+                    status = er[0][2]
+                    summary = stMsg % (' NOT')+' [ErrDB:%s]' % str(er)
+                else:
+                    status = 'CRITICAL'
+                    summary = stMsg % ' NOT'   #ADD HERE the full error msg errmsg
+                self.printd('ERROR: %s' % errmsg)
+            else:
+                status = 'OK'
+                total_transfer = datetime.datetime.now()-start_transfer
+                self.printd('Transfer Duration: %s' % str(total_transfer))
+                summary = stMsg % ''+ " Transfer time: "+str(total_transfer)
+        # checksums of the copy on the SE, for --get-verify checksum
+        if status == 'OK':
+            (self._voInfoDictionary[srmendpt])['checksums']=self._fileTestChecksums
+        elif (self._voInfoDictionary[srmendpt]).has_key('checksums'):
+            del (self._voInfoDictionary[srmendpt])['checksums']
+        #self.print_time()
+        return (status, summary)
 
-        #EXTRACT ARIBITRARY ITEM FROM THE DICTIONARY TO RETURN RESULTS
-        #REPLACE WITH WEIGHTED CALCULATION BASED ON CRITICALITY OF PATHS/ENDPOINTS!!!
-        # weightedResult will return a tuple with nagiosexitcode and detailed output
-        weightedResult=self.weightEndpointCriticality('putResult')
-        return weightedResult
-         ## what if no srmendpt?
-        
     def metricPut(self):
         "Copy a local file to the SRM into default space area(s)."
         
@@ -1044,7 +2531,7 @@ class SRMVOMetrics(probe.MetricGatherer) :
             
             # multiple 'SAPath's are possible
             dest_files = []
-            fn = self._fileSRMPattern % (str(int(time.time())), 
+            fn = self._fileSRMPattern % ('nospacetoken', str(int(time.time())), 
                                          samutils.uuidstr())
             for srmendpt in open(self._ldap_fileEndptSAPath):
                 dest_files.append(srmendpt.rstrip('\n')+'/'+fn)
@@ -1077,7 +2564,7 @@ class SRMVOMetrics(probe.MetricGatherer) :
         conf_file   = ''
         insecure    = 0
         verbose     = 0 # if self.verbosity > 0: verbose = 1 # when API is fixed
-        timeout     = self._timeouts['srm_connect']
+        timeout     = self.callTimeout('put')
         src_spacetokendesc  = ''
         dest_spacetokendesc = ''
 
@@ -1105,18 +2592,17 @@ class SRMVOMetrics(probe.MetricGatherer) :
             self.printd('Destination: %s' % dest_file)
             try:
                 rc, errmsg = \
-                    lcg_util.lcg_cp3(src_file, dest_file, defaulttype, srctype,
-                                     dsttype, nobdii, vo, nbstreams, conf_file,
-                                     insecure, verbose, timeout, 
-                                     src_spacetokendesc, dest_spacetokendesc)
-            except AttributeError, e:
+                    self.session().call('lcg_cp3', src_file, dest_file, defaulttype, srctype,
+                                        dsttype, nobdii, vo, nbstreams, conf_file,
+                                        insecure, verbose, timeout,
+                                        src_spacetokendesc, dest_spacetokendesc)
+            except (AttributeError, CallError), e:
                 status = 'UNKNOWN'
                 summary = stMsg % ' NOT'
                 self.printd('ERROR: %s %s' % (str(e), sys.exc_info()[0]))
             else:
                 if rc != 0:
-                    em = probe.ErrorsMatching(self.errorDBFile, self.errorTopics)
-                    er = em.match(errmsg)
+                    er = self.errorMatcher().match(errmsg)
                     if er:
                         status = er[0][2]
                         summary = stMsg % (' NOT')+' [ErrDB:%s]' % str(er)
@@ -1148,86 +2634,7 @@ class SRMVOMetrics(probe.MetricGatherer) :
         signal.signal(signal.SIGALRM, self.sig_term)
         signal.alarm(self.childTimeout)
         
-        req = {'surls'          : srms,
-               'defaultsetype'  : 'srmv'+self.svcVer,
-               'setype'         : 'srmv'+self.svcVer,
-               'no_bdii_check'  : 1,
-               'timeout'        : self._timeouts['srm_connect'],
-               'srmv2_lslevels' : 0               
-               }
-        self.printd('Using gfal_ls().') 
-        self.printd('Parameters:\n%s' % '\n'.join(
-                        ['  %s: %s' % (x,str(y)) for x,y in req.items()]))
-        errmsg = ''
-        try:
-            (rc, gfalobj, errmsg) = gfal.gfal_init(req)
-        except MemoryError, e:
-            try: gfal.gfal_internal_free(gfalobj)
-            except: pass
-            summary = 'error initialising GFAL: %s' % str(e)
-            self.printd('ERROR: %s' % summary)
-            return ('UNKNOWN', summary)
-        else:
-            if rc != 0:
-                summary = 'problem initialising GFAL: %s' % errmsg
-                self.printd('ERROR: %s' % summary)
-                return ('UNKNOWN', summary)
-
-        self.print_time()
-        self.printd('Listing file(s).')
-        errmsg = ''
-        try:
-            (rc, gfalobj, errmsg) = gfal.gfal_ls(gfalobj)
-        except:
-            try: gfal.gfal_internal_free(gfalobj)
-            except: pass
-            return ('UNKNOWN', 'problem invoking gfal_ls(): %s' % errmsg)
-        else:
-            self.print_time()
-            if rc != 0:
-                try: gfal.gfal_internal_free(gfalobj)
-                except: pass
-                em = probe.ErrorsMatching(self.errorDBFile, self.errorTopics)
-                er = em.match(errmsg)
-                summary = 'problem listing file(s).'
-                if er:
-                    if status != 'CRITICAL':
-                        status = er[0][2]
-                    summary += ' [ErrDB:%s]' % str(er)
-                else:
-                    status = 'CRITICAL'
-                self.printd('ERROR: %s' % errmsg)
-                return (status, summary)
-
-        try:
-            (rc, gfalobj, gfalstatuses) = gfal.gfal_get_results(gfalobj)
-        except:
-            try: gfal.gfal_internal_free(gfalobj)
-            except: pass            
-            raise
-        else:
-            summary = ''
-            for st in gfalstatuses:
-                summary += 'listing [%s]' % st['surl']
-                self.printd('listing [%s]' % st['surl'], cr=False)
-                if st['status'] != 0:
-                    em = probe.ErrorsMatching(self.errorDBFile, self.errorTopics)
-                    er = em.match(st['explanation'])
-                    if er:
-                        if status != 'CRITICAL':
-                            status = er[0][2]
-                        summary += '-%s [ErrDB:%s];' % (status.lower(), str(er))
-                    else:
-                        status = 'CRITICAL'
-                        summary += '-%s;' % status.lower()
-                    self.printd('-%s;\nERROR: %s\n' % (status.lower(), st['explanation']))
-                else:
-                    summary += '-ok;'
-                    self.printd('-ok;')
-
-        try: gfal.gfal_internal_free(gfalobj)
-        except: pass
-
+        status, summary, gfalstatuses = self.lsSURLs(srms, 'file(s)', 'file(s)', 'listing [%s]')
         return (status, summary)
 
     def metricVOLs(self):
@@ -1236,99 +2643,56 @@ class SRMVOMetrics(probe.MetricGatherer) :
         self.printd(self.lcg_util_gfal_ver)
         
         status = 'OK'
+        summary = ''
+        order = ('OK', 'UNKNOWN', 'WARNING', 'CRITICAL')
         
         srms = []
+        results = {}
 
-        for srmendpt in self._voInfoDictionary.keys():
-            dest_filename=(self._voInfoDictionary[srmendpt])['fn']
-            dest_file=srmendpt+'/'+dest_filename
-            srms.append(dest_file)
-
-        self.print_time()
-            
-        signal.signal(signal.SIGALRM, self.sig_term)
-        signal.alarm(self.childTimeout)
-        
-        req = {'surls'          : srms,
-               'defaultsetype'  : 'srmv'+self.svcVer,
-               'setype'         : 'srmv'+self.svcVer,
-               'no_bdii_check'  : 1,
-               'timeout'        : self._timeouts['srm_connect'],
-               'srmv2_lslevels' : 0               
-               }
-        self.printd('Using gfal_ls().') 
-        self.printd('Parameters:\n%s' % '\n'.join(
-                        ['  %s: %s' % (x,str(y)) for x,y in req.items()]))
-        errmsg = ''
-        try:
-            (rc, gfalobj, errmsg) = gfal.gfal_init(req)
-        except MemoryError, e:
-            try: gfal.gfal_internal_free(gfalobj)
-            except: pass
-            summary = 'error initialising GFAL: %s' % str(e)
-            self.printd('ERROR: %s' % summary)
-            return ('UNKNOWN', summary)
+        if self._pipeline:
+            # the files were listed one by one
+            results = self.endpointResults('VOLs')
         else:
-            if rc != 0:
-                summary = 'problem initialising GFAL: %s' % errmsg
-                self.printd('ERROR: %s' % summary)
-                return ('UNKNOWN', summary)
+            for srmendpt in self._voInfoDictionary.keys():
+                dest_filename=(self._voInfoDictionary[srmendpt])['fn']
+                dest_file=srmendpt+'/'+dest_filename
+                parent = self.failedParent('VOLs', srmendpt)
+                gate = self.breakerGate(srmendpt)
+                if gate:
+                    results[srmendpt] = gate
+                elif parent:
+                    results[srmendpt] = ('UNKNOWN', 'skipped: parent %s failed' % parent)
+                else:
+                    srms.append(dest_file)
 
-        self.print_time()
-        self.printd('Listing file(s).')
-        errmsg = ''
-        try:
-            (rc, gfalobj, errmsg) = gfal.gfal_ls(gfalobj)
-        except:
-            try: gfal.gfal_internal_free(gfalobj)
-            except: pass
-            return ('UNKNOWN', 'problem invoking gfal_ls(): %s' % errmsg)
-        else:
             self.print_time()
-            if rc != 0:
-                try: gfal.gfal_internal_free(gfalobj)
-                except: pass
-                em = probe.ErrorsMatching(self.errorDBFile, self.errorTopics)
-                er = em.match(errmsg)
-                summary = 'problem listing file(s).'
-                if er:
-                    if status != 'CRITICAL':
-                        status = er[0][2]
-                    summary += ' [ErrDB:%s]' % str(er)
-                else:
-                    status = 'CRITICAL'
-                self.printd('ERROR: %s' % errmsg)
-                return (status, summary)
+            
+            signal.signal(signal.SIGALRM, self.sig_term)
+            signal.alarm(self.childTimeout)
+        
+            if srms:
+                status, summary, gfalstatuses = self.lsSURLs(srms, 'file(s)', 'file(s)', 'listing [%s]')
 
-        try:
-            (rc, gfalobj, gfalstatuses) = gfal.gfal_get_results(gfalobj)
-        except:
-            try: gfal.gfal_internal_free(gfalobj)
-            except: pass            
-            raise
-        else:
-            summary = ''
-            for st in gfalstatuses:
-                summary += 'listing [%s]' % st['surl']
-                self.printd('listing [%s]' % st['surl'], cr=False)
-                if st['status'] != 0:
-                    em = probe.ErrorsMatching(self.errorDBFile, self.errorTopics)
-                    er = em.match(st['explanation'])
-                    if er:
-                        if status != 'CRITICAL':
-                            status = er[0][2]
-                        summary += '-%s [ErrDB:%s];' % (status.lower(), str(er))
-                    else:
-                        status = 'CRITICAL'
-                        summary += '-%s;' % status.lower()
-                    self.printd('-%s;\nERROR: %s\n' % (status.lower(), st['explanation']))
-                else:
-                    summary += '-ok;'
-                    self.printd('-ok;')
+        # report the worst status
+        for srmendpt in self._voInfoDictionary.keys():
+            if not results.has_key(srmendpt):
+                continue
+            result = results[srmendpt]
+            if result[1].startswith('skipped:'):
+                dest_file=srmendpt+'/'+(self._voInfoDictionary[srmendpt])['fn']
+                summary += 'listing [%s]-%s;' % (dest_file, result[1])
+            else:
+                summary += result[1]
+            if order.index(result[0]) > order.index(status):
+                status = result[0]
+        return (status, summary)
 
-        try: gfal.gfal_internal_free(gfalobj)
-        except: pass
+    def _voLsEndpoint(self, srmendpt):
+        "VOLs for a single SRM endpoint; returns (status, summary)."
 
+        dest_file=srmendpt+'/'+(self._voInfoDictionary[srmendpt])['fn']
+        status, summary, gfalstatuses = self.lsSURLs([dest_file], 'file', 'file',
+                                                     'listing [%s]')
         return (status, summary)
 
     def metricLs2(self):
@@ -1385,7 +2749,7 @@ class SRMVOMetrics(probe.MetricGatherer) :
             
         if not protos:
             return ('WARNING', "No access protocol types for %s published in %s" % \
-                                (self.hostName, self._ldap_url))
+                                (self.hostName, self._ldap_url) + self._bdiiCacheMarker)
         
         self.printd('Discovered GlueSEAccessProtocolType: %s' % ', '.join(protos))
 
@@ -1412,7 +2776,7 @@ class SRMVOMetrics(probe.MetricGatherer) :
         defaulttype = int(self.svcVer)
         setype      = defaulttype
         nobdii      = 1
-        timeout     = self._timeouts['srm_connect']
+        timeout     = self.callTimeout('getturl')
         spacetokendesc = None
         
         self.printd('Using lcg_gt3().')
@@ -1433,10 +2797,11 @@ class SRMVOMetrics(probe.MetricGatherer) :
                 errmsg = ''
                 try:
                     (rc, turl, reqid, fileid, token, errmsg) = \
-                        lcg_util.lcg_gt3(src_file, defaulttype, setype, nobdii,
-                                    [proto], timeout, spacetokendesc)
-                    (rc, errmsg) = lcg_util.lcg_sd3(src_file, nobdii, reqid,
-                                                        fileid, token, timeout)
+                        self.session().call('lcg_gt3', src_file, defaulttype, setype, nobdii,
+                                            [proto], timeout, spacetokendesc)
+                    (rc, errmsg) = self.session().call('lcg_sd3', src_file, nobdii, reqid,
+                                                       fileid, token,
+                                                       self.callTimeout('setdone'))
                 except Exception, e:
                     status = 'UNKNOWN'
                     self.printd('ERROR: %s\n%s' % (errmsg, str(e)))
@@ -1446,8 +2811,7 @@ class SRMVOMetrics(probe.MetricGatherer) :
                             nok.append(proto)
                         self.printd('proto: %s - FAILED' % proto)
                         self.printd('error: %s' % errmsg)
-                        em = probe.ErrorsMatching(self.errorDBFile, self.errorTopics)
-                        er = em.match(errmsg)
+                        er = self.errorMatcher().match(errmsg)
                         if er:
                             status = er[0][2]
                         else:
@@ -1464,6 +2828,7 @@ class SRMVOMetrics(probe.MetricGatherer) :
         summary = 'protocols OK-[%s]' % ', '.join([x for x in ok])
         if nok: 
             summary += ', FAILED-[%s]' % ', '.join([x for x in nok])
+        summary += self._bdiiCacheMarker
         
         return (status, summary)
 
@@ -1472,81 +2837,11 @@ class SRMVOMetrics(probe.MetricGatherer) :
 
         self.printd(self.lcg_util_gfal_ver)
 
-        for srmendpt in self._voInfoDictionary.keys():
-                        
-            self.print_time()
-            src_filename=(self._voInfoDictionary[srmendpt])['fn']
-            src_file=srmendpt+'/'+src_filename
-
-            rc = None 
-            turl = None
-            reqid = None
-            fileid = None
-            token = None
-            errmsg = None
-            # bug in lcg_util: https://gus.fzk.de/ws/ticket_info.php?ticket=39926
-            # SRM types: string to integer mapping
-            # TYPE_NONE  -> 0
-            # TYPE_SRM   -> 1
-            # TYPE_SRMv2 -> 2
-            # TYPE_SE    -> 3
-            defaulttype = int(self.svcVer)
-            setype      = defaulttype
-            nobdii      = 1
-            protocol    = ['gsiftp']
-            timeout     = self._timeouts['srm_connect']
-            spacetokendesc = None
-            
-            self.printd('Using lcg_gt3().')
-            self.printd('''Parameters:
- defaulttype: %i
- setype: %i
- nobdii: %i
- protocol: %s
- timeout: %i
- spacetokendesc: %s''' % (defaulttype, setype, nobdii, protocol, timeout, 
-                          spacetokendesc or '-'))
-        
-            status = 'OK'
-            self.printd('=====\nSURL: %s\n-----' % src_file)
-            self.print_time()
-            errmsg = ''
-            try:
-                (rc, turl, reqid, fileid, token, errmsg) = \
-                     lcg_util.lcg_gt3(src_file, defaulttype, setype, nobdii,
-                                      protocol, timeout, spacetokendesc)
-                (rc, errmsg) = lcg_util.lcg_sd3(src_file, nobdii, reqid,
-                                                fileid, token, timeout)
-            except Exception, e:
-                status = 'UNKNOWN'
-                self.printd('ERROR: %s\n%s' % (errmsg, str(e)))
-                summary = 'protocol UNKNOWN-[%s]' % protocol
-            else:                                
-                if rc != 0:
-                    self.printd('proto: %s - FAILED' % protocol)
-                    self.printd('error: %s' % errmsg)
-                    summary = 'protocol FAILED-[%s]' % protocol
-                    em = probe.ErrorsMatching(self.errorDBFile, self.errorTopics)
-                    er = em.match(errmsg)
-                    if er:
-                        status = er[0][2]
-                    else:
-                        status = 'CRITICAL'
-                else:
-                    self.printd('proto: %s - OK' % protocol)
-                    self.printd('TURL: %s' % turl)
-                    status = 'OK'
-                    summary = 'protocol OK-[%s], TURL: %s' % (protocol,turl)
-                    
-            self.print_time()
-            self.printd('-----')
+        results = self.endpointResults('VOGetTURLs')
+        for srmendpt, result in results.items():
+            (self._voInfoDictionary[srmendpt])['getTURLResult']=result
 
-            (self._voInfoDictionary[srmendpt])['getTURLResult']=(status,summary)
-
-        try:
-            self.saveVoInfoDictionary(self._fileHistoryVoInfoDictionary)
-        except IOError:
-            self.printd('Error saving VO Info Dictionary to file %s' % self._fileHistoryVoInfoDictionary)
+        self.saveVoResults('getTURLResult')
 
         #EXTRACT ARIBITRARY ITEM FROM THE DICTIONARY TO RETURN RESULTS
         #REPLACE WITH WEIGHTED CALCULATION BASED ON CRITICALITY OF PATHS/ENDPOINTS!!!
@@ -1557,7 +2852,114 @@ class SRMVOMetrics(probe.MetricGatherer) :
             return ('UNKNOWN', 'No SRM endpoints found in internal dictionary')
         except KeyError:
             return ('UNKNOWN', 'No test results found in internal dictionary for SRM endpoint')
+
+    def _voGetTURLsEndpoint(self, srmendpt):
+        "VOGetTURLs for a single SRM endpoint; returns (status, summary)."
+
+        self.print_time()
+        src_filename=(self._voInfoDictionary[srmendpt])['fn']
+        src_file=srmendpt+'/'+src_filename
+
+        rc = None 
+        turl = None
+        reqid = None
+        fileid = None
+        token = None
+        errmsg = None
+        # bug in lcg_util: https://gus.fzk.de/ws/ticket_info.php?ticket=39926
+        # SRM types: string to integer mapping
+        # TYPE_NONE  -> 0
+        # TYPE_SRM   -> 1
+        # TYPE_SRMv2 -> 2
+        # TYPE_SE    -> 3
+        defaulttype = int(self.svcVer)
+        setype      = defaulttype
+        nobdii      = 1
+        protocol    = ['gsiftp']
+        timeout     = self.callTimeout('getturl')
+        spacetokendesc = None
         
+        self.printd('Using lcg_gt3().')
+        self.printd('''Parameters:
+ defaulttype: %i
+ setype: %i
+ nobdii: %i
+ protocol: %s
+ timeout: %i
+ spacetokendesc: %s''' % (defaulttype, setype, nobdii, protocol, timeout, 
+                      spacetokendesc or '-'))
+    
+        status = 'OK'
+        self.printd('=====\nSURL: %s\n-----' % src_file)
+        self.print_time()
+        errmsg = ''
+        try:
+            (rc, turl, reqid, fileid, token, errmsg) = \
+                 self.session().call('lcg_gt3', src_file, defaulttype, setype, nobdii,
+                                     protocol, timeout, spacetokendesc)
+            (rc, errmsg) = self.session().call('lcg_sd3', src_file, nobdii, reqid,
+                                               fileid, token,
+                                               self.callTimeout('setdone'))
+        except Exception, e:
+            status = 'UNKNOWN'
+            self.printd('ERROR: %s\n%s' % (errmsg, str(e)))
+            summary = 'protocol UNKNOWN-[%s]' % protocol
+        else:                                
+            if rc != 0:
+                self.printd('proto: %s - FAILED' % protocol)
+                self.printd('error: %s' % errmsg)
+                summary = 'protocol FAILED-[%s]' % protocol
+                er = self.errorMatcher().match(errmsg)
+                if er:
+                    status = er[0][2]
+                else:
+                    status = 'CRITICAL'
+            else:
+                self.printd('proto: %s - OK' % protocol)
+                self.printd('TURL: %s' % turl)
+                status = 'OK'
+                summary = 'protocol OK-[%s], TURL: %s' % (protocol,turl)
+                
+        self.print_time()
+        self.printd('-----')
+        return (status, summary)
+
+    def compareCopy(self, local_file):
+        "Compare a downloaded copy with the test file; (status, message)."
+        try:
+            if same_content(self._fileTest, local_file):
+                return ('OK', ' Diff successful.')
+            self.printd('ERROR: %s differs from %s' % (local_file, self._fileTest))
+            return ('CRITICAL', ' Files differ!')
+        except IOError, e:
+            self.printd('compare ERROR: %s' % str(e))
+            return ('UNKNOWN', ' Unknown problem when comparing files!')
+
+    def checksumOnSE(self, surl, checksums):
+        """Verify surl by the checksum the SE reports in its listing.
+
+        Returns (status, summary), or None if the SE reported no usable
+        checksum and the file has to be downloaded.
+        """
+        self.printd('Verifying checksum reported by SE.')
+        status, summary, gfalstatuses = self.lsSURLs([surl], 'file', 'file',
+                                                     'checksum of [%s]')
+        if not gfalstatuses or gfalstatuses[0]['status'] != 0:
+            self.printd('Cannot list file on SE; downloading it.')
+            return None
+        st = gfalstatuses[0]
+        ctype = st.get('checksumtype')
+        value = st.get('checksum')
+        same = same_checksum(ctype, value, checksums)
+        if same is None:
+            self.printd('No usable checksum from SE (%s: %s); downloading file.' %
+                                (ctype or '-', value or '-'))
+            return None
+        if same:
+            return ('OK', 'File checksum verified on SRM (%s %s).' % (ctype, value))
+        self.printd('ERROR: %s checksum %s on SE, %s expected.' %
+                            (ctype, value, checksums[ctype.lower().replace('-', '')]))
+        return ('CRITICAL', 'File checksum differs on SRM (%s %s)!' % (ctype, value))
 
     def metricGet(self):
         "Copy given remote file(s) from SRM to a local file."
@@ -1591,7 +2993,7 @@ class SRMVOMetrics(probe.MetricGatherer) :
         conf_file   = ''
         insecure    = 0
         verbose     = 0 # if self.verbosity > 0: verbose = 1 # when API is fixed
-        timeout     = self._timeouts['srm_connect']
+        timeout     = self.callTimeout('get')
         src_spacetokendesc  = ''
         dest_spacetokendesc = ''
         
@@ -1612,25 +3014,36 @@ class SRMVOMetrics(probe.MetricGatherer) :
                       insecure, verbose, timeout, 
                       src_spacetokendesc or '-', dest_spacetokendesc or '-'))
         
+        checksums = None
+        if self._getVerify == 'checksum':
+            try:
+                checksums = file_checksums(self._fileTest)
+            except IOError, e:
+                self.printd('Cannot checksum %s: %s' % (self._fileTest, str(e)))
+
         stMsg = 'File was%s copied from SRM.'
         for src_file in src_files:
             self.print_time()
             self.printd('Source: %s' % src_file)
+            if checksums:
+                result = self.checksumOnSE(src_file, checksums)
+                if result:
+                    status, summary = result
+                    continue
             errmsg = ''
             try:
                 rc, errmsg = \
-                    lcg_util.lcg_cp3(src_file, dest_file, defaulttype, srctype,
-                                     dsttype, nobdii, vo, nbstreams, conf_file,
-                                     insecure, verbose, timeout, 
-                                     src_spacetokendesc, dest_spacetokendesc);
+                    self.session().call('lcg_cp3', src_file, dest_file, defaulttype, srctype,
+                                        dsttype, nobdii, vo, nbstreams, conf_file,
+                                        insecure, verbose, timeout,
+                                        src_spacetokendesc, dest_spacetokendesc);
             except Exception, e:
                 status = 'UNKNOWN'
                 summary = stMsg % ' NOT'
                 self.printd('ERROR: %s\n%s' % (errmsg, str(e)))
             else:
                 if rc != 0:
-                    em = probe.ErrorsMatching(self.errorDBFile, self.errorTopics)
-                    er = em.match(errmsg)
+                    er = self.errorMatcher().match(errmsg)
                     if er:
                         status = er[0][2]
                         summary = stMsg % (' NOT')+'[ErrDB:%s]' % str(er)
@@ -1639,19 +3052,8 @@ class SRMVOMetrics(probe.MetricGatherer) :
                         summary = stMsg % ' NOT'
                     self.printd('ERROR: %s' % errmsg)
                 else:
-                    cmd = '`which diff` %s %s' % (self._fileTest, self._fileTestIn)
-                    res = commands.getstatusoutput(cmd)
-                    if res[0] == 0:
-                        status = 'OK'
-                        summary = stMsg % ('')+' Diff successful.'
-                    elif res[0] == 256: # files differ
-                        status = 'CRITICAL'
-                        summary = stMsg % ('')+' Files differ!'
-                        self.printd('diff ERROR: %s' % res[1])
-                    else:
-                        status = 'UNKNOWN'
-                        summary = stMsg % ''+' Unknown problem when comparing files!'
-                        self.printd('diff ERROR: %s' % res[1])
+                    status, cmpMsg = self.compareCopy(self._fileTestIn)
+                    summary = stMsg % ('')+cmpMsg
             self.print_time()
 
         return(status, summary)
@@ -1661,38 +3063,59 @@ class SRMVOMetrics(probe.MetricGatherer) :
 
         self.printd(self.lcg_util_gfal_ver)
 
-        for srmendpt in self._voInfoDictionary.keys():
-                        
-            self.print_time()
-            src_filename=(self._voInfoDictionary[srmendpt])['fn']
-            src_file=srmendpt+'/'+src_filename
+        results = self.endpointResults('VOGet')
+        for srmendpt, result in results.items():
+            (self._voInfoDictionary[srmendpt])['getResult']=result
 
-            dest_file = 'file:'+self._fileTestIn
+        self.saveVoResults('getResult')
 
-            self.printd('Source: %s' % src_file)
-            self.printd('Destination: %s' % dest_file)
+        #EXTRACT ARIBITRARY ITEM FROM THE DICTIONARY TO RETURN RESULTS
+        #REPLACE WITH WEIGHTED CALCULATION BASED ON CRITICALITY OF PATHS/ENDPOINTS!!!
 
-            self.printd('Get file using lcg_cp3().')
-            # bug in lcg_util: https://gus.fzk.de/ws/ticket_info.php?ticket=39926
-            # SRM types string to integer mapping
-            # TYPE_NONE  -> 0
-            # TYPE_SRM   -> 1
-            # TYPE_SRMv2 -> 2
-            # TYPE_SE    -> 3
-            defaulttype = int(self.svcVer)
-            srctype     = defaulttype
-            dsttype     = 0
-            nobdii      = 1
-            vo          = self.voName
-            nbstreams   = 1
-            conf_file   = ''
-            insecure    = 0
-            verbose     = 0 # if self.verbosity > 0: verbose = 1 # when API is fixed
-            timeout     = self._timeouts['srm_connect']
-            src_spacetokendesc  = ''
-            dest_spacetokendesc = ''
-        
-            self.printd('''Parameters:
+        weightedResult=self.weightEndpointCriticality('getResult')
+        return weightedResult
+
+    def _voGetEndpoint(self, srmendpt):
+        "VOGet for a single SRM endpoint; returns (status, summary)."
+
+        self.print_time()
+        src_filename=(self._voInfoDictionary[srmendpt])['fn']
+        src_file=srmendpt+'/'+src_filename
+
+        checksums = (self._voInfoDictionary[srmendpt]).get('checksums')
+        if self._getVerify == 'checksum' and checksums:
+            result = self.checksumOnSE(src_file, checksums)
+            if result:
+                return result
+
+        # one local copy per endpoint, endpoints may be fetched concurrently
+        local_file = '%s.%s' % (self._fileTestIn, src_filename)
+        dest_file = 'file:'+local_file
+
+        self.printd('Source: %s' % src_file)
+        self.printd('Destination: %s' % dest_file)
+
+        self.printd('Get file using lcg_cp3().')
+        # bug in lcg_util: https://gus.fzk.de/ws/ticket_info.php?ticket=39926
+        # SRM types string to integer mapping
+        # TYPE_NONE  -> 0
+        # TYPE_SRM   -> 1
+        # TYPE_SRMv2 -> 2
+        # TYPE_SE    -> 3
+        defaulttype = int(self.svcVer)
+        srctype     = defaulttype
+        dsttype     = 0
+        nobdii      = 1
+        vo          = self.voName
+        nbstreams   = 1
+        conf_file   = ''
+        insecure    = 0
+        verbose     = 0 # if self.verbosity > 0: verbose = 1 # when API is fixed
+        timeout     = self.callTimeout('get')
+        src_spacetokendesc  = ''
+        dest_spacetokendesc = ''
+    
+        self.printd('''Parameters:
  defaulttype: %i
  srctype: %i
  dsttype: %i
@@ -1705,65 +3128,46 @@ class SRMVOMetrics(probe.MetricGatherer) :
  timeout: %i
  src_spacetokendesc: %s
  dest_spacetokendesc: %s''' % (defaulttype, srctype,
-                      dsttype, nobdii, vo, nbstreams, conf_file or '-',
-                      insecure, verbose, timeout, 
-                      src_spacetokendesc or '-', dest_spacetokendesc or '-'))
-        
-            stMsg = 'File was%s copied from SRM.'
-            errmsg = ''
-            start_transfer = datetime.datetime.now()
-            #self.print_time()
-            self.printd('StartTime of the transfer: %s' % str(start_transfer))
-            try:
-                rc, errmsg = \
-                    lcg_util.lcg_cp3(src_file, dest_file, defaulttype, srctype,
-                                     dsttype, nobdii, vo, nbstreams, conf_file,
-                                     insecure, verbose, timeout, 
-                                     src_spacetokendesc, dest_spacetokendesc);
-            except Exception, e:
-                status = 'UNKNOWN'
-                summary = stMsg % ' NOT'
-                self.printd('ERROR: %s\n%s' % (errmsg, str(e)))
-            else:
-                if rc != 0:
-                    em = probe.ErrorsMatching(self.errorDBFile, self.errorTopics)
-                    er = em.match(errmsg)
-                    if er:
-                        status = er[0][2]
-                        summary = stMsg % (' NOT')+'[ErrDB:%s]' % str(er)
-                    else:
-                        status = 'CRITICAL'
-                        summary = stMsg % ' NOT'
-                    self.printd('ERROR: %s' % errmsg)
-                else:
-                    cmd = '`which diff` %s %s' % (self._fileTest, self._fileTestIn)
-                    res = commands.getstatusoutput(cmd)
-                    if res[0] == 0:
-                        status = 'OK'
-                        total_transfer = datetime.datetime.now()-start_transfer
-                        self.printd('Transfer Duration: %s' % str(total_transfer))
-                        summary = stMsg % ('')+' Diff successful.' + " Transfer time: "+str(total_transfer)
-                    elif res[0] == 256: # files differ
-                        status = 'CRITICAL'
-                        summary = stMsg % ('')+' Files differ!'
-                        self.printd('diff ERROR: %s' % res[1])
-                    else:
-                        status = 'UNKNOWN'
-                        summary = stMsg % ''+' Unknown problem when comparing files!'
-                        self.printd('diff ERROR: %s' % res[1])
-            self.print_time()
-            (self._voInfoDictionary[srmendpt])['getResult']=(status,summary)
-
+                  dsttype, nobdii, vo, nbstreams, conf_file or '-',
+                  insecure, verbose, timeout, 
+                  src_spacetokendesc or '-', dest_spacetokendesc or '-'))
+    
+        stMsg = 'File was%s copied from SRM.'
+        errmsg = ''
+        start_transfer = datetime.datetime.now()
+        #self.print_time()
+        self.printd('StartTime of the transfer: %s' % str(start_transfer))
         try:
-            self.saveVoInfoDictionary(self._fileHistoryVoInfoDictionary)
-        except IOError:
-            self.printd('Error saving VO Info Dictionary to file %s' % self._fileHistoryVoInfoDictionary)
-
-        #EXTRACT ARIBITRARY ITEM FROM THE DICTIONARY TO RETURN RESULTS
-        #REPLACE WITH WEIGHTED CALCULATION BASED ON CRITICALITY OF PATHS/ENDPOINTS!!!
-
-        weightedResult=self.weightEndpointCriticality('getResult')
-        return weightedResult
+            rc, errmsg = \
+                self.session().call('lcg_cp3', src_file, dest_file, defaulttype, srctype,
+                                    dsttype, nobdii, vo, nbstreams, conf_file,
+                                    insecure, verbose, timeout,
+                                    src_spacetokendesc, dest_spacetokendesc);
+        except Exception, e:
+            status = 'UNKNOWN'
+            summary = stMsg % ' NOT'
+            self.printd('ERROR: %s\n%s' % (errmsg, str(e)))
+        else:
+            if rc != 0:
+                er = self.errorMatcher().match(errmsg)
+                if er:
+                    status = er[0][2]
+                    summary = stMsg % (' NOT')+'[ErrDB:%s]' % str(er)
+                else:
+                    status = 'CRITICAL'
+                    summary = stMsg % ' NOT'
+                self.printd('ERROR: %s' % errmsg)
+            else:
+                status, cmpMsg = self.compareCopy(local_file)
+                summary = stMsg % ('')+cmpMsg
+                if status == 'OK':
+                    total_transfer = datetime.datetime.now()-start_transfer
+                    self.printd('Transfer Duration: %s' % str(total_transfer))
+                    summary += " Transfer time: "+str(total_transfer)
+        self.print_time()
+        try: os.unlink(local_file)
+        except OSError: pass
+        return (status, summary)
 
 #
 
@@ -1803,7 +3207,7 @@ class SRMVOMetrics(probe.MetricGatherer) :
         conf_file   = ''
         insecure    = 0
         verbose     = 0 # if self.verbosity > 0: verbose = 1 # when API is fixed
-        timeout     = self._timeouts['srm_connect']
+        timeout     = self.callTimeout('del')
         
         self.printd('Using lcg_del4().')
         self.printd('''Parameters:
@@ -1828,16 +3232,15 @@ class SRMVOMetrics(probe.MetricGatherer) :
             self.printd('Deleting: %s' % src_file)
             try:
                 rc, errmsg = \
-                    lcg_util.lcg_del4(src_file, defaulttype, setype, nobdii, nolfc, aflag, 
-                                      se, vo, conf_file, insecure, verbose, timeout);
+                    self.session().call('lcg_del4', src_file, defaulttype, setype, nobdii, nolfc, aflag, 
+                                        se, vo, conf_file, insecure, verbose, timeout);
             except Exception, e:
                 status = 'UNKNOWN'
                 summary = stMsg % ' NOT'
                 self.printd('ERROR: %s\n%s' % (errmsg, str(e)))
             else:
                 if rc != 0:
-                    em = probe.ErrorsMatching(self.errorDBFile, self.errorTopics)
-                    er = em.match(errmsg)
+                    er = self.errorMatcher().match(errmsg)
                     if er:
                         status = er[0][2]
                         summary = stMsg % (' NOT')+' [ErrDB:%s]' % str(er)
@@ -1860,38 +3263,55 @@ class SRMVOMetrics(probe.MetricGatherer) :
         # TODO: - cleanup of the metric's working directory 
         #   (this may go to metricAll() in the superclass)
 
-        for srmendpt in self._voInfoDictionary.keys():
-                        
-            self.print_time()
-            src_filename=(self._voInfoDictionary[srmendpt])['fn']
-            src_file=srmendpt+'/'+src_filename
+        results = self.endpointResults('VODel')
+        for srmendpt, result in results.items():
+            (self._voInfoDictionary[srmendpt])['delResult']=result
 
-            self.printd('Source: %s' % src_file)
+        self.saveVoResults('delResult')
 
-            # bug in lcg_util: https://gus.fzk.de/ws/ticket_info.php?ticket=39926
-            # SRM types string to integer mapping
-            # TYPE_NONE  -> 0
-            # TYPE_SRM   -> 1
-            # TYPE_SRMv2 -> 2
-            # TYPE_SE    -> 3
-            defaulttype = int(self.svcVer)
-            setype      = defaulttype
-            nobdii      = 1
-            try:
-                catalog=(self._voInfoDictionary[srmendpt])['fileCatalog']
-                nolfc=0
-            except KeyError:
-                nolfc       = 1
-            aflag       = 0
-            se          = ''
-            vo          = self.voName
-            conf_file   = ''
-            insecure    = 0
-            verbose     = 0 # if self.verbosity > 0: verbose = 1 # when API is fixed
-            timeout     = self._timeouts['srm_connect']
-        
-            self.printd('Using lcg_del4().')
-            self.printd('''Parameters:
+        #EXTRACT ARIBITRARY ITEM FROM THE DICTIONARY TO RETURN RESULTS
+        #REPLACE WITH WEIGHTED CALCULATION BASED ON CRITICALITY OF PATHS/ENDPOINTS!!!
+
+        try:
+            return (self._voInfoDictionary.values()[0])['delResult']
+        except IndexError:
+            return ('UNKNOWN', 'No SRM endpoints found in internal dictionary')
+        except KeyError:
+            return ('UNKNOWN', 'No test results found in internal dictionary for SRM endpoint')
+
+    def _voDelEndpoint(self, srmendpt):
+        "VODel for a single SRM endpoint; returns (status, summary)."
+
+        self.print_time()
+        src_filename=(self._voInfoDictionary[srmendpt])['fn']
+        src_file=srmendpt+'/'+src_filename
+
+        self.printd('Source: %s' % src_file)
+
+        # bug in lcg_util: https://gus.fzk.de/ws/ticket_info.php?ticket=39926
+        # SRM types string to integer mapping
+        # TYPE_NONE  -> 0
+        # TYPE_SRM   -> 1
+        # TYPE_SRMv2 -> 2
+        # TYPE_SE    -> 3
+        defaulttype = int(self.svcVer)
+        setype      = defaulttype
+        nobdii      = 1
+        try:
+            catalog=(self._voInfoDictionary[srmendpt])['fileCatalog']
+            nolfc=0
+        except KeyError:
+            nolfc       = 1
+        aflag       = 0
+        se          = ''
+        vo          = self.voName
+        conf_file   = ''
+        insecure    = 0
+        verbose     = 0 # if self.verbosity > 0: verbose = 1 # when API is fixed
+        timeout     = self.callTimeout('del')
+    
+        self.printd('Using lcg_del4().')
+        self.printd('''Parameters:
  defaulttype: %i
  setype: %i
  nobdii: %i
@@ -1903,52 +3323,497 @@ class SRMVOMetrics(probe.MetricGatherer) :
  insecure: %i
  verbose: %i
  timeout: %i''' % (defaulttype, setype, nobdii, nolfc, aflag, 
-                          se or '-', vo, conf_file or '-', insecure, 
-                          verbose, timeout))
-        
-            stMsg = 'File was%s deleted from SRM.'
-            errmsg = ''
-            self.print_time()
-            self.printd('Deleting: %s' % src_file)
-            try:
-                rc, errmsg = \
-                    lcg_util.lcg_del4(src_file, defaulttype, setype, nobdii, nolfc, aflag, 
-                                      se, vo, conf_file, insecure, verbose, timeout);
-            except Exception, e:
-                status = 'UNKNOWN'
-                summary = stMsg % ' NOT'
-                self.printd('ERROR: %s\n%s' % (errmsg, str(e)))
-            else:
-                if rc != 0:
-                    em = probe.ErrorsMatching(self.errorDBFile, self.errorTopics)
-                    er = em.match(errmsg)
-                    if er:
-                        status = er[0][2]
-                        summary = stMsg % (' NOT')+' [ErrDB:%s]' % str(er)
-                    else:
-                        status = 'CRITICAL'
-                        summary  = stMsg % ' NOT'
-                    self.printd('ERROR: %s' % errmsg)
+                      se or '-', vo, conf_file or '-', insecure, 
+                      verbose, timeout))
+    
+        stMsg = 'File was%s deleted from SRM.'
+        errmsg = ''
+        self.print_time()
+        self.printd('Deleting: %s' % src_file)
+        try:
+            rc, errmsg = \
+                self.session().call('lcg_del4', src_file, defaulttype, setype, nobdii, nolfc, aflag, 
+                                    se, vo, conf_file, insecure, verbose, timeout);
+        except Exception, e:
+            status = 'UNKNOWN'
+            summary = stMsg % ' NOT'
+            self.printd('ERROR: %s\n%s' % (errmsg, str(e)))
+        else:
+            if rc != 0:
+                er = self.errorMatcher().match(errmsg)
+                if er:
+                    status = er[0][2]
+                    summary = stMsg % (' NOT')+' [ErrDB:%s]' % str(er)
                 else:
-                    status = 'OK'
-                    summary = stMsg % ''
-            self.print_time()
-            (self._voInfoDictionary[srmendpt])['delResult']=(status,summary)
+                    status = 'CRITICAL'
+                    summary  = stMsg % ' NOT'
+                self.printd('ERROR: %s' % errmsg)
+            else:
+                status = 'OK'
+                summary = stMsg % ''
+        self.print_time()
+        return (status, summary)
+
+    def metricVOCleanup(self):
+        "Delete the test files left in the SRM space area(s) defined by VO."
+
+        self.printd(self.lcg_util_gfal_ver)
 
+        status = 'OK'
+        order = ('OK', 'UNKNOWN', 'WARNING', 'CRITICAL')
+        files = size = 0
+        details = ''
+        perf = []
+        results = self.endpointResults('VOCleanup')
+        for srmendpt in sorted(results.keys()):
+            result = results[srmendpt]
+            if order.index(result[0]) > order.index(status):
+                status = result[0]
+            token = self._voInfoDictionary[srmendpt].get('space_token') or srmendpt
+            details += '%s %s\n' % (token, result[1])
+            if len(result) > 2:
+                files += result[2][0]
+                size += result[2][1]
+                perf.extend([perfdata(token+'_files_deleted', result[2][0]),
+                             perfdata(token+'_bytes_deleted', result[2][1], 'B')])
+        summary = 'Deleted %i test file(s) older than %i sec, %i bytes, ' \
+                  'from %i endpoint(s).\n%s' % (files, self._cleanupAge, size,
+                                                len(results), details)
+        perf = [perfdata('files_deleted', files),
+                perfdata('bytes_deleted', size, 'B')] + perf
+        return (status, summary.rstrip('\n') + ' | ' + ' '.join(perf))
+
+    def testFileRegex(self):
+        """Regular expression matching the names made from _fileSRMPattern;
+        the groups are the space token, the time and the UUID. The time has
+        10 digits and the UUID is 8-4-4-4-12 hex digits, so that an all-digit
+        UUID group is not taken for the time."""
+        parts = [re.escape(x) for x in self._fileSRMPattern.split('%s')]
+        uuid = '-'.join(['[0-9a-fA-F]{%i}' % n for n in (8, 4, 4, 4, 12)])
+        return re.compile('^%s(.+?)%s(\d{10})%s(%s)%s$' %
+                          (parts[0], parts[1], parts[2], uuid, parts[3]))
+
+    def gfalRequest(self, op, surls, **req):
+        """gfal_init() for surls, then op (gfal_ls or gfal_deletesurls) and
+        gfal_get_results(); returns (statuses, None) or (None, error)."""
+        session = self.session()
+        req.update({'surls'         : surls,
+                    'defaultsetype' : 'srmv'+self.svcVer,
+                    'setype'        : 'srmv'+self.svcVer,
+                    'no_bdii_check' : 1})
         try:
-            self.saveVoInfoDictionary(self._fileHistoryVoInfoDictionary)
-        except IOError:
-            self.printd('Error saving VO Info Dictionary to file %s' % self._fileHistoryVoInfoDictionary)
+            rc, gfalobj, errmsg = session.call('gfal_init', req)
+            if rc != 0:
+                return (None, 'problem initialising GFAL: %s' % errmsg)
+            session.free(gfalobj)
+            rc, gfalobj, errmsg = session.call(op, gfalobj)
+            if rc != 0:
+                return (None, '%s() failed: %s' % (op, errmsg))
+            rc, gfalobj, statuses = session.call('gfal_get_results', gfalobj)
+        except (MemoryError, CallError), e:
+            return (None, '%s() failed: %s' % (op, str(e)))
+        return (statuses, None)
+
+    def _voCleanupEndpoint(self, srmendpt):
+        """VOCleanup for a single SRM endpoint; returns (status, summary,
+        (files deleted, bytes deleted)).
+
+        Only files named after _fileSRMPattern whose name and modification
+        times are both older than --cleanup-age are deleted, and never the
+        current test file of an endpoint, so that it is safe to run along
+        with the other metrics. Files listed without a modification time are
+        kept. Files gone already count as deleted by someone else.
+        """
+        regex = self.testFileRegex()
+        keep = [info.get('fn') for info in self._voInfoDictionary.values()]
+        limit = time.time() - self._cleanupAge
+
+        # (surl, size) of the expired test files
+        expired = []
+        offset = 0
+        while 1:
+            statuses, error = self.gfalRequest('gfal_ls', [srmendpt],
+                                               timeout=self.callTimeout('ls'),
+                                               srmv2_lslevels=1,
+                                               srmv2_lsoffset=offset,
+                                               srmv2_lscount=self._cleanupListCount)
+            if error is None and statuses[0]['status'] != 0:
+                error = statuses[0]['explanation']
+            if error is not None:
+                self.printd('ERROR: %s' % error)
+                return ('UNKNOWN', 'cannot list %s: %s' % (srmendpt, error))
+            subpaths = statuses[0].get('subpaths') or []
+            for entry in subpaths:
+                name = entry['surl'].rstrip('/').split('/')[-1]
+                m = regex.match(name)
+                if not m or name in keep or int(m.group(2)) > limit:
+                    continue
+                # without a modification time the file may be in use
+                stat = entry.get('stat') or ()
+                if len(stat) <= 8 or not stat[8] or stat[8] > limit:
+                    continue
+                expired.append((entry['surl'], len(stat) > 6 and stat[6] or 0))
+            if len(subpaths) < self._cleanupListCount:
+                break
+            offset += len(subpaths)
+        self.printd('%i expired test file(s) in %s' % (len(expired), srmendpt))
+
+        files = size = 0
+        failed = []
+        sizes = dict(expired)
+        surls = [x[0] for x in expired]
+        for i in range(0, len(surls), self._cleanupBatch):
+            batch = surls[i:i+self._cleanupBatch]
+            statuses, error = self.gfalRequest('gfal_deletesurls', batch,
+                                               timeout=self.callTimeout('del'))
+            if error is not None:
+                self.printd('ERROR: %s' % error)
+                failed.extend(batch)
+                continue
+            for st in statuses:
+                self.session().forget(st['surl'])
+                if st['status'] == 0:
+                    files += 1
+                    size += sizes.get(st['surl'], 0)
+                elif st['status'] != errno.ENOENT:
+                    self.printd('ERROR: %s: %s' % (st['surl'], st['explanation']))
+                    failed.append(st['surl'])
+
+        summary = 'deleted %i of %i expired test file(s), %i bytes' % \
+                  (files, len(expired), size)
+        if failed:
+            return ('WARNING', summary + '; %i could not be deleted' % 
+                               len(failed), (files, size))
+        return ('OK', summary, (files, size))
+
+    def metricVOPutThroughput(self):
+        "Measure the upload rate to the SRM space area(s) defined by VO."
 
-        #EXTRACT ARIBITRARY ITEM FROM THE DICTIONARY TO RETURN RESULTS
-        #REPLACE WITH WEIGHTED CALCULATION BASED ON CRITICALITY OF PATHS/ENDPOINTS!!!
+        self.printd(self.lcg_util_gfal_ver)
 
+        size = self._throughputSize*1048576
         try:
-            return (self._voInfoDictionary.values()[0])['delResult']
-        except IndexError:
-            return ('UNKNOWN', 'No SRM endpoints found in internal dictionary')
-        except KeyError:
-            return ('UNKNOWN', 'No test results found in internal dictionary for SRM endpoint')
-            
-runner = probe.Runner(SRMVOMetrics, probe.ProbeFormatRenderer())
-sys.exit(runner.run(sys.argv))
+            write_test_file(self._fileThroughput, size)
+        except (IOError, OSError), e:
+            self.printd('ERROR: %s' % str(e))
+            return ('UNKNOWN', 'Error writing local file of %i MB.' % 
+                                self._throughputSize)
+
+        results = self.endpointResults('VOPutThroughput')
+        return self.throughputResult(results, 'putThroughputResult')
+
+    def metricVOGetThroughput(self):
+        "Measure the download rate from the SRM space area(s) defined by VO."
+
+        self.printd(self.lcg_util_gfal_ver)
+
+        results = self.endpointResults('VOGetThroughput')
+        return self.throughputResult(results, 'getThroughputResult')
+
+    def throughputResult(self, results, VOtest):
+        """Store the results of a throughput metric, return the weighted
+        result with the performance data of all endpoints appended."""
+        perf = []
+        for srmendpt, result in results.items():
+            (self._voInfoDictionary[srmendpt])[VOtest]=result[:2]
+            if len(result) > 2:
+                perf.extend(result[2])
+        self.saveVoResults(VOtest, ('throughputFile',))
+        status, summary = self.weightEndpointCriticality(VOtest)
+        if perf:
+            summary = summary.rstrip('\n') + ' | ' + ' '.join(perf)
+        return (status, summary)
+
+    def timedCopy(self, src_file, dest_file, srctype, dsttype, 
+                  dest_spacetokendesc='', watch=None):
+        """lcg_cp3() with nbstreams, timed.
+
+        Returns (rc, errmsg, seconds, ttfb). The copy runs in a helper
+        thread while the local file watch, if given, is polled for its
+        first byte; ttfb is the time until then, None if not watched.
+        """
+        # not adaptive, the size of the file sets the time of the copy; but
+        # within what is left of the metric's time
+        timeout = self._timeouts['srm_connect']
+        deadline = getattr(self._timingContext, 'deadline', None)
+        if deadline is not None:
+            timeout = max(1, int(math.ceil(min(timeout, deadline - time.time()))))
+        args = (src_file, dest_file, int(self.svcVer), srctype, dsttype, 
+                1, self.voName, self._throughputStreams, '', 0, 0, 
+                timeout, '', dest_spacetokendesc)
+        self.printd('lcg_cp3(): %s -> %s, %i stream(s), space token: %s' % 
+                            (src_file, dest_file, self._throughputStreams, 
+                             dest_spacetokendesc or '-'))
+        done = {}
+        metric = getattr(self._timingContext, 'metric', None)
+        endpoint = getattr(self._timingContext, 'endpoint', None)
+        def copy():
+            self._timingContext.metric = metric
+            self._timingContext.endpoint = endpoint
+            self._timingContext.deadline = deadline
+            try:
+                done['rc'] = self.session().call('lcg_cp3', *args)
+            except Exception, e:
+                done['error'] = e
+        start = time.time()
+        t = threading.Thread(target=copy)
+        t.setDaemon(True)
+        t.start()
+        ttfb = None
+        while t.isAlive():
+            if ttfb is None and watch:
+                try:
+                    if os.path.getsize(watch) > 0:
+                        ttfb = time.time() - start
+                except OSError:
+                    pass
+            t.join(0.05)
+        elapsed = time.time() - start
+        if done.has_key('error'):
+            raise done['error']
+        rc, errmsg = done['rc']
+        if watch and ttfb is None:
+            ttfb = elapsed
+        return (rc, errmsg, elapsed, ttfb)
+
+    def _throughputStatus(self, rate):
+        if self._throughputMin and rate < self._throughputMin:
+            return 'WARNING'
+        return 'OK'
+
+    def _voPutThroughputEndpoint(self, srmendpt):
+        "VOPutThroughput for a single SRM endpoint; (status, summary, perfdata)."
+
+        info = self._voInfoDictionary[srmendpt]
+        token = info.get('space_token') or srmendpt
+        # a test file left over by a run without VOGetThroughput
+        if info.has_key('throughputFile'):
+            self.printd('Removing leftover %s' % info['throughputFile'])
+            try:
+                self.session().call('lcg_del4', info['throughputFile'], int(self.svcVer), 
+                                    int(self.svcVer), 1, 1, 0, '', self.voName, '', 0, 0, 
+                                    self._timeouts['srm_connect'])
+            except Exception, e:
+                self.printd('ERROR: %s' % str(e))
+            del info['throughputFile']
+
+        dest_file = srmendpt+'/throughput-'+info['fn'].replace('.txt', '.dat')
+        size = os.path.getsize(self._fileThroughput)
+        stMsg = 'File of %i MB was%%s copied to SRM.' % (size/1048576)
+        self.print_time()
+        try:
+            rc, errmsg, elapsed, ttfb = \
+                self.timedCopy(self._fileThroughput, dest_file, 0, int(self.svcVer),
+                               info.get('space_token', ''))
+        except Exception, e:
+            self.printd('ERROR: %s' % str(e))
+            return ('UNKNOWN', stMsg % ' NOT')
+        self.print_time()
+        if rc != 0:
+            self.printd('ERROR: %s' % errmsg)
+            er = self.errorMatcher().match(errmsg)
+            if er:
+                return (er[0][2], stMsg % (' NOT')+' [ErrDB:%s]' % str(er))
+            return ('CRITICAL', stMsg % ' NOT')
+
+        info['throughputFile'] = dest_file
+        rate = size/1048576.0/max(elapsed, 0.001)
+        self.printd('%i bytes in %.2f sec: %.2f MB/s' % (size, elapsed, rate))
+        return (self._throughputStatus(rate),
+                stMsg % '' + ' %.2f MB/s in %.1f sec, %i stream(s).' % 
+                        (rate, elapsed, self._throughputStreams),
+                [perfdata(token+'_put_rate', rate),
+                 perfdata(token+'_put_time', elapsed, 's')])
+
+    def _voGetThroughputEndpoint(self, srmendpt):
+        "VOGetThroughput for a single SRM endpoint; (status, summary, perfdata)."
+
+        info = self._voInfoDictionary[srmendpt]
+        token = info.get('space_token') or srmendpt
+        if not info.has_key('throughputFile'):
+            return ('UNKNOWN', 'No file copied by VOPutThroughput.')
+        src_file = info['throughputFile']
+        local_file = '%s.%s' % (self._fileThroughput, os.path.basename(src_file))
+        stMsg = 'File was%s copied from SRM.'
+        self.print_time()
+        try:
+            try:
+                rc, errmsg, elapsed, ttfb = \
+                    self.timedCopy(src_file, 'file:'+local_file, int(self.svcVer), 0,
+                                   watch=local_file)
+            except Exception, e:
+                self.printd('ERROR: %s' % str(e))
+                return ('UNKNOWN', stMsg % ' NOT')
+            self.print_time()
+            if rc != 0:
+                self.printd('ERROR: %s' % errmsg)
+                er = self.errorMatcher().match(errmsg)
+                if er:
+                    return (er[0][2], stMsg % (' NOT')+' [ErrDB:%s]' % str(er))
+                return ('CRITICAL', stMsg % ' NOT')
+            try:
+                if not same_content(self._fileThroughput, local_file):
+                    return ('CRITICAL', stMsg % '' + ' Files differ!')
+                size = os.path.getsize(local_file)
+            except (IOError, OSError), e:
+                self.printd('compare ERROR: %s' % str(e))
+                return ('UNKNOWN', stMsg % '' + ' Unknown problem when comparing files!')
+        finally:
+            try: os.unlink(local_file)
+            except OSError: pass
+
+        # the rate of the data transfer proper, after the first byte
+        rate = size/1048576.0/max(elapsed - ttfb, 0.001)
+        self.printd('%i bytes in %.2f sec, first byte after %.2f sec: %.2f MB/s' % 
+                            (size, elapsed, ttfb, rate))
+        # a failed delete leaves the file to the next VOPutThroughput
+        try:
+            rc, errmsg = self.session().call('lcg_del4', src_file, int(self.svcVer), 
+                                             int(self.svcVer), 1, 1, 0, '', self.voName, 
+                                             '', 0, 0, self._timeouts['srm_connect'])
+        except Exception, e:
+            self.printd('ERROR deleting %s: %s' % (src_file, str(e)))
+        else:
+            if rc == 0:
+                del info['throughputFile']
+            else:
+                self.printd('ERROR deleting %s: %s' % (src_file, errmsg))
+        return (self._throughputStatus(rate),
+                stMsg % '' + ' %.2f MB/s, first byte after %.2f sec, %i stream(s).' % 
+                        (rate, ttfb, self._throughputStreams),
+                [perfdata(token+'_get_rate', rate),
+                 perfdata(token+'_get_ttfb', ttfb, 's'),
+                 perfdata(token+'_get_time', elapsed, 's')])
+
+def split_batch_args(argv):
+    """Take the batch mode options out of argv.
+
+    Returns (hosts, concurrency, argv); hosts is None if --batch-hosts was
+    not given. --batch-hosts takes a comma separated list of hostnames or
+    @file, a file with one hostname per line.
+    """
+    hosts = None
+    concurrency = 10
+    rest = []
+    args = list(argv)
+    while args:
+        arg = args.pop(0)
+        if arg in ('--batch-hosts', '--batch-concurrency') and not args:
+            raise getopt.GetoptError('%s requires an argument' % arg)
+        if arg == '--batch-hosts':
+            spec = args.pop(0)
+            if spec.startswith('@'):
+                fp = open(spec[1:], 'r')
+                try:
+                    hosts = [l.strip() for l in fp 
+                             if l.strip() and not l.strip().startswith('#')]
+                finally:
+                    fp.close()
+            else:
+                hosts = [h.strip() for h in spec.split(',') if h.strip()]
+        elif arg == '--batch-concurrency':
+            concurrency = max(1, int(args.pop(0)))
+        else:
+            rest.append(arg)
+    return hosts, concurrency, rest
+
+def host_argv(argv, host):
+    "argv for one host of a batch: any -H/-u option replaced by -H host."
+    out = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in ('-H', '--hostname', '-u', '--uri'):
+            skip = True
+        elif arg.startswith('--hostname=') or arg.startswith('--uri='):
+            pass
+        else:
+            out.append(arg)
+    return out + ['-H', host]
+
+def run_batch(runner, argv, hosts, concurrency):
+    """Run the probe for every host in a child forked from this process.
+
+    The modules are imported and the lcg_util/GFAL version is read once,
+    before forking. The output of every child is collected and written
+    in one piece when it is done. Returns the highest exit code.
+    """
+    import select
+    import traceback
+    get_lcg_util_gfal_ver()
+    try:
+        client_module('lcg_util')
+        client_module('gfal')
+    except ImportError:
+        # reported by the metrics of every host
+        pass
+    pending = list(hosts)
+    running = {}    # read end of the child's stdout -> [pid, host, output]
+    worst = 0
+    while pending or running:
+        while pending and len(running) < concurrency:
+            host = pending.pop(0)
+            r, w = os.pipe()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                os.close(r)
+                for fd in running.keys():
+                    os.close(fd)
+                os.dup2(w, 1)
+                os.close(w)
+                code = 3
+                try:
+                    try:
+                        code = runner.run(host_argv(argv, host))
+                    except SystemExit, e:
+                        code = e.code
+                        if code is not None and not isinstance(code, int):
+                            sys.stderr.write('%s\n' % code)
+                            code = 3
+                    except:
+                        traceback.print_exc()
+                finally:
+                    sys.stdout.flush()
+                    os._exit(code or 0)
+            os.close(w)
+            running[r] = [pid, host, []]
+
+        ready = select.select(running.keys(), [], [])[0]
+        for fd in ready:
+            data = os.read(fd, 65536)
+            if data:
+                running[fd][2].append(data)
+                continue
+            os.close(fd)
+            pid, host, output = running.pop(fd)
+            status = os.waitpid(pid, 0)[1]
+            if os.WIFEXITED(status):
+                code = os.WEXITSTATUS(status)
+            else:
+                code = 3
+                sys.stderr.write('%s: probe killed by signal %i\n' % 
+                                 (host, os.WTERMSIG(status)))
+            worst = max(worst, min(code, 3))
+            sys.stdout.write(''.join(output))
+            sys.stdout.flush()
+    return worst
+
+
+def main(argv):
+    "Run the probe (or a batch of it) for argv; returns the exit code."
+    runner = probe.Runner(SRMVOMetrics, probe.ProbeFormatRenderer())
+    try:
+        hosts, concurrency, argv = split_batch_args(argv)
+    except (getopt.GetoptError, IOError, ValueError), e:
+        sys.stdout.write('UNKNOWN: %s\n' % str(e))
+        return 3
+    if hosts is None:
+        return runner.run(argv)
+    return run_batch(runner, argv, hosts, concurrency)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
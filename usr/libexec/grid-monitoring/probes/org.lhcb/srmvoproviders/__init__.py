@@ -0,0 +1,31 @@
+##############################################################################
+#
+# NAME:        __init__.py
+#
+# FACILITY:    SAM (Service Availability Monitoring)
+#
+# COPYRIGHT:
+#         Copyright (c) 2009, Members of the EGEE Collaboration.
+#         http://www.eu-egee.org/partners/
+#         Licensed under the Apache License, Version 2.0.
+#         http://www.apache.org/licenses/LICENSE-2.0
+#         This software is provided "as is", without warranties
+#         or conditions of any kind, either express or implied.
+#
+# DESCRIPTION:
+#
+#         VO providers of the endpoint discovery metrics of srmvometrics.py.
+#
+##############################################################################
+
+"""
+VO providers of the endpoint discovery metrics of srmvometrics.py.
+
+Each module is imported by SRMVOMetrics.provider() only when one of its
+metrics is run, and gets the SRMVOMetrics instance as argument.
+
+cms   - GetPFNFromTFC, from the PhEDEx DataService
+atlas - GetATLASInfo, from the ATLAS ToA list
+lhcb  - GetLHCbInfo, from the LHCb ToA list
+toa   - the local index of the ToA lists, and RefreshToA
+"""
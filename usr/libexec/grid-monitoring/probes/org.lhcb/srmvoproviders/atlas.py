@@ -0,0 +1,33 @@
+##############################################################################
+#
+# NAME:        atlas.py
+#
+# FACILITY:    SAM (Service Availability Monitoring)
+#
+# COPYRIGHT:
+#         Copyright (c) 2009, Members of the EGEE Collaboration.
+#         http://www.eu-egee.org/partners/
+#         Licensed under the Apache License, Version 2.0.
+#         http://www.apache.org/licenses/LICENSE-2.0
+#         This software is provided "as is", without warranties
+#         or conditions of any kind, either express or implied.
+#
+# DESCRIPTION:
+#
+#         ATLAS endpoint discovery from the ATLAS ToA list.
+#
+##############################################################################
+
+"""
+ATLAS endpoint discovery from the ATLAS ToA list.
+"""
+
+from srmvoproviders import toa
+
+# space tokens whose failures are critical
+criticalTokens = ('ATLASDATADISK', 'ATLASMCDISK', 'ATLASGROUPDISK')
+
+
+def get_info(g):
+    "GetATLASInfo of SRMVOMetrics g."
+    return toa.discover(g, 'ATLAS', 'SAM', criticalTokens)
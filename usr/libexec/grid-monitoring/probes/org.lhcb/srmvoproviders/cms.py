@@ -0,0 +1,150 @@
+##############################################################################
+#
+# NAME:        cms.py
+#
+# FACILITY:    SAM (Service Availability Monitoring)
+#
+# COPYRIGHT:
+#         Copyright (c) 2009, Members of the EGEE Collaboration.
+#         http://www.eu-egee.org/partners/
+#         Licensed under the Apache License, Version 2.0.
+#         http://www.apache.org/licenses/LICENSE-2.0
+#         This software is provided "as is", without warranties
+#         or conditions of any kind, either express or implied.
+#
+# DESCRIPTION:
+#
+#         CMS endpoint discovery from the PhEDEx DataService.
+#
+##############################################################################
+
+"""
+CMS endpoint discovery from the PhEDEx DataService.
+"""
+
+import re
+import time
+import urllib2
+import simplejson
+
+from gridmon import utils as samutils
+
+
+def get_info(g, testLFN="/store/unmerged/SAM/testSRM"):
+    """GetPFNFromTFC of SRMVOMetrics g: full SRM endpoint(s) and storage
+    areas from PhEDEx DataService.
+    """
+
+    #URLs for PhEDEx DataService for lfn2pfn
+
+    tfcURL="http://cmsweb.cern.ch/phedex/datasvc/json/prod/lfn2pfn?node="
+    pfnMatchURL="&lfn="
+    pfnProtocolOption = "&protocol=srmv2"
+    destinationOption = "&destination="
+    custodialOption = "&custodial="
+
+    #Path of text file with list of SRM endpoints
+    seMapFileURL="http://cern.ch/magini/phedex-v2-endpoints.txt"
+    nodeName = g.hostName
+
+    # LFN path for file to test transfers
+    g.printd('The LFN used for testing will be in: '+testLFN)
+    
+    try:
+        g.printd('Retrieving list of endpoints to test at: %s' % seMapFileURL)
+        siteNameFile=urllib2.urlopen(seMapFileURL)
+    except urllib2.URLError:
+        g.printd("WARNING: unable to open URL with SRM list")
+        return('UNKNOWN',"Unable to open URL with SRM list")
+
+    outputList={}
+    for siteLine in siteNameFile.readlines():
+        endpointName=siteLine.split()[0]
+        siteName=siteLine.split()[1]
+    
+        if endpointName == nodeName:
+            
+            g.printd(nodeName+" is listed as SRM for Site "+siteName)
+            
+            # Contact web service to get PFN and spacetoken for non-custodial transfers
+            endpointLFN = "/SAM-%s" % endpointName
+
+            # Testing only non-custodial area - don't want to clutter custodial area with small files at T1s
+            custodiality = "n"
+                
+            pfnUrl = tfcURL+siteName+pfnMatchURL+testLFN+endpointLFN+pfnProtocolOption+destinationOption+siteName+custodialOption+custodiality
+            g.printd("Setting custodiality flag="+custodiality)
+            g.printd("Contacting webservice to perform LFN-to-PFN matching at URL:")
+            g.printd(pfnUrl)
+
+            try:
+                pfnFile=urllib2.urlopen(pfnUrl)
+            except urllib2.URLError:
+                g.printd('WARNING: Unable to open PhEDEx DataService lfn2pfn URL to perform LFN-to-PFN matching for Site %s' % siteName)
+                continue
+
+            pfnJSON = simplejson.load(pfnFile)
+            
+            try:
+                pfn = (((pfnJSON[u'phedex'])[u'mapping'])[0])[u'pfn']
+                spacetoken = (((pfnJSON[u'phedex'])[u'mapping'])[0])[u'space_token']
+            except KeyError:
+                try:
+                    errormsg = pfnJSON[u'error']
+                except KeyError:
+                    g.printd('WARNING: Unknown error from PhEDEx DataService')
+                    continue
+                g.printd("Error from PhEDEx DataService: ")
+                g.printd(errormsg)
+                g.printd("Possibly the site is not running a FileExport agent for the Prod instance of PhEDEx")
+                continue
+            
+            if pfn == None:
+                g.printd("ERROR: LFN did not match to any PFN - probably the TFC does not contain any rule for the srmv2 protocol.")
+                continue
+            
+            g.printd("LFN was matched to PFN "+pfn)
+            if spacetoken:
+                spacetokendesc=spacetoken
+                g.printd("In space token "+spacetoken+" for custodiality="+custodiality)
+            else:
+                spacetokendesc="nospacetoken"
+                g.printd("No space token defined for custodiality="+custodiality)
+
+            if re.compile("^srm://.+srm/managerv2\?SFN=.+$").match(pfn) or re.compile("^srm://.+srm/v2/server\?SFN=.+$").match(pfn):
+                pfntonode=re.sub(":.+$","",re.sub("^srm://","",pfn))
+                if pfntonode!=nodeName :
+                    g.printd("WARNING: the resulting PFN matches to SRM "+pfntonode+" instead of SRM "+nodeName)
+                    continue
+                else:
+                    fn = g._fileSRMPattern % (spacetokendesc,str(int(time.time())), 
+                                                 samutils.uuidstr())
+                    outputList[pfn]={'fn': fn, 'space_token': spacetoken, 'userspace' : testLFN}
+            else:
+                g.printd("WARNING: Invalid matching to srmv2 protocol")
+                g.printd("Note: this test currently supports only PFNs in the known srmv2 full endpoint formats:")
+                g.printd("srm://hostname:port/srm/managerv2?SFN=sitefilename")
+                g.printd("or")
+                g.printd("srm://hostname:port/srm/v2/server?SFN=sitefilename")
+
+    # Extract a random PFN from the dictionary of PFN matches. It will be used for testing, other PFN matches will be ignored
+    # Print warning if not all PFN matches are the same.
+    try:
+        outputPfn=outputList.popitem()
+    except KeyError:
+        g.printd("WARNING: "+nodeName+" not found in SRM list")
+        return('UNKNOWN',"WARNING: "+nodeName+" not found in SRM list")
+
+    for otherOutputPfns in outputList:
+        if otherOutputPfns != outputPfn:
+            g.printd("WARNING: PFN matching was not the same on all PhEDEx nodes associated to SRM "+nodeName)
+
+    g.printd("The PFN path used for testing will be:")
+    g.printd(str(outputPfn))
+    
+    g._voInfoDictionary[outputPfn[0]]=outputPfn[1]
+
+    g.printd('Saving endpoints to %s' % g._fileVoInfoStore, v=2)
+    g.saveVoInfoDictionary([outputPfn[0]])
+
+    return ('OK', "Got PFN and Space Token from PhEDEx DataService")
@@ -0,0 +1,33 @@
+##############################################################################
+#
+# NAME:        lhcb.py
+#
+# FACILITY:    SAM (Service Availability Monitoring)
+#
+# COPYRIGHT:
+#         Copyright (c) 2009, Members of the EGEE Collaboration.
+#         http://www.eu-egee.org/partners/
+#         Licensed under the Apache License, Version 2.0.
+#         http://www.apache.org/licenses/LICENSE-2.0
+#         This software is provided "as is", without warranties
+#         or conditions of any kind, either express or implied.
+#
+# DESCRIPTION:
+#
+#         LHCb endpoint discovery from the LHCb ToA list.
+#
+##############################################################################
+
+"""
+LHCb endpoint discovery from the LHCb ToA list.
+"""
+
+from srmvoproviders import toa
+
+# space tokens whose failures are critical
+criticalTokens = ('LHCb_USER', 'LHCb_M-DST', 'LHCb_RAW')
+
+
+def get_info(g):
+    "GetLHCbInfo of SRMVOMetrics g."
+    return toa.discover(g, 'LHCb', '/SAM', criticalTokens)
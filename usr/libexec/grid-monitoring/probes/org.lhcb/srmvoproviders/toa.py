@@ -0,0 +1,208 @@
+##############################################################################
+#
+# NAME:        toa.py
+#
+# FACILITY:    SAM (Service Availability Monitoring)
+#
+# COPYRIGHT:
+#         Copyright (c) 2009, Members of the EGEE Collaboration.
+#         http://www.eu-egee.org/partners/
+#         Licensed under the Apache License, Version 2.0.
+#         http://www.apache.org/licenses/LICENSE-2.0
+#         This software is provided "as is", without warranties
+#         or conditions of any kind, either express or implied.
+#
+# DESCRIPTION:
+#
+#         Local index of the ToA lists of the VO metrics.
+#
+##############################################################################
+
+"""
+Local index of the ToA lists of the VO metrics.
+"""
+
+import os
+import re
+import time
+import pickle
+import hashlib
+import fcntl
+import datetime
+
+from gridmon import utils as samutils
+
+
+class ToAIndex:
+    """Local index of a ToA_srm2_list file by exact SRM hostname.
+
+    The list (one 'SURL space_token ...' line per endpoint) lives on AFS.
+    It is only read again when its mtime or size changed, and the index
+    only rebuilt when its md5 changed. If the list cannot be read the last
+    good index is served and 'error' says why.
+    """
+
+    _hostRE = re.compile(r'^[a-zA-Z0-9+.-]+://([^:/?]+)')
+
+    def __init__(self, source, path):
+        self.source = source
+        self.path = path
+        self.index = None
+        self.error = None
+
+    def _read(self):
+        try:
+            fp = open(self.path, 'rb')
+            try:
+                return pickle.load(fp)
+            finally:
+                fp.close()
+        except (IOError, EOFError, ValueError, KeyError, pickle.UnpicklingError):
+            return None
+
+    def _write(self, index):
+        tmp = '%s.%i' % (self.path, os.getpid())
+        fp = open(tmp, 'wb')
+        try:
+            pickle.dump(index, fp, 2)
+        finally:
+            fp.close()
+        os.rename(tmp, self.path)
+
+    def parse(self, data):
+        "Return {hostname: [lines]} of the list."
+        hosts = {}
+        for line in data.splitlines():
+            m = self._hostRE.match(line.strip())
+            if m:
+                hosts.setdefault(m.group(1).lower(), []).append(line.strip())
+        return hosts
+
+    def refresh(self, force=False, interval=0):
+        """Bring the index up to date with the list, checked at most every
+        interval seconds unless force is given. Returns True if the index
+        was rebuilt; raises IOError if there is neither list nor index.
+        """
+        fd = os.open(self.path+'.lock', os.O_WRONLY | os.O_CREAT, 0644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            index = self._read()
+            now = time.time()
+            self.index = index
+            if index and not force and now - index['checked'] < interval:
+                return False
+            rebuilt = False
+            try:
+                st = os.stat(self.source)
+                stamp = (st.st_mtime, st.st_size)
+                if force or not index or index['stamp'] != stamp:
+                    fp = open(self.source, 'r')
+                    try:
+                        data = fp.read()
+                    finally:
+                        fp.close()
+                    md5 = hashlib.md5(data).hexdigest()
+                    if force or not index or index['md5'] != md5:
+                        index = {'md5'   : md5,
+                                 'hosts' : self.parse(data)}
+                        rebuilt = True
+                    index['stamp'] = stamp
+            except (IOError, OSError), e:
+                self.error = str(e)
+                if index is None:
+                    raise IOError(e)
+                return False
+            index['checked'] = now
+            try:
+                self._write(index)
+            except (IOError, OSError), e:
+                self.error = 'cannot write index: %s' % str(e)
+            self.index = index
+            return rebuilt
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def lookup(self, hostname):
+        "Lines of the list for hostname."
+        return self.index['hosts'].get(hostname.lower(), [])
+
+    def age(self):
+        "Seconds since the list was last read successfully."
+        return time.time() - self.index['checked']
+
+
+def index(g, vo, force=False):
+    "The local index of the ToA list of vo, checked for changes."
+    source = g._toaFile or g._toaFiles[vo]
+    index = ToAIndex(source, '%s/ToAIndex.%s' % (g.workdir_metric, vo))
+    if index.refresh(force, g._toaCheckInterval):
+        g.printd('Indexed %i host(s) of %s' % (len(index.index['hosts']), source))
+    if index.error:
+        g.printd('WARNING: %s: %s; using index of %i sec ago.' %
+                            (source, index.error, index.age()))
+    return index
+
+
+def refresh(g):
+    "RefreshToA of SRMVOMetrics g: re-read the ToA lists into the index."
+    status = 'OK'
+    summary = ''
+    for vo in sorted(g._toaFiles.keys()):
+        try:
+            voindex = index(g, vo, force=True)
+        except IOError, e:
+            status = 'CRITICAL'
+            summary += '%s: no ToA list nor index (%s); ' % (vo, str(e))
+            continue
+        if voindex.error:
+            if status == 'OK':
+                status = 'WARNING'
+            summary += '%s: serving index of %s ago (%s); ' % (vo,
+                        str(datetime.timedelta(seconds=int(voindex.age()))), 
+                        voindex.error)
+        else:
+            summary += '%s: %i host(s) indexed; ' % (vo, len(voindex.index['hosts']))
+    return (status, summary.rstrip('; '))
+
+
+def discover(g, vo, suffix, criticalTokens):
+    """Fill the VO info dictionary of SRMVOMetrics g with the endpoints of
+    the ToA list of vo for its host, keyed by SURL + suffix.
+    """
+    try:
+        entries = index(g, vo).lookup(g.hostName)
+    except IOError, e:
+        return ('UNKNOWN', 'Cannot read ToA list: %s' % str(e))
+    discovered = []
+    for entry in entries:
+        spacetokendesc = entry.split()[1]
+        fn = g._fileSRMPattern % (spacetokendesc, str(int(time.time())),
+                                  samutils.uuidstr())
+        if spacetokendesc in criticalTokens:
+            criticality = 1
+        else:
+            criticality = 0
+        #endpoint (spacetoken) criticality
+        g._voInfoDictionary[entry.split()[0]+suffix] = {
+            'fn': fn,
+            'space_token': spacetokendesc,
+            'criticality': criticality,
+        }
+        discovered.append(entry.split()[0]+suffix)
+
+    g.printd(str(entries))
+    g.printd(str(g._voInfoDictionary))
+    try:
+        fp = open(g._ldap_fileEndptSAPath, "w")
+        for entry in entries:
+            fp.write(entry.split()[0]+'\n')
+        fp.close()
+    except IOError, e:
+        try:
+            os.unlink(g._ldap_fileEndptSAPath)
+        except: pass
+        return ('UNKNOWN', 'IOError: %s' % str(e))
+
+    g.saveVoInfoDictionary(discovered)
+    return ('OK',"Endpoint informations found in ToA cached file ")